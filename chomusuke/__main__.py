@@ -1,66 +1,52 @@
 import argparse
 import asyncio
-import json
+import atexit
+import functools
 import logging
 import os
 import platform
+import queue
+import signal
 import sys
+from logging.handlers import QueueListener
 
 from .__init__ import __version__ as version
-from .bot import Chomusuke
+from .config import config_from_env, config_from_json
+from .exceptions import DatabaseUnavailable
+from .logs import JSONFormatter, LogQueueHandler, RateLimitFilter
+from .startup import StartupTimer
 
 LOGGER = logging.getLogger("chomusuke")
 
 
-def configure_logging():
+def configure_logging(worker: int = None):
     """
     Configures the logging system of the bot.
+    :param worker: The number of the worker of the cluster that is logging, if any.
     """
     # Set the logger level to INFO
     LOGGER.setLevel(logging.INFO)
     # Create a stream logger for sending messages to STDOUT
     stream = logging.StreamHandler()
     stream.setLevel(logging.INFO)
-    # Then, we need a formatter to make the messages pretty
-    formatter = logging.Formatter("[%(asctime)s] [%(levelname)s] [%(filename)s] %(message)s")
+    # Then, we need a formatter to make the messages pretty (or JSON, for log collectors)
+    if os.environ.get("LOG_FORMAT", "text") == "json":
+        formatter = JSONFormatter(worker)
+    else:
+        name = f" [worker {worker}]" if worker is not None else ""
+        formatter = logging.Formatter(f"[%(asctime)s] [%(levelname)s]{name} [%(filename)s] %(message)s")
     stream.setFormatter(formatter)
-    # Finally, add the formatter so is processed
-    LOGGER.addHandler(stream)
-
-
-def config_from_env():
-    """
-    Generates a dict with configuration values from the environment variables.
-    """
-    # Notify the user
-    LOGGER.info("Using environment variables for the configuration")
-    # Create a dictionary with the info that we need
-    output = {
-        "token": os.environ["DISCORD_TOKEN"],
-        "prefix": os.environ.get("DISCORD_PREFIX", "!"),
-        "cogs": os.environ.get("DISCORD_COGS", "").split(","),
-        "database": os.environ.get("MONGODB_URL", "")
-    }
-    # And return it
-    return output
-
-
-def config_from_json(file):
-    """
-    Generates a dict with configuration values from a JSON file.
-    """
-    # Notify the user about the loading
-    LOGGER.info("Loading configuration from %s", file)
-    # Open the file for reading
-    with open(file):
-        # Get the contents as JSON
-        output = json.load(file)
-    # If there is no token saved, notify the user and return
-    if "token" not in output:
-        LOGGER.critical("The configuration file does not contain the Discord Token")
-        sys.exit(4)
-    # If everything succeeds, return the output
-    return output
+    # The messages are written by a thread, so the event loop never waits for STDOUT
+    handler = LogQueueHandler(queue.SimpleQueue())
+    listener = QueueListener(handler.queue, stream, respect_handler_level=True)
+    listener.start()
+    # Write the messages that are still waiting before exiting
+    atexit.register(listener.stop)
+    # Drop the repeated messages, so a flood of the same event (like during a raid) is not written every time
+    handler.addFilter(RateLimitFilter(int(os.environ.get("LOG_RATE_LIMIT", 10)),
+                                      float(os.environ.get("LOG_RATE_INTERVAL", 60))))
+    # Finally, add the handler so the messages are processed
+    LOGGER.addHandler(handler)
 
 
 def parse_args():
@@ -74,14 +60,70 @@ def parse_args():
                         help="if the bot should be configured with environment variables")
     parser.add_argument("--json", dest="json", action="store",
                         help="the JSON configuration file that should be used")
+    parser.add_argument("--cluster", dest="cluster", action="store", type=int, default=0,
+                        help="the number of processes that should run the shards of the bot")
     # Finally, return the arguments
     return parser.parse_args()
 
 
+def run_bot(config: dict, timer: StartupTimer, **options):
+    """
+    Runs the bot until is closed, returning the exit code.
+    :param config: The configuration of the bot.
+    :param timer: The timer of the startup phases.
+    :param options: The other arguments of the bot, like the shards to run.
+    """
+    # Import the bot, measuring the time required for it
+    with timer.phase("imports"):
+        from .bot import Chomusuke
+
+    # Get the event loop
+    loop = asyncio.get_event_loop()
+    # Then, create a instance for the bot
+    bot = Chomusuke(config["prefix"], loop=loop, database=config["database"], config=config, **options)
+    # And save the exit code of the bot
+    code = 0
+
+    # Close the bot when the process is asked to stop, like during a restart (not available on Windows)
+    try:
+        loop.add_signal_handler(signal.SIGTERM, lambda: loop.create_task(bot.close()))
+    except NotImplementedError:
+        pass
+
+    # Notify the user that we got everything and we are starting the bot
+    LOGGER.info("Preparing the database, loading the cogs and logging in")
+
+    # Start processing everything
+    try:
+        # Load the cogs, prepare the database and log in
+        loop.run_until_complete(bot.start_up(config["token"], config.get("cogs", []), timer))
+        # And connect the bot to Discord
+        loop.run_until_complete(bot.connect())
+    except KeyboardInterrupt:
+        # After a CTRL+C or CTRL+Z, log out the bot and disconnect everything
+        loop.run_until_complete(bot.logout())
+    except DatabaseUnavailable as e:
+        # If the database is not available, log it
+        LOGGER.critical("Unable to start: %s", e.args[0])
+        code = 5
+    finally:
+        # After the bot finishes (or crashing), make sure that the shutdown finished
+        loop.run_until_complete(bot.close())
+        # Cancel the tasks that are still running
+        loop.run_until_complete(bot.shutdown.finish())
+        # And close the loop
+        loop.close()
+
+    # Finally, return the exit code
+    return code
+
+
 def main():
     """
     Executes the bot from the command line.
     """
+    # Start measuring the time required to start the bot
+    timer = StartupTimer()
     # Configure the logging system
     configure_logging()
     # And notify the user that we are starting the bot
@@ -99,7 +141,7 @@ def main():
             sys.exit(1)
 
         # Otherwise, load the configuration
-        config = config_from_env()
+        loader = config_from_env
     # If the user wants the configuration from a JSON file
     elif args.json:
         # If the JSON file does not exists
@@ -108,52 +150,29 @@ def main():
             LOGGER.critical("The configuration file %s was not found", args.json)
             sys.exit(3)
         # Otherwise, get the configuration
-        config = config_from_json(args.json)
+        loader = functools.partial(config_from_json, args.json)
     # If there is no configuration type specified
     else:
         LOGGER.critical("You need to specify what configuration system should be used")
         sys.exit(2)
 
-    # Get the event loop
-    loop = asyncio.get_event_loop()
-    # Then, create a instance for the bot
-    bot = Chomusuke(config["prefix"], loop=loop, database=config["database"])
-
-    # If there are cogs in the configuration
-    if "cogs" in config:
-        # Iterate over the cogs
-        for cog in config["cogs"]:
-            # If the cog is an empty string
-            if cog == "":
-                # Skip this iteration and continue
-                continue
-
-            # And try to import them
-            try:
-                bot.import_cog(cog)
-            # If we failed
-            except Exception:
-                LOGGER.exception(f"Error while loading %s", cog)
+    # Load the configuration
+    config = loader()
+    # If there is no token saved, notify the user and return
+    if "token" not in config:
+        LOGGER.critical("The configuration does not contain the Discord Token")
+        sys.exit(4)
 
-    # Notify the user that we got everything and we are starting the bot
-    LOGGER.info("Continuing with logging procedure")
+    # If the bot should run on multiple processes, start the supervisor of the cluster
+    if args.cluster:
+        from .cluster import Supervisor
+        code = Supervisor(config, args.cluster, loader).run()
+    # Otherwise, run the bot on this process
+    else:
+        code = run_bot(config, timer, config_loader=loader)
 
-    # Start processing everything
-    try:
-        # Log and connect the user
-        loop.run_until_complete(bot.login(config["token"]))
-        # And connect the bot to Discord
-        loop.run_until_complete(bot.connect())
-    except KeyboardInterrupt:
-        # After a CTRL+C or CTRL+Z, log out the bot and disconnect everything
-        loop.run_until_complete(bot.logout())
-    finally:
-        # After the bot finishes (or crashing), grab all tasks
-        tasks = asyncio.all_tasks(loop)
-        # Run all of the tasks until they have been completed
-        loop.run_until_complete(asyncio.gather(*tasks))
-        # After the tasks have been completed, close the loop
-        loop.close()
+    # Finally, exit with the correct code
+    sys.exit(code)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,611 @@
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import os
+import random
+import re
+import string
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import discord
+from discord.ext import commands
+
+from .bot import Chomusuke
+from .exceptions import DatabaseUnavailable
+from .index import NameIndex
+from .prefixes import PrefixResolver
+from .storage import create_storage
+from .transfer import export_data, import_data
+
+LOGGER = logging.getLogger("chomusuke")
+# The IDs of the objects created for the benchmarks
+GUILD_ID = 100000000000000000
+CHANNEL_ID = 200000000000000000
+OWNER_ID = 300000000000000000
+BOT_ID = 400000000000000000
+# The pattern used to find the users mentioned on a message
+MENTION = re.compile(r"<@!?(\d+)>")
+
+
+def user_data(user_id: int, bot: bool = False):
+    """
+    Creates the gateway payload of a user.
+    """
+    return {"id": str(user_id), "username": f"user{user_id % 100000}", "discriminator": "0001", "avatar": None,
+            "bot": bot}
+
+
+def percentile(values, percent: float):
+    """
+    Gets the percentile of a sorted list of values.
+    """
+    if not values:
+        return 0
+    return values[min(int(len(values) * percent / 100), len(values) - 1)]
+
+
+class FakeHTTP:
+    """
+    Replaces the Discord REST API, returning the payloads that Discord would send back.
+    """
+    def __init__(self):
+        self.next_id = 500000000000000000
+        # The messages sent as (time, channel ID, content)
+        self.sent = []
+
+    def _message(self, channel_id, content, embed=None):
+        self.next_id += 1
+        return {"id": str(self.next_id), "channel_id": str(channel_id), "type": 0, "content": content or "",
+                "author": user_data(BOT_ID, True), "attachments": [], "embeds": [embed] if embed else [],
+                "mentions": [], "mention_roles": [], "pinned": False, "mention_everyone": False, "tts": False,
+                "timestamp": datetime.now(timezone.utc).isoformat(), "edited_timestamp": None}
+
+    async def send_message(self, channel_id, content, *, tts=False, embed=None, nonce=None, allowed_mentions=None):
+        self.sent.append((time.perf_counter(), channel_id, content))
+        return self._message(channel_id, content, embed)
+
+    async def edit_message(self, channel_id, message_id, **fields):
+        return self._message(channel_id, fields.get("content", None), fields.get("embed", None))
+
+    async def add_reaction(self, channel_id, message_id, emoji):
+        pass
+
+    async def remove_reaction(self, channel_id, message_id, emoji, member_id):
+        pass
+
+    async def clear_reactions(self, channel_id, message_id):
+        pass
+
+    async def close(self):
+        pass
+
+
+class Harness:
+    """
+    A bot connected to a fake gateway and REST API, with a single guild.
+    """
+    def __init__(self, loop, config: dict):
+        # Create the bot without a connection to Discord
+        self.bot = Chomusuke("!", loop=loop, config=config)
+        self.state = self.bot._connection
+        self.http = self.bot.http = self.state.http = FakeHTTP()
+        # Create the user of the bot
+        self.state.user = discord.ClientUser(state=self.state, data=user_data(BOT_ID, True))
+        # And the guild with the owner as the only member
+        self.guild = self.state._add_guild_from_data({
+            "id": str(GUILD_ID), "name": "Benchmark", "owner_id": str(OWNER_ID), "member_count": 1,
+            "roles": [{"id": str(GUILD_ID), "name": "@everyone", "permissions": 104324673, "position": 0}],
+            "channels": [{"id": str(CHANNEL_ID), "type": 0, "name": "general", "position": 0}],
+            "members": [{"user": user_data(OWNER_ID), "roles": [], "joined_at": None, "deaf": False,
+                         "mute": False}]
+        })
+        self.channel = self.guild.get_channel(CHANNEL_ID)
+        self.next_id = 600000000000000000
+
+    async def prepare(self, tags: int):
+        """
+        Loads the cogs and adds the tags and welcome settings.
+        """
+        # Prepare the storage
+        await self.bot.storage.connect()
+        # Load the cogs
+        for cog in ("chomusuke.cogs.basics:Basics", "chomusuke.cogs.tags:Tags", "chomusuke.cogs.welcome:Welcome"):
+            self.bot.import_cog(cog)
+
+        # Add the tags
+        now = datetime.now(timezone.utc)
+        for number in range(tags):
+            await self.bot.storage.tags.create({"guild_id": GUILD_ID, "name": f"tag{number}",
+                                                "content": f"The content of the tag number {number}",
+                                                "author": OWNER_ID, "discriminator": "owner#0001", "created": now,
+                                                "edited": None, "usage": None})
+        # Enable the welcome messages
+        await self.bot.storage.welcome.update(GUILD_ID, {"enabled": True, "msg": "Welcome to the guild!",
+                                                         "channel": CHANNEL_ID})
+        # And tell the cogs that the bot is ready
+        await self.dispatch("on_ready")
+
+    async def dispatch(self, event: str, *args):
+        """
+        Runs the listeners of the cogs for an event and waits until they finish.
+        """
+        await asyncio.gather(*[listener(*args) for listener in self.bot.extra_events.get(event, [])])
+
+    def create_message(self, content: str):
+        """
+        Creates a message from the guild owner.
+        """
+        self.next_id += 1
+        data = {"id": str(self.next_id), "channel_id": str(CHANNEL_ID), "guild_id": str(GUILD_ID), "type": 0,
+                "content": content, "author": user_data(OWNER_ID), "attachments": [], "embeds": [], "mentions": [],
+                "mention_roles": [], "pinned": False, "mention_everyone": False, "tts": False,
+                "timestamp": datetime.now(timezone.utc).isoformat(), "edited_timestamp": None}
+        return discord.Message(state=self.state, channel=self.channel, data=data)
+
+    async def message(self, content: str):
+        """
+        Sends a message from the guild owner through the command processing of the bot.
+        """
+        await self.bot.process_commands(self.create_message(content))
+
+    async def join(self):
+        """
+        Adds a new member to the guild and runs the join listeners.
+
+        Returns the ID of the new member.
+        """
+        self.next_id += 1
+        member = discord.Member(data={"user": user_data(self.next_id), "roles": [], "joined_at": None},
+                                guild=self.guild, state=self.state)
+        self.guild._add_member(member)
+        await self.dispatch("on_member_join", member)
+        return self.next_id
+
+
+class Faults:
+    """
+    The problems of the stand-in database used by the outage workload.
+    """
+    def __init__(self):
+        # The seconds added to every operation, and if the operations fail like when the server is down
+        self.latency = 0
+        self.failing = False
+
+
+class FaultyStorage:
+    """
+    A stand-in for a database server that becomes slow or unreachable, wrapping the storage of a collection.
+    """
+    def __init__(self, target, faults: Faults):
+        self._target = target
+        self._faults = faults
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if not asyncio.iscoroutinefunction(value):
+            return value
+
+        async def faulty(*args, **kwargs):
+            if self._faults.latency:
+                await asyncio.sleep(self._faults.latency)
+            if self._faults.failing:
+                raise ConnectionError("The database is not available")
+            return await value(*args, **kwargs)
+
+        return faulty
+
+
+def synthetic(workload: str, events: int, tags: int):
+    """
+    Generates a stream of events for a workload.
+    """
+    for number in range(events):
+        # Select the type of event
+        if workload == "mixed":
+            kind = random.choice(("tag", "tag", "tag", "miss", "about", "info", "join"))
+        else:
+            kind = workload
+        # And create it
+        if kind == "tag":
+            yield {"type": "message", "content": f"!tag tag{random.randrange(tags)}"}
+        elif kind == "miss":
+            yield {"type": "message", "content": f"!tag tga{random.randrange(tags)}"}
+        elif kind == "info":
+            yield {"type": "message", "content": f"!tag about tag{random.randrange(tags)}"}
+        elif kind == "about":
+            yield {"type": "message", "content": "!about"}
+        elif kind == "join":
+            yield {"type": "join"}
+
+
+def replay(path: str):
+    """
+    Reads a stream of events from a NDJSON file, like {"type": "message", "content": "!tag hello"}.
+    """
+    with open(path) as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+async def run_events(harness: Harness, events, rate: float = 0):
+    """
+    Sends the events to the bot and measures the time taken by every one of them.
+    """
+    latencies = []
+    joins = {}
+    interval = 1 / rate if rate else 0
+    tasks = []
+    start = time.perf_counter()
+
+    async def handle(event):
+        begin = time.perf_counter()
+        if event["type"] == "message":
+            await harness.message(event["content"])
+        elif event["type"] == "join":
+            joins[await harness.join()] = begin
+        latencies.append(time.perf_counter() - begin)
+
+    for number, event in enumerate(events):
+        # If there is a rate, send the events at the same time as they would arrive from the gateway
+        if interval:
+            delay = start + number * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(harness.bot.loop.create_task(handle(event)))
+        # Otherwise, send them one after the other
+        else:
+            await handle(event)
+    # Wait for the events that are still running
+    await asyncio.gather(*tasks)
+    return latencies, joins, time.perf_counter() - start
+
+
+async def run(args):
+    """
+    Runs the benchmark of the bot with the command line arguments.
+    """
+    # Create the bot
+    config = {"storage": args.storage, "sqlite": args.sqlite, "welcome_window": args.window,
+              "welcome_max_delay": args.max_delay, "welcome_batch": args.batch}
+    harness = Harness(asyncio.get_event_loop(), config)
+    await harness.prepare(args.tags)
+
+    # Select the events to send
+    events = replay(args.replay) if args.replay else synthetic(args.workload, args.events, args.tags)
+
+    # Start tracing the memory, if requested
+    if args.allocations:
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+    # Send the events
+    latencies, joins, elapsed = await run_events(harness, events, args.rate)
+    # Wait for the grouped welcome messages
+    if args.window:
+        await asyncio.sleep(args.max_delay + 0.1)
+
+    # Calculate the results
+    latencies.sort()
+    results = {
+        "workload": args.replay or args.workload,
+        "storage": args.storage,
+        "events": len(latencies),
+        "seconds": elapsed,
+        "events_per_second": len(latencies) / elapsed if elapsed else 0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "messages_sent": len(harness.http.sent)
+    }
+
+    # If there were joins, calculate the time until the member was mentioned
+    if joins:
+        delays = sorted(sent - joins[int(user)] for sent, _, content in harness.http.sent
+                        for user in MENTION.findall(content or "") if int(user) in joins)
+        results["join_delay_p50_ms"] = percentile(delays, 50) * 1000
+        results["join_delay_p99_ms"] = percentile(delays, 99) * 1000
+
+    # If the memory was traced, add the allocations
+    if args.allocations:
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+        results["peak_traced_kib"] = peak / 1024
+        results["net_blocks_per_event"] = blocks / len(latencies) if latencies else 0
+
+    # Close the bot
+    await harness.bot.close()
+    return results
+
+
+def run_index(args):
+    """
+    Measures the tag name index with a large number of names.
+    """
+    # Create random names for the tags
+    names = {"".join(random.choices(string.ascii_lowercase + "-", k=random.randint(4, 16))) for _ in range(args.tags)}
+    queries = random.sample(sorted(names), min(len(names), 1000))
+
+    # Measure the time required to build the index
+    start = time.perf_counter()
+    index = NameIndex(names)
+    build = time.perf_counter() - start
+
+    # Then, the prefix completions
+    start = time.perf_counter()
+    for query in queries:
+        index.complete(query[:2])
+    complete = (time.perf_counter() - start) / len(queries)
+
+    # And the suggestions for names with a typo
+    start = time.perf_counter()
+    for query in queries:
+        index.suggest(query[:-1] + "q")
+    suggest = (time.perf_counter() - start) / len(queries)
+
+    return {"workload": "index", "names": len(names), "build_ms": build * 1000, "complete_us": complete * 1000000,
+            "suggest_us": suggest * 1000000}
+
+
+async def check_breaker(bot, faults: Faults, timeout: float):
+    """
+    Checks that the storage is not used while the breaker is open and that it closes again, even if the operation
+    trying the storage is cancelled.
+
+    Returns the checks as name -> if it passed.
+    """
+    checks = {}
+    tags = bot.storage.tags
+    # Read a tag while the storage works, so its result is saved
+    faults.latency, faults.failing = 0, False
+    expected = await tags.get(GUILD_ID, "tag0")
+    # Make the storage hang until the breaker opens
+    faults.latency = 60
+    while bot.breaker.closed:
+        await tags.get(GUILD_ID, "tag0")
+
+    # With the breaker open, the reads use the saved results and the writes fail, without waiting for the storage
+    start = time.perf_counter()
+    checks["stale_reads"] = await tags.get(GUILD_ID, "tag0") == expected
+    try:
+        await tags.update(GUILD_ID, "tag0", {"content": "Changed during the outage"})
+        checks["writes_rejected"] = False
+    except DatabaseUnavailable:
+        checks["writes_rejected"] = True
+    checks["fails_fast"] = time.perf_counter() - start < timeout / 2
+
+    # Let an operation try the storage again and cancel it before the storage responds
+    await asyncio.sleep(bot.breaker.reset_timeout)
+    probe = asyncio.ensure_future(tags.get(GUILD_ID, "tag0"))
+    await asyncio.sleep(timeout / 4)
+    probe.cancel()
+    try:
+        await probe
+    except asyncio.CancelledError:
+        pass
+    # And check that the next operation still reaches the storage once it works again
+    faults.latency = 0
+    try:
+        await tags.get(GUILD_ID, "tag1")
+    except DatabaseUnavailable:
+        pass
+    checks["closes_after_cancelled_probe"] = bot.breaker.closed
+    return checks
+
+
+async def run_outage(args):
+    """
+    Measures the commands while the storage works, becomes slow, stops responding and recovers.
+    """
+    # Create the bot with a small tag cache, so most of the reads reach the storage
+    config = {"storage": "memory", "tag_cache_size": 16, "storage_timeout": args.storage_timeout,
+              "breaker_threshold": 5, "breaker_reset": 1}
+    harness = Harness(asyncio.get_event_loop(), config)
+    await harness.prepare(args.tags)
+    bot = harness.bot
+    # Put the stand-in database between the storage and the guard
+    # (the storage is wrapped as scheduler -> guard -> metrics)
+    faults = Faults()
+    for collection in (bot.storage.tags, bot.storage.welcome):
+        guarded = collection._target
+        guarded._target._target = FaultyStorage(guarded._target._target, faults)
+    # The stand-in fails with ConnectionError, like the drivers when the server is down
+    bot.storage_guard.errors += (ConnectionError,)
+
+    phases = (("healthy", 0, False), ("slow", args.fault_latency, False), ("down", 0, True), ("recovered", 0, False))
+    results = {"workload": "outage", "storage_timeout": args.storage_timeout}
+    count = args.events // len(phases)
+    for name, latency, failing in phases:
+        faults.latency = latency
+        faults.failing = failing
+        # Read tags (most of them seen before) and change some of them
+        events = [{"type": "message", "content": f"!tag usage tag{random.randrange(args.tags)} text"}
+                  if random.random() < 0.2 else {"type": "message", "content": f"!tag tag{random.randrange(args.tags)}"}
+                  for _ in range(count)]
+        stale, rejected, sent = bot.storage_guard.stale, bot.storage_guard.rejected, len(harness.http.sent)
+        latencies, _, elapsed = await run_events(harness, events, args.rate or 500)
+        latencies.sort()
+        replies = sum(1 for _, _, content in harness.http.sent[sent:] if "database is not available" in (content or ""))
+        results[f"{name}_p50_ms"] = percentile(latencies, 50) * 1000
+        results[f"{name}_p99_ms"] = percentile(latencies, 99) * 1000
+        results[f"{name}_stale"] = bot.storage_guard.stale - stale
+        results[f"{name}_rejected"] = bot.storage_guard.rejected - rejected
+        results[f"{name}_unavailable_replies"] = replies
+        # Wait until the breaker tries the storage again before the next phase
+        await asyncio.sleep(bot.breaker.reset_timeout)
+    results["breaker_trips"] = bot.breaker.trips
+
+    # Check that the commands failed fast and used the old results while the storage was down, and that the storage
+    # was used again after it recovered
+    checks = {
+        "down_fails_fast": results["down_p99_ms"] < args.storage_timeout * 1000,
+        "down_stale_reads": results["down_stale"] > 0,
+        "recovered": bot.breaker.closed and not results["recovered_rejected"]
+    }
+    checks.update(await check_breaker(bot, faults, args.storage_timeout))
+    results["failed_checks"] = [name for name, passed in checks.items() if not passed]
+
+    faults.latency = 0
+    faults.failing = False
+    await bot.close()
+    return results
+
+
+async def run_prefix(args):
+    """
+    Measures the prefix resolver with many guilds using custom prefixes, and the messages processed by the bot.
+    """
+    # Give a custom prefix to half of the guilds
+    prefixes = ("?", "$", "c!", ">>", ".")
+    resolver = PrefixResolver("!")
+    resolver.load({GUILD_ID + number: random.choice(prefixes) for number in range(0, args.guilds, 2)})
+    guilds = [SimpleNamespace(id=GUILD_ID + number) for number in range(args.guilds)]
+    # Create the messages of the users, most of them normal text and the rest commands
+    words = ("hello", "what", "is", "this", "bot", "doing", "lol", "ok", "nice", "thanks", "the", "tag", "?")
+    chat = [SimpleNamespace(content=" ".join(random.choices(words, k=random.randint(1, 12))),
+                            guild=random.choice(guilds)) for _ in range(args.events)]
+    invocations = []
+    for _ in range(args.events):
+        guild = random.choice(guilds)
+        invocations.append(SimpleNamespace(content=f"{resolver.get(guild.id)}tag hello", guild=guild))
+
+    def measure(function, messages):
+        start = time.perf_counter()
+        for message in messages:
+            function(message)
+        return len(messages) / (time.perf_counter() - start)
+
+    results = {"workload": "prefix", "guilds": args.guilds, "custom_prefixes": len(resolver),
+               "rejected_per_second": measure(resolver.matches, chat),
+               "matched_per_second": measure(resolver.matches, invocations),
+               "resolved_per_second": measure(lambda message: resolver(None, message), invocations)}
+
+    # Then, send normal text through the bot, with and without rejecting it before creating a context
+    harness = Harness(asyncio.get_event_loop(), {"storage": "memory"})
+    await harness.prepare(10)
+    messages = [harness.create_message(message.content) for message in chat]
+    unfiltered = functools.partial(commands.Bot.process_commands, harness.bot)
+    for name, function in (("bot_text", harness.bot.process_commands), ("bot_text_unfiltered", unfiltered)):
+        start = time.perf_counter()
+        for message in messages:
+            await function(message)
+        results[f"{name}_per_second"] = len(messages) / (time.perf_counter() - start)
+    await harness.bot.close()
+    return results
+
+
+async def run_transfer(args):
+    """
+    Measures the throughput of exporting and importing the tags as NDJSON.
+    """
+    config = {"database": args.database, "sqlite": args.sqlite}
+    source = create_storage(args.storage, config)
+    await source.connect()
+    # Create the tags on the source, split on a few guilds
+    now = datetime.now(timezone.utc)
+    items = [{"guild_id": GUILD_ID + number % 10, "name": f"tag{number}", "content": f"The content of the tag {number}",
+              "author": OWNER_ID, "discriminator": "owner#0001", "created": now, "edited": None, "usage": None,
+              "uses": 0, "last_used": None} for number in range(args.tags)]
+    for index in range(0, len(items), args.transfer_batch):
+        await source.tags.insert_many(items[index:index + args.transfer_batch], True)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "tags.ndjson")
+        # Export the tags
+        start = time.perf_counter()
+        with open(path, "w", encoding="utf-8") as file:
+            exported = await export_data(source, file, batch=args.transfer_batch)
+        export_time = time.perf_counter() - start
+        await source.close()
+
+        # And import them into an empty storage
+        if args.storage == "sqlite":
+            config["sqlite"] = os.path.join(directory, "import.db") if args.sqlite != ":memory:" else ":memory:"
+        target = create_storage(args.storage, config)
+        await target.connect()
+        start = time.perf_counter()
+        with open(path, encoding="utf-8") as file:
+            imported = await import_data(target, file, batch=args.transfer_batch, replace=True)
+        import_time = time.perf_counter() - start
+        size = os.path.getsize(path)
+        await target.close()
+
+    return {"workload": "transfer", "storage": args.storage, "documents": exported["tag"],
+            "batch": args.transfer_batch, "file_kib": size / 1024, "export_seconds": export_time,
+            "export_per_second": exported["tag"] / export_time if export_time else 0,
+            "import_seconds": import_time, "imported": imported["saved"],
+            "import_per_second": imported["read"] / import_time if import_time else 0}
+
+
+def parse_args():
+    """
+    Parses the command line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Measures the performance of Chomusuke without Discord.")
+    parser.add_argument("--workload", choices=("mixed", "tag", "miss", "info", "about", "join", "index", "transfer",
+                                               "outage", "prefix"),
+                        default="mixed", help="the type of events to generate")
+    parser.add_argument("--replay", help="a NDJSON file with the events to send instead of generating them")
+    parser.add_argument("--events", type=int, default=10000, help="the number of events to generate")
+    parser.add_argument("--tags", type=int, default=1000, help="the number of tags on the guild")
+    parser.add_argument("--guilds", type=int, default=10000, help="the number of guilds on the prefix workload")
+    parser.add_argument("--rate", type=float, default=0,
+                        help="the events per second to send, or 0 to send them one after the other")
+    parser.add_argument("--storage", choices=("memory", "sqlite", "mongo"), default="memory",
+                        help="the storage to use (mongo is only available for the transfer workload)")
+    parser.add_argument("--database", default="mongodb://localhost:27017",
+                        help="the URL of the MongoDB server for the transfer workload")
+    parser.add_argument("--transfer-batch", dest="transfer_batch", type=int, default=500,
+                        help="the documents read or saved at once on the transfer workload")
+    parser.add_argument("--storage-timeout", dest="storage_timeout", type=float, default=0.2,
+                        help="the seconds that a storage operation can take on the outage workload")
+    parser.add_argument("--fault-latency", dest="fault_latency", type=float, default=30,
+                        help="the seconds added to the storage operations on the slow phase of the outage workload")
+    parser.add_argument("--sqlite", default=":memory:", help="the SQLite database file")
+    parser.add_argument("--window", type=float, default=0, help="the seconds to group the welcome messages")
+    parser.add_argument("--max-delay", dest="max_delay", type=float, default=5,
+                        help="the maximum seconds to delay a grouped welcome message")
+    parser.add_argument("--batch", type=int, default=25, help="the maximum members on a welcome message")
+    parser.add_argument("--allocations", action="store_true", help="if the memory allocations should be traced")
+    parser.add_argument("--json", action="store_true", help="if the results should be printed as JSON")
+    return parser.parse_args()
+
+
+def main():
+    """
+    Runs the benchmarks from the command line.
+    """
+    args = parse_args()
+
+    # Run the selected benchmark
+    if args.workload == "index":
+        results = run_index(args)
+    elif args.workload == "transfer":
+        results = asyncio.get_event_loop().run_until_complete(run_transfer(args))
+    elif args.workload == "prefix":
+        results = asyncio.get_event_loop().run_until_complete(run_prefix(args))
+    elif args.workload == "outage":
+        results = asyncio.get_event_loop().run_until_complete(run_outage(args))
+    else:
+        results = asyncio.get_event_loop().run_until_complete(run(args))
+
+    # And print the results
+    if args.json:
+        print(json.dumps(results))
+    else:
+        for key, value in results.items():
+            print(f"{key}: {value:.3f}" if isinstance(value, float) else f"{key}: {value}")
+    # And fail if the workload checks something that did not work
+    if results.get("failed_checks"):
+        sys.exit(f"Failed checks: {', '.join(results['failed_checks'])}")
+
+
+if __name__ == "__main__":
+    main()
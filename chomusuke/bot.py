@@ -1,11 +1,30 @@
+import asyncio
 import importlib
 import inspect
 import logging
+import time
 
-from discord.ext.commands import AutoShardedBot
-from motor.motor_asyncio import AsyncIOMotorClient
+from discord.ext.commands import AutoShardedBot, CommandInvokeError
+
+from .breaker import CircuitBreaker, GuardedStorage, StorageGuard
+from .exceptions import DatabaseUnavailable, Overloaded
+from .members import MemberLookup, member_options
+from .metrics import InstrumentedStorage, MetricsServer, Registry
+from .outbound import OutboundContext, OutboundDispatcher
+from .prefixes import PrefixResolver
+from .scheduler import CURRENT_GUILD, FairScheduler, ScheduledStorage
+from .shutdown import ShutdownCoordinator
+from .startup import StartupTimer
+from .storage import create_storage
 
 LOGGER = logging.getLogger("chomusuke")
+# The configuration values that are only read when the bot starts
+RESTART_KEYS = ("token", "cogs", "database", "storage", "database_timeout", "sqlite", "global_concurrency",
+                "guild_concurrency", "command_queue", "command_queue_timeout", "outbound_deadline", "metrics_port",
+                "metrics_host", "member_cache", "member_chunking", "shard_count", "identify_concurrency",
+                "restart_backoff", "restart_max_backoff", "storage_timeout", "storage_timeouts", "breaker_threshold",
+                "breaker_reset", "storage_snapshot_size", "storage_snapshot_ttl", "outbound_drain",
+                "shutdown_deadlines")
 
 
 class Chomusuke(AutoShardedBot):
@@ -18,35 +37,143 @@ class Chomusuke(AutoShardedBot):
         """
         # Try to get the settings for the web server
         db = kwargs.pop("database", "")
+        # And save the rest of the configuration, so the cogs can use it
+        self.config = kwargs.pop("config", {})
+        if db:
+            self.config["database"] = db
+        # Save the information of the cluster, if the bot is running as a worker
+        self.cluster = kwargs.pop("cluster", None)
+        # The function that reads the configuration again, if any
+        self.config_loader = kwargs.pop("config_loader", None)
+        # The cogs loaded as "package:class" -> name of the cog
+        self.cog_specs = {}
+
+        # Configure the cache of the members, unless the options were specified by hand
+        self.member_cache = self.config.get("member_cache", "full")
+        self.member_chunking = self.config.get("member_chunking", "startup")
+        for key, value in member_options(self.member_cache, self.member_chunking).items():
+            kwargs.setdefault(key, value)
 
         # Call the default Bot init
         super().__init__(*args, **kwargs)
+        # Resolve the prefix of every guild from memory, using the prefix of the config as the default one
+        self.prefixes = PrefixResolver(self.command_prefix)
+        self.command_prefix = self.prefixes
 
-        # If the user wants a MongoDB instance
-        if db:
-            # Notify the user that the database is being initialized
-            LOGGER.info("Initializing MongoDB instance")
-            # Create the Motor/MongoDB instance
-            self.mongo = AsyncIOMotorClient(db)
-            # Make sure that the the database is valid by calling a simple command
-            self.mongo.admin.command("ismaster")
-            # And save the bot database
-            self.db = self.mongo.chomusuke
+        # Warn the user if the member events are not going to be received
+        if not kwargs["guild_subscriptions"]:
+            LOGGER.warning("The member cache is disabled, so the member events (like welcome messages) are too")
+        # Create the lookup of the members that are not cached
+        self.member_lookup = MemberLookup(self.config.get("member_lookup_size", 1024),
+                                          self.config.get("member_lookup_ttl", 300))
+        # And the task that requests the members after ready, if any
+        self.chunker = None
+
+        # Select the storage backend, with MongoDB as the default when there is a database URL
+        backend = self.config.get("storage", "") or ("mongo" if self.config.get("database", "") else "")
+
+        # If the user wants to store data
+        if backend:
+            # Notify the user that the storage is being initialized
+            LOGGER.info("Initializing %s storage", backend)
+            # And create it
+            self.storage = create_storage(backend, self.config)
         # Otherwise
         else:
             # Tell the user that there is no database available
-            LOGGER.warning("The MongoDB instance is disabled")
+            LOGGER.warning("The storage is disabled")
             LOGGER.warning("Cogs that require storing any type of data might not work")
-            # And set the database to nothing
-            self.mongo = None
-            self.db = None
+            # And set the storage to nothing
+            self.storage = None
 
-    def import_cog(self, name: str):
+        # The timer used to measure the startup, replaced by start_up()
+        self.timer = StartupTimer()
+
+        # Create the metrics of the commands and the gateway
+        self.metrics = Registry()
+        self.command_latency = self.metrics.histogram("chomusuke_command_seconds", "Time taken by the commands",
+                                                      ["command", "status"])
+        self.command_errors = self.metrics.counter("chomusuke_command_errors_total", "Errors raised by the commands",
+                                                   ["command", "error"])
+        self.metrics.gauge("chomusuke_gateway_latency_seconds", "Latency of the gateway connection of every shard",
+                           ["shard"], lambda: {(str(shard),): latency for shard, latency in self.latencies})
+        # The circuit breaker of the storage and the guard of the operations, if there is a storage
+        self.breaker = None
+        self.storage_guard = None
+        # If there is a storage, measure the operations of it
+        if self.storage:
+            latency = self.metrics.histogram("chomusuke_storage_seconds", "Time taken by the storage operations",
+                                             ["collection", "operation"])
+            errors = self.metrics.counter("chomusuke_storage_errors_total", "Errors raised by the storage operations",
+                                          ["collection", "operation", "error"])
+            self.storage.tags = InstrumentedStorage(self.storage.tags, "tags", latency, errors)
+            self.storage.welcome = InstrumentedStorage(self.storage.welcome, "welcome", latency, errors)
+            self.storage.prefixes = InstrumentedStorage(self.storage.prefixes, "prefixes", latency, errors)
+            # And stop waiting for the storage when is not available, using the last results of the reads
+            self.breaker = CircuitBreaker(self.config.get("breaker_threshold", 5), self.config.get("breaker_reset", 30))
+            self.storage_guard = StorageGuard(self.breaker, self.config.get("storage_timeout", 5),
+                                              self.config.get("storage_timeouts", {}), self.storage.unavailable_errors,
+                                              self.config.get("storage_snapshot_size", 4096),
+                                              self.config.get("storage_snapshot_ttl", 86400))
+            self.storage.tags = GuardedStorage(self.storage.tags, "tags", self.storage_guard)
+            self.storage.welcome = GuardedStorage(self.storage.welcome, "welcome", self.storage_guard)
+            self.storage.prefixes = GuardedStorage(self.storage.prefixes, "prefixes", self.storage_guard)
+            self.metrics.gauge("chomusuke_storage_available", "If the circuit breaker of the storage is closed", (),
+                               lambda: {(): int(self.breaker.closed)})
+            self.metrics.counter("chomusuke_storage_trips_total", "Times that the circuit breaker was opened", (),
+                                 lambda: {(): self.breaker.trips})
+            self.metrics.counter("chomusuke_storage_stale_total", "Reads answered with old results", (),
+                                 lambda: {(): self.storage_guard.stale})
+            self.metrics.counter("chomusuke_storage_rejected_total", "Operations that failed because the storage was "
+                                 "not available", (), lambda: {(): self.storage_guard.rejected})
+        # Create the scheduler that limits the storage operations of the commands
+        self.scheduler = FairScheduler(self.config.get("global_concurrency", 50),
+                                       self.config.get("guild_concurrency", 4),
+                                       self.config.get("command_queue", 100),
+                                       self.config.get("command_queue_timeout", 10))
+        # The last time that a guild was told that the bot is busy
+        self.busy_replies = {}
+        self.command_wait = self.metrics.histogram("chomusuke_command_wait_seconds",
+                                                   "Time waited by the storage operations of the commands")
+        self.metrics.gauge("chomusuke_commands_running", "Storage operations of the commands that are running", (),
+                           lambda: {(): self.scheduler.running})
+        self.metrics.gauge("chomusuke_commands_waiting", "Storage operations of the commands waiting for a slot", (),
+                           lambda: {(): self.scheduler.waiting})
+        self.metrics.counter("chomusuke_commands_rejected_total", "Commands rejected because the bot was busy", (),
+                             lambda: {(): self.scheduler.rejected})
+        # And make the operations wait for a slot before reaching the guard (so the wait is not part of the timeout)
+        if self.storage:
+            self.storage.tags = ScheduledStorage(self.storage.tags, self.scheduler, self.command_wait)
+            self.storage.welcome = ScheduledStorage(self.storage.welcome, self.scheduler, self.command_wait)
+            self.storage.prefixes = ScheduledStorage(self.storage.prefixes, self.scheduler, self.command_wait)
+        # Create the dispatcher that sends the messages of the bot
+        self.outbound = OutboundDispatcher(self.loop, self.metrics, self.config.get("outbound_deadline", 60))
+        # The tasks of the commands that are running, so the shutdown can wait for them
+        self.handlers = set()
+        # And the phases used to close the bot, in order
+        deadlines = {"outbound": self.config.get("outbound_drain", 5)}
+        deadlines.update(self.config.get("shutdown_deadlines", {}))
+        self.shutdown = ShutdownCoordinator(self.loop, deadlines)
+        self.shutdown.add("commands", self.wait_for_commands)
+        self.shutdown.add("cogs", self.flush_cogs)
+        self.shutdown.add("outbound", self.outbound.drain)
+        self.shutdown.add("gateway", self.close_gateway)
+        self.shutdown.add("storage", self.close_storage)
+        # And create the server for the metrics, if enabled
+        port = self.config.get("metrics_port", 0)
+        self.metrics_server = MetricsServer(self.metrics, self.config.get("metrics_host", "127.0.0.1"),
+                                            port) if port else None
+
+        # Save the MongoDB client and database, if they are being used
+        self.mongo = getattr(self.storage, "client", None)
+        self.db = getattr(self.storage, "db", None)
+
+    def resolve_cog(self, name: str, reload: bool = False):
         """
-        Imports a cog with importlib and adds it to a.
+        Imports the module of a cog and returns the class of it.
+        :param name: The module and class of the cog as "package:class".
+        :param reload: If the module should be executed again, to get the changes made since it was imported.
         """
-        # Notify that we are attempting to import the cog
-        LOGGER.info('Loading the cog "%s"', name)
         # Split the name sent
         split = name.split(":")
 
@@ -56,6 +183,9 @@ class Chomusuke(AutoShardedBot):
 
         # At this point, we guess that the input is correct
         imported = importlib.import_module(split[0])
+        # If requested, execute the module again
+        if reload:
+            imported = importlib.reload(imported)
 
         # If the imported library does not has a library with the specified attribute
         if not hasattr(imported, split[1]):
@@ -66,8 +196,299 @@ class Chomusuke(AutoShardedBot):
         if not inspect.isclass(cog):
             raise TypeError(f"{name} is not a class")
 
-        # If we got here, call add_cog
-        self.add_cog(cog(self))
+        # If we got here, return the class
+        return cog
+
+    def import_cog(self, name: str):
+        """
+        Imports a cog with importlib and adds it to a.
+        """
+        # Notify that we are attempting to import the cog
+        LOGGER.info('Loading the cog "%s"', name)
+        # Import the cog and add it
+        self.add_spec(name, self.resolve_cog(name)(self))
+
+    def add_spec(self, spec: str, cog):
+        """
+        Adds a cog, remembering the module and class where it came from.
+        """
+        self.add_cog(cog)
+        self.cog_specs[spec] = cog.qualified_name
+
+    def find_spec(self, name: str):
+        """
+        Gets the "package:class" of a loaded cog from their name or the "package:class" itself.
+        """
+        if name in self.cog_specs:
+            return name
+        for spec, cog_name in self.cog_specs.items():
+            if cog_name.lower() == name.lower():
+                return spec
+        raise KeyError(f"The cog {name} is not loaded")
+
+    async def unload_cog(self, name: str):
+        """
+        Saves the data of a cog and removes it.
+        """
+        spec = self.find_spec(name)
+        cog = self.get_cog(self.cog_specs[spec])
+        # Save the data of the cog (if any) and remove it
+        if hasattr(cog, "cog_flush"):
+            await cog.cog_flush()
+        self.remove_cog(self.cog_specs.pop(spec))
+        LOGGER.info('Unloaded the cog "%s"', spec)
+
+    async def reload_cog(self, name: str):
+        """
+        Replaces a cog with a new instance created from the current version of their module.
+
+        The cogs can hand off their state (like caches and buffers) to the new instance with cog_handoff and
+        cog_restore, otherwise the data is saved with cog_flush.
+        """
+        spec = self.find_spec(name)
+        old = self.get_cog(self.cog_specs[spec])
+        # Create the new instance before removing the old one, so the old one is kept if there are errors
+        cls = await self.loop.run_in_executor(None, self.resolve_cog, spec, True)
+        new = cls(self)
+
+        # Get the state of the old cog, or save their data
+        state = None
+        try:
+            if hasattr(old, "cog_handoff") and hasattr(new, "cog_restore"):
+                state = old.cog_handoff()
+            elif hasattr(old, "cog_flush"):
+                await old.cog_flush()
+        # If that failed, the old cog is still loaded, so only stop the new one
+        except Exception:
+            if hasattr(new, "cog_unload"):
+                new.cog_unload()
+            raise
+
+        # Replace the old cog with the new one
+        self.remove_cog(old.qualified_name)
+        try:
+            self.add_spec(spec, new)
+            if state is not None:
+                new.cog_restore(state)
+        # If the new cog can't be used, remove it and put back a new instance of the old version with the state, so
+        # the cog is not lost (the old instance was already unloaded)
+        except Exception:
+            if self.get_cog(new.qualified_name) is new:
+                self.remove_cog(new.qualified_name)
+            elif hasattr(new, "cog_unload"):
+                new.cog_unload()
+            restored = type(old)(self)
+            self.add_spec(spec, restored)
+            if state is not None and hasattr(restored, "cog_restore"):
+                restored.cog_restore(state)
+            raise
+        LOGGER.info('Reloaded the cog "%s"', spec)
+
+    async def reload_config(self):
+        """
+        Reads the configuration again and applies the values that can be changed while running.
+
+        Returns the keys that changed, and the ones of them that only take effect after a restart.
+        """
+        # If we don't know where the configuration came from, we can't read it again
+        if not self.config_loader:
+            raise RuntimeError("The configuration can't be read again")
+        # Read and parse the file on the thread pool, but apply the values here, so they don't change in the middle
+        # of the work of the event loop
+        config = await self.loop.run_in_executor(None, self.config_loader)
+        # Find the values that changed
+        changed = sorted(key for key in set(config) | set(self.config) if config.get(key) != self.config.get(key))
+        # Apply them, including the prefix
+        self.config.update(config)
+        self.prefixes.set_default(self.config.get("prefix", self.prefixes.default))
+        LOGGER.info("Configuration reloaded, %s values changed", len(changed))
+        # And return the ones that changed
+        return changed, [key for key in changed if key in RESTART_KEYS]
+
+    async def import_cogs(self, names):
+        """
+        Imports multiple cogs at the same time.
+
+        The modules are imported on the thread pool, so slow imports do not block the other startup phases.
+        """
+        async def load(name):
+            # Notify that we are attempting to import the cog
+            LOGGER.info('Loading the cog "%s"', name)
+            with self.timer.phase(f"cog {name}"):
+                # Try to import the module on a separate thread and add the cog
+                try:
+                    cog = await self.loop.run_in_executor(None, self.resolve_cog, name)
+                    self.add_spec(name, cog(self))
+                # If we failed, log it and continue
+                except Exception:
+                    LOGGER.exception("Error while loading %s", name)
+
+        # Load all of the cogs that are not empty strings
+        await asyncio.gather(*[load(name) for name in names if name])
+
+    async def wait_for_storage(self):
+        """
+        Connects to the storage and waits until is ready to be used.
+        """
+        # If there is no storage, there is nothing to wait for
+        if not self.storage:
+            return
+
+        # Otherwise, try to connect to it with a time limit
+        timeout = self.config.get("database_timeout", 10)
+        with self.timer.phase("database"):
+            try:
+                await asyncio.wait_for(self.storage.connect(), timeout)
+            except asyncio.TimeoutError:
+                raise DatabaseUnavailable(f"The {self.storage.name} storage did not respond in {timeout} seconds")
+        # Then, load the prefixes of the guilds in a single query
+        with self.timer.phase("prefixes"):
+            self.prefixes.load(await self.storage.prefixes.all())
+
+    async def start_up(self, token: str, cogs, timer: StartupTimer = None):
+        """
+        Prepares the storage, loads the cogs and logs in at the same time.
+        """
+        # Save the timer of the startup, if any
+        if timer:
+            self.timer = timer
+
+        async def login():
+            with self.timer.phase("login"):
+                await self.login(token)
+
+        # Run all of the independent phases at the same time
+        await asyncio.gather(self.wait_for_storage(), self.import_cogs(cogs), login())
+        # If the metrics are enabled, start serving them
+        if self.metrics_server:
+            await self.metrics_server.start()
+        # And save the moment when we started connecting to the gateway
+        self.connecting = time.perf_counter()
+
+    async def close(self):
+        """
+        Stops the commands, saves the data of the cogs and closes the connection to Discord and the storage.
+
+        Every phase of the shutdown has a time limit, and calling this again waits for the same shutdown.
+        """
+        await self.shutdown.run()
+
+    async def wait_for_commands(self, deadline: float):
+        """
+        Waits for the commands that are running (new commands are ignored once the shutdown starts).
+        """
+        tasks = [task for task in self.handlers if task is not asyncio.current_task()]
+        if not tasks:
+            return
+        _, pending = await asyncio.wait(tasks, timeout=deadline)
+        if pending:
+            LOGGER.warning("%s commands were still running after %ss", len(pending), deadline)
+
+    async def flush_cogs(self, deadline: float):
+        """
+        Saves the data of the cogs and stops their background work.
+        """
+        # Stop requesting members
+        if self.chunker:
+            self.chunker.cancel()
+
+        async def flush(name, cog):
+            try:
+                await cog.cog_flush()
+            except Exception:
+                LOGGER.exception("Unable to save the data of the cog %s", name)
+
+        # Save the data of every cog at the same time, since they don't depend on each other
+        await asyncio.gather(*[flush(name, cog) for name, cog in self.cogs.items() if hasattr(cog, "cog_flush")])
+
+    async def close_gateway(self, deadline: float):
+        """
+        Closes the connection to Discord and stops serving the metrics.
+        """
+        await super().close()
+        if self.metrics_server:
+            await self.metrics_server.stop()
+
+    async def close_storage(self, deadline: float):
+        """
+        Closes the connections used by the storage.
+        """
+        if self.storage:
+            await self.storage.close()
+
+    async def process_commands(self, message):
+        """
+        Processes the commands of a message, ignoring the messages that can't be commands before creating a context.
+        """
+        if message.author.bot or not self.prefixes.matches(message):
+            return
+        await super().process_commands(message)
+
+    async def get_context(self, message, *, cls=OutboundContext):
+        """
+        Gets the context of a message, sending the replies through the outbound dispatcher.
+        """
+        return await super().get_context(message, cls=cls)
+
+    async def invoke(self, ctx):
+        """
+        Invokes a command, unless the bot is shutting down.
+        """
+        # If the bot is shutting down, ignore the command
+        if self.shutdown.started:
+            return
+        # Otherwise, save the task of the command until it finishes, so the shutdown can wait for it
+        task = asyncio.current_task()
+        self.handlers.add(task)
+        # And if the cog uses the storage, save the guild so the storage operations wait for a slot of the guild
+        guild = ctx.guild.id if ctx.guild and getattr(ctx.cog, "uses_storage", False) else None
+        token = CURRENT_GUILD.set(guild)
+        try:
+            await super().invoke(ctx)
+        finally:
+            CURRENT_GUILD.reset(token)
+            self.handlers.discard(task)
+
+    async def on_command(self, ctx):
+        """
+        Event executed before a command is invoked.
+        """
+        # Save the time when the command started
+        ctx.started = time.perf_counter()
+
+    async def on_command_completion(self, ctx):
+        """
+        Event executed after a command finished successfully.
+        """
+        # Save the time taken by the command
+        self.command_latency.observe(ctx.command.qualified_name, "ok", value=time.perf_counter() - ctx.started)
+
+    async def on_command_error(self, ctx, exception):
+        """
+        Event executed when a command fails.
+        """
+        # Get the name of the command
+        name = ctx.command.qualified_name if ctx.command else "unknown"
+        # Count the error
+        self.command_errors.inc(name, type(exception).__name__)
+        # If the command was invoked, save the time taken by it
+        if hasattr(ctx, "started"):
+            self.command_latency.observe(name, "error", value=time.perf_counter() - ctx.started)
+        # If the storage is not available, tell the user instead of logging the error
+        if isinstance(exception, CommandInvokeError) and \
+                isinstance(exception.original, DatabaseUnavailable):
+            await ctx.send("The database is not available right now, so nothing was changed. "
+                           "Please try again in a few minutes.")
+            return
+        # If the bot is too busy, tell the guild (at most once every few seconds)
+        if isinstance(exception, CommandInvokeError) and isinstance(exception.original, Overloaded):
+            now = time.monotonic()
+            if ctx.guild and now - self.busy_replies.get(ctx.guild.id, 0) > self.config.get("busy_reply_cooldown", 10):
+                self.busy_replies[ctx.guild.id] = now
+                await ctx.send("I'm a bit busy right now, please try again in a few seconds.")
+            return
+        # And handle the error as usual
+        await super().on_command_error(ctx, exception)
 
     async def on_ready(self):
         """
@@ -75,3 +496,25 @@ class Chomusuke(AutoShardedBot):
         """
         # Log a message about it
         LOGGER.info("Bot is ready to work!")
+
+        # If this is the first time that we are ready, report the startup times
+        if getattr(self, "connecting", None):
+            self.timer.add("gateway ready", self.connecting)
+            self.connecting = None
+            self.timer.report()
+
+        # If the members are requested in the background, start doing it
+        if self.member_chunking == "background" and self.member_cache == "full" and \
+                (not self.chunker or self.chunker.done()):
+            self.chunker = self.loop.create_task(self.chunk_guilds())
+
+    async def chunk_guilds(self):
+        """
+        Requests the offline members of the large guilds, a few guilds at a time.
+        """
+        guilds = [guild for guild in self.guilds if guild.large and not guild.unavailable and not guild.chunked]
+        batch = self.config.get("member_chunk_batch", 10)
+        start = time.perf_counter()
+        for index in range(0, len(guilds), batch):
+            await self.request_offline_members(*guilds[index:index + batch])
+        LOGGER.info("Requested the members of %s guilds in %.3fs", len(guilds), time.perf_counter() - start)
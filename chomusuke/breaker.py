@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import time
+
+from .cache import LRUCache, MISSING
+from .exceptions import DatabaseUnavailable
+
+LOGGER = logging.getLogger("chomusuke")
+# The operations of the storages that only read data, so their last results can be used when the storage is down
+READS = {"get", "names", "most_used", "search", "all"}
+# The time limits of the operations that take longer than the rest, like the bulk writes
+TIMEOUTS = {"add_uses": 30, "insert_many": 60}
+
+
+def changed_items(operation: str, args: tuple, kwargs: dict):
+    """
+    Gets the items changed by a write as guild ID -> names, or None if they are not known.
+
+    The names are None when anything on the guild could have changed.
+    """
+    try:
+        if operation in ("create", "insert_many"):
+            items = [args[0]] if operation == "create" else args[0]
+            pairs = [(item["guild_id"], item.get("name", None)) for item in items]
+        elif operation == "add_uses":
+            pairs = list(args[0])
+        else:
+            # The rest of the writes receive the guild first, and the tag writes also the name
+            guild_id = kwargs["guild_id"] if "guild_id" in kwargs else args[0]
+            name = kwargs.get("name", args[1] if len(args) > 1 else None)
+            pairs = [(guild_id, name if operation in ("update", "delete") and isinstance(name, str) else None)]
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+    changed = {}
+    for guild_id, name in pairs:
+        names = changed.setdefault(guild_id, set())
+        if names is not None:
+            if name is None:
+                changed[guild_id] = None
+            else:
+                names.add(name)
+    return changed
+
+
+class CircuitBreaker:
+    """
+    Stops using the storage after too many consecutive failures, trying it again after some time.
+    """
+    def __init__(self, threshold: int = 5, reset_timeout: float = 30):
+        """
+        Initializes a new Circuit Breaker.
+        :param threshold: The number of consecutive failures that open the breaker.
+        :param reset_timeout: The seconds to wait before trying the storage again.
+        """
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        # The consecutive failures, and the moment when the breaker was opened (or None if is closed)
+        self.failures = 0
+        self.opened = None
+        # If an operation is being tried after the breaker was opened
+        self.testing = False
+        # The number of times that the breaker was opened
+        self.trips = 0
+
+    @property
+    def closed(self):
+        """
+        If the storage is being used normally.
+        """
+        return self.opened is None
+
+    def allow(self):
+        """
+        Checks if an operation can use the storage.
+        """
+        # If the breaker is closed, everything can use the storage
+        if self.opened is None:
+            return True
+        # If is open, only allow a single operation to try the storage after the reset time
+        if self.testing or time.monotonic() - self.opened < self.reset_timeout:
+            return False
+        self.testing = True
+        return True
+
+    def success(self):
+        """
+        Saves that the storage responded, closing the breaker.
+        """
+        if self.opened is not None:
+            LOGGER.info("The storage is available again")
+        self.failures = 0
+        self.opened = None
+        self.testing = False
+
+    def abort(self):
+        """
+        Saves that the operation trying the storage stopped before it responded, so another one can try it.
+        """
+        self.testing = False
+
+    def failure(self):
+        """
+        Saves that the storage failed, opening the breaker if there were too many failures.
+        """
+        self.failures += 1
+        # If the storage was being tried or failed too many times, (re)open the breaker
+        if self.testing or (self.opened is None and self.failures >= self.threshold):
+            if self.opened is None:
+                LOGGER.warning("The storage failed %s times in a row, stopping its use for %s seconds",
+                               self.failures, self.reset_timeout)
+                self.trips += 1
+            self.opened = time.monotonic()
+        self.testing = False
+
+
+class StorageGuard:
+    """
+    Runs the operations of the storages with time limits and a circuit breaker, using the last results of the reads
+    when the storage is not available.
+    """
+    def __init__(self, breaker: CircuitBreaker, timeout: float = 5, timeouts: dict = None, errors=(),
+                 snapshot_size: int = 4096, snapshot_ttl: float = 86400):
+        """
+        Initializes a new Storage Guard.
+        :param breaker: The circuit breaker of the storage.
+        :param timeout: The maximum seconds that an operation can take.
+        :param timeouts: The maximum seconds of specific operations, as name -> seconds.
+        :param errors: The exceptions raised by the storage when is not available.
+        :param snapshot_size: The maximum number of read results kept.
+        :param snapshot_ttl: The seconds that a read result is kept.
+        """
+        self.breaker = breaker
+        self.timeout = timeout
+        self.timeouts = dict(TIMEOUTS, **(timeouts or {}))
+        self.errors = (asyncio.TimeoutError,) + tuple(errors)
+        # The last result of the reads, as (collection, operation, arguments) -> result
+        self.snapshot = LRUCache(snapshot_size, snapshot_ttl, snapshot_ttl)
+        # The operations answered with old results, and the ones that failed because the storage was not available
+        self.stale = 0
+        self.rejected = 0
+
+    async def call(self, collection: str, name: str, function, args: tuple, kwargs: dict):
+        """
+        Runs an operation of a storage.
+        """
+        key = (collection, name, args, tuple(sorted(kwargs.items()))) if name in READS else None
+        # If the breaker is open, don't wait for the storage
+        if not self.breaker.allow():
+            return self.fallback(collection, name, key)
+        # If the breaker is open, this is the operation that tries the storage again
+        probe = not self.breaker.closed
+
+        # Otherwise, run the operation with a time limit
+        try:
+            result = await asyncio.wait_for(function(*args, **kwargs), self.timeouts.get(name, self.timeout))
+        # If the storage is not available, save the failure and try to use the last result
+        except self.errors as e:
+            self.breaker.failure()
+            LOGGER.debug("The operation %s of the %s failed: %s", name, collection, type(e).__name__)
+            return self.fallback(collection, name, key)
+        # If the operation was cancelled, the storage was not tested, so let the next operation try it
+        # (CancelledError is an Exception on Python 3.7, so it goes before the other errors)
+        except asyncio.CancelledError:
+            if probe:
+                self.breaker.abort()
+            raise
+        # Any other error means that the storage responded
+        except Exception:
+            self.breaker.success()
+            raise
+        # And the rest (like KeyboardInterrupt) stop the operation before the storage responds
+        except BaseException:
+            if probe:
+                self.breaker.abort()
+            raise
+
+        self.breaker.success()
+        # Save the result of the reads, in case the storage stops responding
+        if key is not None:
+            if result is None:
+                self.snapshot.put_missing(key)
+            else:
+                self.snapshot.put(key, result)
+        # And forget the results that a write could have changed, so they are not used after the storage goes down
+        else:
+            self.invalidate(collection, changed_items(name, args, kwargs))
+        return result
+
+    def invalidate(self, collection: str, changed: dict = None):
+        """
+        Removes the last results of the reads of a collection that could include some items.
+        :param collection: The name of the type of data that was changed.
+        :param changed: The items that were changed as guild ID -> names (or None for the whole guild), or None if
+        anything could have changed.
+        """
+        def affected(key):
+            if key[0] != collection:
+                return False
+            if changed is None:
+                return True
+            _, operation, args, kwargs = key
+            kwargs = dict(kwargs)
+            guild_id = args[0] if args else kwargs.get("guild_id", None)
+            # The reads without a guild (like all) can include any of them
+            if guild_id is None:
+                return True
+            if guild_id not in changed:
+                return False
+            # And only the gets of a single item can skip the other items of the guild
+            names = changed[guild_id]
+            name = (args[1] if len(args) > 1 else kwargs.get("name", None)) if operation == "get" else None
+            return names is None or name is None or name in names
+
+        self.snapshot.pop_matching(affected)
+
+    def fallback(self, collection: str, name: str, key):
+        """
+        Gets the last result of a read, or raises DatabaseUnavailable if there is none or this is a write.
+        """
+        value = self.snapshot.get(key) if key is not None else None
+        if value is MISSING:
+            self.stale += 1
+            return None
+        if value is not None:
+            self.stale += 1
+            return value
+        self.rejected += 1
+        raise DatabaseUnavailable(f"The storage is not available, unable to {name} the {collection}")
+
+
+class GuardedStorage:
+    """
+    Runs the coroutines of a storage, like the ones of bot.storage.tags, through a Storage Guard.
+    """
+    def __init__(self, target, collection: str, guard: StorageGuard):
+        """
+        Initializes a new Guarded Storage.
+        :param target: The storage to protect.
+        :param collection: The name of the type of data stored.
+        :param guard: The guard used for the operations.
+        """
+        self._target = target
+        self._collection = collection
+        self._guard = guard
+
+    def __getattr__(self, name):
+        # Get the attribute from the storage
+        value = getattr(self._target, name)
+        # If is not a coroutine, return it as is
+        if not asyncio.iscoroutinefunction(value):
+            return value
+
+        async def guarded(*args, **kwargs):
+            return await self._guard.call(self._collection, name, value, args, kwargs)
+
+        # Save the wrapper, so is not created again
+        self.__dict__[name] = guarded
+        return guarded
@@ -0,0 +1,146 @@
+import sys
+import time
+from collections import OrderedDict
+
+# Marker stored in the cache for keys that are known to not exist
+MISSING = object()
+
+
+def estimate_size(value):
+    """
+    Calculates the approximate size in bytes of a value stored on the cache.
+    """
+    # If this is a dictionary, add the size of the keys and values
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    # If is a list or tuple, do the same but only with the items
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(x) for x in value)
+    # Otherwise, just return the size of the object
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """
+    A bounded Least Recently Used cache with expiration times and support for negative entries.
+    """
+    def __init__(self, max_items: int = 1024, ttl: float = 300, negative_ttl: float = 60, max_memory: int = 0):
+        """
+        Initializes a new LRU Cache.
+        :param max_items: The maximum number of items stored.
+        :param ttl: The time in seconds before an item expires.
+        :param negative_ttl: The time in seconds before a negative (missing) entry expires.
+        :param max_memory: The approximate maximum memory in bytes used by the items, or zero for no limit.
+        """
+        # Save the limits of the cache
+        self.max_items = max_items
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_memory = max_memory
+        # Create the counters of the cache
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.memory = 0
+        # And create the storage of the items as key -> (expiration, size, value)
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        """
+        Gets an item from the cache.
+
+        Returns MISSING if the key was stored as a negative entry or the default value if is not cached.
+        """
+        # Try to get the entry from the cache
+        entry = self._items.get(key, None)
+        # If there is no entry, count the miss and return the default value
+        if entry is None:
+            self.misses += 1
+            return default
+        # If the entry has expired, remove it, count the miss and return the default value
+        if entry[0] < time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return default
+        # Otherwise, mark the item as recently used
+        self._items.move_to_end(key)
+        # And return the item
+        self.hits += 1
+        return entry[2]
+
+    def put(self, key, value):
+        """
+        Stores an item on the cache.
+        """
+        # Select the correct expiration time and size for the value
+        if value is MISSING:
+            expiration = time.monotonic() + self.negative_ttl
+            size = estimate_size(key)
+        else:
+            expiration = time.monotonic() + self.ttl
+            size = estimate_size(key) + estimate_size(value)
+
+        # If there is an existing item, remove it
+        if key in self._items:
+            self._remove(key)
+        # Then, add the item to the cache
+        self._items[key] = (expiration, size, value)
+        self.memory += size
+        # And remove the old items until we are back under the limits
+        while self._items and (len(self._items) > self.max_items or self.max_memory and self.memory > self.max_memory):
+            self._remove(next(iter(self._items)))
+            self.evictions += 1
+
+    def put_missing(self, key):
+        """
+        Marks a key as known to not exist.
+        """
+        self.put(key, MISSING)
+
+    def pop(self, key):
+        """
+        Removes an item from the cache, if present.
+        """
+        if key in self._items:
+            self._remove(key)
+
+    def pop_matching(self, predicate):
+        """
+        Removes the items whose keys make a function return True.
+        """
+        for key in [key for key in self._items if predicate(key)]:
+            self._remove(key)
+
+    def clear(self):
+        """
+        Removes all of the items from the cache.
+        """
+        self._items.clear()
+        self.memory = 0
+
+    def stats(self):
+        """
+        Returns a dict with the counters of the cache.
+        """
+        return {
+            "items": len(self._items),
+            "memory": self.memory,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+    def _remove(self, key):
+        """
+        Removes an item and frees the memory used by it.
+        """
+        # Remove the item from the cache
+        entry = self._items.pop(key)
+        # And subtract the size of it
+        self.memory -= entry[1]
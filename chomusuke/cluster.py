@@ -0,0 +1,234 @@
+import asyncio
+import logging
+import math
+import multiprocessing
+import time
+
+from .shutdown import DEADLINES, GRACE
+
+LOGGER = logging.getLogger("chomusuke")
+# The seconds that a worker needs to run before the restart backoff is reset
+STABLE_TIME = 300
+
+
+def shard_ranges(shard_count: int, workers: int):
+    """
+    Splits the shards on contiguous ranges, one per worker.
+    """
+    # Every worker gets the same number of shards, and the first ones get one more if they can't be split evenly
+    size, extra = divmod(shard_count, workers)
+    ranges = []
+    start = 0
+    for number in range(workers):
+        end = start + size + (1 if number < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+async def fetch_shard_count(token: str):
+    """
+    Gets the number of shards recommended by Discord.
+    """
+    from discord.http import HTTPClient
+    http = HTTPClient()
+    try:
+        await http.static_login(token, bot=True)
+        shards, _ = await http.get_bot_gateway()
+        return shards
+    finally:
+        await http.close()
+
+
+class ClusterInfo:
+    """
+    The place of a worker inside of the cluster, available as bot.cluster.
+    """
+    def __init__(self, index: int, workers: int, shard_ids, shard_count: int, stats):
+        """
+        Initializes a new Cluster Info.
+        :param index: The number of the worker.
+        :param workers: The total number of workers.
+        :param shard_ids: The shards run by the worker.
+        :param shard_count: The total number of shards.
+        :param stats: The dict shared by the workers with the guilds and members of every one of them.
+        """
+        self.index = index
+        self.workers = workers
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.stats = stats
+
+    def publish(self, guilds: int, members: int):
+        """
+        Shares the guilds and members of this worker with the others.
+        """
+        self.stats[self.index] = (guilds, members)
+
+    def totals(self, guilds: int, members: int):
+        """
+        Shares the guilds and members of this worker and gets the total of the cluster.
+        """
+        self.publish(guilds, members)
+        values = list(self.stats.values())
+        return sum(value[0] for value in values), sum(value[1] for value in values)
+
+
+def run_worker(config: dict, index: int, workers: int, shard_ids, shard_count: int, stats, loader=None):
+    """
+    Runs the bot on a worker process with the specified shards.
+    """
+    # Import the runner here, since this is executed on a new process
+    from .__main__ import configure_logging, run_bot
+    from .startup import StartupTimer
+
+    timer = StartupTimer()
+    configure_logging(index)
+    LOGGER.info("Starting worker %s with the shards %s to %s", index, shard_ids[0], shard_ids[-1])
+
+    # Every worker needs a different port for the metrics
+    config = dict(config)
+    if config.get("metrics_port", 0):
+        config["metrics_port"] += index
+    # And run the bot
+    cluster = ClusterInfo(index, workers, shard_ids, shard_count, stats)
+    raise SystemExit(run_bot(config, timer, shard_ids=shard_ids, shard_count=shard_count, cluster=cluster,
+                             config_loader=loader))
+
+
+class Supervisor:
+    """
+    Runs the shards of the bot on multiple processes, restarting the ones that crash.
+    """
+    def __init__(self, config: dict, workers: int, loader=None):
+        """
+        Initializes a new Supervisor.
+        :param config: The configuration of the bot.
+        :param workers: The number of processes to start.
+        :param loader: The function that reads the configuration again, passed to the workers.
+        """
+        self.config = config
+        self.workers = workers
+        self.loader = loader
+        # The seconds between every IDENTIFY and the number of them that can be sent at the same time
+        self.identify_interval = config.get("identify_interval", 5)
+        self.identify_concurrency = config.get("identify_concurrency", 1)
+        # The seconds to wait before restarting a worker, doubled every time that it crashes
+        self.backoff = config.get("restart_backoff", 5)
+        self.max_backoff = config.get("restart_max_backoff", 300)
+        # Use new processes instead of copies of this one
+        self.context = multiprocessing.get_context("spawn")
+        # The processes running, the moment when they were started and the times that they crashed
+        self.processes = {}
+        self.started = {}
+        self.failures = {}
+        # The moment when the shards of the last worker will finish identifying
+        self.identified = 0
+
+    def get_shard_count(self):
+        """
+        Gets the number of shards to run, asking Discord if is not configured.
+        """
+        count = self.config.get("shard_count", 0)
+        if not count:
+            loop = asyncio.new_event_loop()
+            try:
+                count = loop.run_until_complete(fetch_shard_count(self.config["token"]))
+            finally:
+                loop.close()
+            LOGGER.info("Discord recommends %s shards", count)
+        # Make sure that every worker has at least one shard
+        return max(count, self.workers)
+
+    def start(self, index: int, shard_ids, shard_count: int, stats):
+        """
+        Starts the process of a worker.
+        """
+        process = self.context.Process(target=run_worker, name=f"chomusuke-worker-{index}",
+                                       args=(self.config, index, self.workers, shard_ids, shard_count, stats,
+                                             self.loader))
+        process.start()
+        self.processes[index] = process
+        self.started[index] = time.monotonic()
+        # The shards of the worker identify one after the other, so wait for them before starting the next one
+        self.identified = time.monotonic() + \
+            math.ceil(len(shard_ids) / self.identify_concurrency) * self.identify_interval
+        LOGGER.info("Started worker %s (PID %s) with %s shards", index, process.pid, len(shard_ids))
+
+    def check(self, index: int, pending: dict, stats):
+        """
+        Checks if the process of a worker has finished, scheduling a restart if it crashed.
+        """
+        process = self.processes[index]
+        if process.is_alive():
+            return
+        # Remove the process and their stats
+        process.join()
+        del self.processes[index]
+        stats.pop(index, None)
+        # If the worker was stopped, there is nothing else to do
+        if process.exitcode == 0:
+            LOGGER.info("Worker %s stopped", index)
+            return
+
+        # If the worker ran for a while, this is not a crash loop, so start the backoff again
+        now = time.monotonic()
+        if now - self.started[index] > STABLE_TIME:
+            self.failures[index] = 0
+        # And restart it after the backoff
+        failures = self.failures.get(index, 0)
+        delay = min(self.backoff * 2 ** failures, self.max_backoff)
+        self.failures[index] = failures + 1
+        pending[index] = now + delay
+        LOGGER.warning("Worker %s exited with code %s, restarting in %ss", index, process.exitcode, delay)
+
+    def stop(self):
+        """
+        Waits for the workers to stop, terminating the ones that do not stop in time.
+        """
+        # The most that the shutdown of a worker can take
+        deadlines = dict(DEADLINES, **self.config.get("shutdown_deadlines", {}))
+        deadline = sum(deadlines.values()) + len(deadlines) * GRACE
+        for index, process in self.processes.items():
+            process.join(10)
+            if process.is_alive():
+                # Ask the worker to shut down, and kill it if it takes too long
+                LOGGER.warning("Worker %s did not stop, terminating it", index)
+                process.terminate()
+                process.join(deadline)
+                if process.is_alive():
+                    LOGGER.warning("Worker %s did not shut down in %ss, killing it", index, deadline)
+                    process.kill()
+                    process.join()
+
+    def run(self):
+        """
+        Starts the workers and restarts them until all of them stop.
+        """
+        # Split the shards between the workers
+        shard_count = self.get_shard_count()
+        ranges = shard_ranges(shard_count, self.workers)
+        LOGGER.info("Running %s shards on %s workers", shard_count, self.workers)
+
+        # Create the dict shared by the workers
+        with self.context.Manager() as manager:
+            stats = manager.dict()
+            # The workers waiting to start as index -> moment when they can be started
+            pending = {index: 0 for index in range(self.workers)}
+            try:
+                while pending or self.processes:
+                    # Start the workers that waited the most, as long as the shards of the last one finished identifying
+                    for index, when in sorted(pending.items(), key=lambda item: item[1]):
+                        now = time.monotonic()
+                        if when <= now and self.identified <= now:
+                            del pending[index]
+                            self.start(index, ranges[index], shard_count, stats)
+                    # Check the workers that are running
+                    for index in list(self.processes):
+                        self.check(index, pending, stats)
+                    time.sleep(1)
+            except KeyboardInterrupt:
+                # The workers also got the CTRL+C, so wait for them to log out
+                LOGGER.info("Stopping the workers")
+                self.stop()
+        return 0
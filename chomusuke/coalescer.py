@@ -0,0 +1,98 @@
+import logging
+
+LOGGER = logging.getLogger("chomusuke")
+
+
+class _Batch:
+    """
+    The items waiting to be sent for a single key.
+    """
+    __slots__ = ("items", "first", "handle")
+
+    def __init__(self, first: float):
+        self.items = []
+        self.first = first
+        self.handle = None
+
+
+class Coalescer:
+    """
+    Groups items added in a short period of time, so they can be sent together.
+
+    A batch is sent when no items have been added during the window, when the oldest item has waited max_delay
+    seconds or when the batch has max_batch items, whatever happens first.
+    """
+    def __init__(self, loop, send, window: float = 2, max_delay: float = 5, max_batch: int = 25):
+        """
+        Initializes a new Coalescer.
+        :param loop: The event loop used for the timers.
+        :param send: The coroutine function called with the key and list of items of a batch.
+        :param window: The seconds to wait for more items after the last one.
+        :param max_delay: The maximum seconds that an item can wait.
+        :param max_batch: The maximum number of items on a batch.
+        """
+        self.loop = loop
+        self.send = send
+        self.window = window
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        # The batches that are waiting to be sent
+        self.pending = {}
+
+    def add(self, key, item):
+        """
+        Adds an item to the batch of the specified key.
+        """
+        # Get the batch of the key, or create a new one
+        now = self.loop.time()
+        batch = self.pending.get(key, None)
+        if batch is None:
+            batch = self.pending[key] = _Batch(now)
+        # And add the item
+        batch.items.append(item)
+
+        # Cancel the existing timer
+        if batch.handle:
+            batch.handle.cancel()
+        # If the batch is full, send it right now
+        if len(batch.items) >= self.max_batch:
+            self.flush(key)
+        # Otherwise, wait for more items without going over the maximum delay
+        else:
+            delay = max(min(self.window, batch.first + self.max_delay - now), 0)
+            batch.handle = self.loop.call_later(delay, self.flush, key)
+
+    def flush(self, key):
+        """
+        Sends the batch of the specified key right now.
+        """
+        # Try to remove the batch
+        batch = self.pending.pop(key, None)
+        # If there is no batch, return
+        if batch is None:
+            return
+        # Otherwise, cancel the timer and send the items
+        if batch.handle:
+            batch.handle.cancel()
+        self.loop.create_task(self._send(key, batch.items))
+
+    async def flush_all(self):
+        """
+        Sends all of the batches that are waiting.
+        """
+        # Take all of the batches
+        pending, self.pending = self.pending, {}
+        # And send them
+        for key, batch in pending.items():
+            if batch.handle:
+                batch.handle.cancel()
+            await self._send(key, batch.items)
+
+    async def _send(self, key, items):
+        """
+        Sends a batch and logs any errors.
+        """
+        try:
+            await self.send(key, items)
+        except Exception:
+            LOGGER.exception("Unable to send a batch of %s items for %s", len(items), key)
@@ -1,15 +1,50 @@
+import asyncio
+import logging
 import os
 import platform
 
 import discord
 from discord.ext import commands
-from git import NoSuchPathError, Repo
 
+from chomusuke.prefixes import validate_prefix
+
+LOGGER = logging.getLogger("chomusuke")
 DESCRIPTION = "Chomusuke is a Discord Bot created by Lemon#6947 for making servers more productive and fun."
 REVISION = "[{0}](https://github.com/ChomusukeBot/Chomusuke/tree/{1}) from {2}"
 SUPPORT = "[GitHub](https://github.com/ChomusukeBot/Chomusuke/issues) & [Discord](https://discord.gg/Cf6sspj)"
 
 
+def get_revision():
+    """
+    Gets the formatted revision of the code that is running.
+    """
+    # If Heroku told us the commit that was built, use it
+    commit = os.environ.get("HEROKU_SLUG_COMMIT", None) or os.environ.get("SOURCE_VERSION", None)
+    if commit:
+        return REVISION.format(commit[:7], commit, "Heroku")
+
+    # Import GitPython only when is needed, since it takes a while
+    try:
+        from git import InvalidGitRepositoryError, NoSuchPathError, Repo
+    except ImportError:
+        return "No Git Repo Found"
+
+    try:
+        # Get some information from the git repository (this can run git, so it is called on the thread pool)
+        repo = Repo(".git")
+        long_hash = repo.head.commit.hexsha
+        # If the HEAD is detached, there is no branch
+        try:
+            branch = repo.head.ref
+        except TypeError:
+            branch = "detached HEAD"
+        # And return it
+        return REVISION.format(long_hash[:7], long_hash, branch)
+    except (NoSuchPathError, InvalidGitRepositoryError, ValueError):
+        # If the repo was not found or is empty, say it
+        return "No Git Repo Found"
+
+
 class Basics(commands.Cog):
     """
     A set of basic information commands for Chomusuke.
@@ -18,42 +53,166 @@ class Basics(commands.Cog):
         """
         Initializes a new instance of the Basics cog.
         """
-        # Save the branch and latest commit
+        # Save the bot
         self.bot = bot
+        # The revision is read the first time that is needed, since it will not change while running
+        self.revision = None
+        # If we have a DYNO environment variable, we are using Heroku, otherwise save the name of the system
+        self.system = "Heroku" if "DYNO" in os.environ else platform.system()
+        # And start counting the guilds and members
+        self.guilds = 0
+        self.members = 0
+        if bot.is_ready():
+            self.count()
+        # If the bot is part of a cluster, start sharing the stats with the other workers
+        if bot.cluster:
+            self.publisher = bot.loop.create_task(self.publish_loop())
+
+    def cog_unload(self):
+        """
+        Stops sharing the stats with the other workers.
+        """
+        if self.bot.cluster:
+            self.publisher.cancel()
+
+    async def cog_flush(self):
+        """
+        Stops sharing the stats before the bot is closed.
+        """
+        self.cog_unload()
+
+    async def publish_loop(self):
+        """
+        Shares the guilds and members with the other workers of the cluster periodically.
+        """
+        while True:
+            try:
+                await self.bot.loop.run_in_executor(None, self.bot.cluster.publish, self.guilds, self.members)
+            except Exception:
+                LOGGER.exception("Unable to share the stats with the cluster")
+            await asyncio.sleep(self.bot.config.get("cluster_stats_interval", 30))
+
+    async def get_totals(self):
+        """
+        Gets the guilds and members of the bot, including the other workers of the cluster.
+        """
+        # If the bot is not part of a cluster, return the ones of this process
+        if not self.bot.cluster:
+            return self.guilds, self.members
+        # Otherwise, request the total from the cluster, using the ones of this process if is not available
+        try:
+            return await self.bot.loop.run_in_executor(None, self.bot.cluster.totals, self.guilds, self.members)
+        except Exception:
+            LOGGER.exception("Unable to get the stats of the cluster")
+            return self.guilds, self.members
+
+    def count(self):
+        """
+        Counts all of the guilds and members on the cache.
+        """
+        self.guilds = len(self.bot.guilds)
+        self.members = sum(guild.member_count or 0 for guild in self.bot.guilds)
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        """
+        Counts the guilds and members once they are available.
+        """
+        self.count()
+
+    @commands.Cog.listener()
+    async def on_guild_join(self, guild: discord.Guild):
+        """
+        Adds a guild and their members to the stats.
+        """
+        self.guilds += 1
+        self.members += guild.member_count or 0
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        """
+        Removes a guild and their members from the stats.
+        """
+        self.guilds -= 1
+        self.members -= guild.member_count or 0
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member: discord.Member):
+        """
+        Adds a member to the stats.
+        """
+        self.members += 1
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        """
+        Removes a member from the stats.
+        """
+        self.members -= 1
 
     @commands.command(aliases=["info"])
     async def about(self, ctx: commands.Context):
         """
         Shows some basic information about the Bot.
         """
-        try:
-            # Get some information from the git repository
-            repo = Repo(".git")
-            short_hash = repo.git.rev_parse(repo.head, short=True)
-            long_hash = repo.head.commit
-            branch = repo.head.ref
-            # And save it
-            git_info = REVISION.format(short_hash, long_hash, branch)
-        except NoSuchPathError:
-            # If the repo was not found, say it
-            git_info = "No Git Repo Found"
-
-        # If we have a DYNO environment variable, we are using Heroku
-        if "DYNO" in os.environ:
-            system = "Heroku"
-        # Otherwise, save the name of the system
-        else:
-            system = platform.system()
-
+        # If we don't have the revision, get it without blocking the bot
+        if self.revision is None:
+            self.revision = await self.bot.loop.run_in_executor(None, get_revision)
         # Create an embed for showing the info
         embed = discord.Embed(title=f"About Chomusuke", description=DESCRIPTION,
                               url="https://github.com/ChomusukeBot", color=0xE40025)
         # Set the thumbnail to the image of the GitHub organization
         embed.set_thumbnail(url="https://avatars2.githubusercontent.com/u/52353631")
         # And add a couple of fields that we need
-        embed.add_field(name="Version", value=git_info, inline=True)
+        embed.add_field(name="Version", value=self.revision, inline=True)
         embed.add_field(name="Support", value=SUPPORT, inline=True)
-        embed.add_field(name="Stats", value="{0} guilds\n{1} users".format(len(self.bot.guilds), len(self.bot.users)))
-        embed.add_field(name="Running on", value=system)
+        guilds, members = await self.get_totals()
+        embed.add_field(name="Stats", value="{0} guilds\n{1} members".format(guilds, members))
+        embed.add_field(name="Running on", value=self.system)
         # And finally send the embed
         await ctx.send(embed=embed)
+
+    @commands.group(invoke_without_command=True)
+    async def prefix(self, ctx: commands.Context):
+        """
+        Shows the command prefix used on this guild.
+        """
+        await ctx.send(f"The prefix of the commands is `{self.bot.prefixes.get(ctx.guild.id if ctx.guild else None)}`")
+
+    @prefix.command(name="set")
+    @commands.guild_only()
+    @commands.has_permissions(manage_guild=True)
+    async def set_prefix(self, ctx: commands.Context, *, prefix: str):
+        """
+        Changes the command prefix used on this guild.
+        """
+        # If there is no storage, the prefix can't be saved
+        if not self.bot.storage:
+            await ctx.send("The prefix can't be changed because the storage is disabled.")
+            return
+        # Make sure that the prefix can be used
+        try:
+            validate_prefix(prefix)
+        except ValueError as e:
+            await ctx.send(e.args[0])
+            return
+
+        # Save it (or remove it, if is the default one)
+        value = None if prefix == self.bot.prefixes.default else prefix
+        await self.bot.storage.prefixes.set(ctx.guild.id, value)
+        self.bot.prefixes.set(ctx.guild.id, value)
+        # And notify about it
+        await ctx.send(f"The prefix of the commands was changed to `{prefix}`")
+
+    @prefix.command(name="reset")
+    @commands.guild_only()
+    @commands.has_permissions(manage_guild=True)
+    async def reset_prefix(self, ctx: commands.Context):
+        """
+        Uses the default command prefix on this guild.
+        """
+        # If there is no storage, the guild is already using the default prefix
+        if self.bot.storage:
+            await self.bot.storage.prefixes.set(ctx.guild.id, None)
+        self.bot.prefixes.set(ctx.guild.id, None)
+        await ctx.send(f"The prefix of the commands was changed to `{self.bot.prefixes.default}`")
@@ -1,8 +1,17 @@
 import logging
+import os
+import tempfile
+import time
 
+import discord
 from discord.ext import commands
 
+from chomusuke.members import cache_memory
+from chomusuke.transfer import export_data, import_data
+
 LOGGER = logging.getLogger("chomusuke")
+# The maximum size of a file uploaded to Discord
+UPLOAD_LIMIT = 8 * 1024 * 1024
 
 
 class Owner(commands.Cog):
@@ -20,6 +29,7 @@ class Owner(commands.Cog):
         return await self.bot.is_owner(ctx.author)
 
     @commands.command()
+    @commands.is_owner()
     async def stop(self, ctx):
         """
         Disconnects the bot and closes all of the API connections.
@@ -28,5 +38,167 @@ class Owner(commands.Cog):
         LOGGER.warning('Shutdown requested by "%s#%s" (%s)', ctx.author.name, ctx.author.discriminator, ctx.author.id)
         # Send a message to show that we are disconnecting
         await ctx.send(f"{ctx.author.mention} Bye!")
-        # Close the bot connection
-        await self.bot.close()
+        # Close the bot on another task, since the shutdown waits for the running commands (like this one)
+        self.bot.loop.create_task(self.bot.close())
+
+    @commands.command()
+    @commands.is_owner()
+    async def load(self, ctx, name: str):
+        """
+        Loads a cog, like chomusuke.cogs.tags:Tags.
+        """
+        start = time.perf_counter()
+        try:
+            await self.bot.loop.run_in_executor(None, self.bot.resolve_cog, name)
+            self.bot.import_cog(name)
+        except Exception as e:
+            LOGGER.exception("Unable to load the cog %s", name)
+            await ctx.send(f"Unable to load `{name}`: {type(e).__name__}: {e}")
+            return
+        await ctx.send(f"Loaded `{name}` in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    @commands.command()
+    @commands.is_owner()
+    async def unload(self, ctx, name: str):
+        """
+        Saves the data of a cog and removes it.
+        """
+        start = time.perf_counter()
+        try:
+            await self.bot.unload_cog(name)
+        except Exception as e:
+            LOGGER.exception("Unable to unload the cog %s", name)
+            await ctx.send(f"Unable to unload `{name}`: {type(e).__name__}: {e}")
+            return
+        await ctx.send(f"Unloaded `{name}` in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    @commands.command()
+    @commands.is_owner()
+    async def reload(self, ctx, name: str):
+        """
+        Replaces a cog with the current version of their code, keeping their cached data.
+        """
+        start = time.perf_counter()
+        try:
+            await self.bot.reload_cog(name)
+        except Exception as e:
+            LOGGER.exception("Unable to reload the cog %s", name)
+            await ctx.send(f"Unable to reload `{name}`, the old version is still loaded: {type(e).__name__}: {e}")
+            return
+        await ctx.send(f"Reloaded `{name}` in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    @commands.command()
+    @commands.is_owner()
+    async def reconfigure(self, ctx):
+        """
+        Reads the configuration again.
+        """
+        start = time.perf_counter()
+        try:
+            changed, restart = await self.bot.reload_config()
+        except Exception as e:
+            LOGGER.exception("Unable to read the configuration")
+            await ctx.send(f"Unable to read the configuration: {type(e).__name__}: {e}")
+            return
+        # Tell the user what changed, without showing the values
+        message = f"Configuration read in {(time.perf_counter() - start) * 1000:.1f}ms, "
+        message += f"changed: {', '.join(changed)}" if changed else "nothing changed"
+        if restart:
+            message += f"\nThese values need a restart: {', '.join(restart)}"
+        if changed:
+            message += "\nThe values used by the cogs are applied when the cogs are reloaded"
+        await ctx.send(message)
+
+    @commands.command()
+    @commands.is_owner()
+    async def memory(self, ctx, count: int = 10):
+        """
+        Shows the approximate memory used by the cache of members of the largest guilds.
+        """
+        # Calculate the memory of the users and the members of every guild
+        users, guilds = cache_memory(self.bot)
+        total = users + sum(size for _, _, size in guilds)
+        # Create the message with the totals
+        message = f"Member cache: {self.bot.member_cache} ({self.bot.member_chunking} chunking)\n"
+        message += f"Users: {len(self.bot.users)} ({users / 1024:.1f} KiB)\n"
+        message += f"Total: {total / 1024:.1f} KiB on {len(guilds)} guilds\n```\n"
+        # Add the largest guilds
+        for guild, members, size in guilds[:count]:
+            message += f"{size / 1024:10.1f} KiB {members:>8} members  {guild.name[:32]} ({guild.id})\n"
+        message += "```"
+        # And send it
+        await ctx.send(message)
+
+    def reporter(self, message: discord.Message, action: str):
+        """
+        Creates a function that shows the progress of an import or export on a message, every few seconds.
+        """
+        last = time.monotonic()
+
+        def progress(kind, count):
+            nonlocal last
+            if time.monotonic() - last > 2:
+                last = time.monotonic()
+                self.bot.loop.create_task(message.edit(content=f"{action}... {count} documents so far ({kind})"))
+
+        return progress
+
+    @commands.command()
+    @commands.is_owner()
+    async def export(self, ctx, guild_id: int = None):
+        """
+        Exports the tags and welcome settings of a guild (or every guild) as a NDJSON file.
+        """
+        # If there is no storage, there is nothing to export
+        if not self.bot.storage:
+            await ctx.send("There is no storage to export from.")
+            return
+
+        message = await ctx.send("Exporting...")
+        # Write the data into a temporary file
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, f"chomusuke-{guild_id or 'all'}.ndjson")
+            with open(path, "w", encoding="utf-8") as file:
+                counts = await export_data(self.bot.storage, file, guild_id,
+                                           self.bot.config.get("transfer_batch", 500),
+                                           self.reporter(message, "Exporting"))
+            summary = f"Exported {counts['tag']} tags and {counts['welcome']} welcome settings"
+            # If the file is too big for Discord, say it
+            if os.path.getsize(path) > UPLOAD_LIMIT:
+                await message.edit(content=f"{summary}, but the file is too big (use `python -m chomusuke.transfer`)")
+                return
+            # Otherwise, upload it
+            await message.edit(content=summary)
+            await ctx.send(file=discord.File(path))
+
+    @commands.command(name="import")
+    @commands.is_owner()
+    async def import_(self, ctx, guild_id: int = None, replace: bool = False):
+        """
+        Imports the tags and welcome settings from the NDJSON file attached to the message.
+        """
+        # If there is no storage or file, return
+        if not self.bot.storage:
+            await ctx.send("There is no storage to import into.")
+            return
+        if not ctx.message.attachments:
+            await ctx.send("Please attach the NDJSON file to import.")
+            return
+
+        message = await ctx.send("Importing...")
+        # Download the file and import it
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "import.ndjson")
+            await ctx.message.attachments[0].save(path)
+            with open(path, encoding="utf-8") as file:
+                counts = await import_data(self.bot.storage, file, guild_id,
+                                           self.bot.config.get("transfer_batch", 500), replace,
+                                           self.reporter(message, "Importing"))
+
+        # Tell the cogs that their cached data is no longer valid
+        for name, cog in self.bot.cogs.items():
+            if hasattr(cog, "cog_invalidate"):
+                await cog.cog_invalidate()
+        # And show the results
+        await message.edit(content=f"Read {counts['read']} documents, saved {counts['saved']} "
+                                   f"and skipped {counts['invalid']} invalid lines")
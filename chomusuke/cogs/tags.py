@@ -1,22 +1,298 @@
+import asyncio
+import logging
+import time
 from datetime import datetime, timezone
 
 import discord
 from discord.ext import commands
 
-from chomusuke.exceptions import DatabaseRequired
+from chomusuke.cache import LRUCache, MISSING
+from chomusuke.exceptions import DatabaseRequired, DatabaseUnavailable, TemplateError
+from chomusuke.index import NameIndex, TextIndex
+from chomusuke.paginator import KeysetPaginator
+from chomusuke.scheduler import CURRENT_GUILD
+from chomusuke.templates import compile_template, render_for, validate
+
+LOGGER = logging.getLogger("chomusuke")
 
 
 class Tags(commands.Cog):
     """
     Shows small snippets of text for specific guilds.
     """
+    # The commands of this cog use the storage, so their storage operations wait for the scheduler of the bot
+    uses_storage = True
+
     def __init__(self, bot):
-        # If there is no database saved
-        if not bot.db:
+        # If there is no storage available
+        if not bot.storage:
             # Raise an exception
             raise DatabaseRequired("The tags need to be stored in a database")
-        # Otherwise, save the bot instance
+        # Otherwise, save the bot instance and the storage of the tags
         self.bot = bot
+        self.storage = bot.storage.tags
+        # And create the cache for the tags of all guilds
+        self.cache = LRUCache(max_items=bot.config.get("tag_cache_size", 1024),
+                              ttl=bot.config.get("tag_cache_ttl", 300),
+                              max_memory=bot.config.get("tag_cache_memory", 0))
+        # Create the storage for the indexes of tag names, built when a guild needs them
+        self.indexes = LRUCache(max_items=bot.config.get("tag_index_size", 256), ttl=3600)
+        self.building = {}
+        # And the same for the text indexes, used when the storage can't search the tags by itself
+        self.texts = LRUCache(max_items=bot.config.get("tag_search_index_size", 64), ttl=3600)
+        self.building_texts = {}
+        # The uses of the tags that have not been saved as (guild, name) -> [count, last use]
+        self.uses = {}
+        self.max_uses = bot.config.get("tag_usage_buffer", 10000)
+        self.flush_interval = bot.config.get("tag_usage_interval", 60)
+        # The flush started because the buffer was full, if any
+        self.flushing = None
+        # And start saving the uses periodically
+        self.flusher = bot.loop.create_task(self.flush_loop())
+
+    def cog_unload(self):
+        """
+        Stops saving the uses periodically and saves the remaining ones.
+        """
+        self.flusher.cancel()
+        self.bot.loop.create_task(self.try_flush_uses())
+
+    async def cog_flush(self):
+        """
+        Stops saving the uses periodically and saves the remaining ones before the bot is closed.
+        """
+        self.flusher.cancel()
+        await self.flush_uses()
+
+    def add_use(self, guild_id: int, name: str):
+        """
+        Counts a use of a tag, to be saved on the next flush.
+        """
+        # Increase the count and set the last use
+        entry = self.uses.get((guild_id, name), None)
+        if entry is None:
+            self.uses[(guild_id, name)] = [1, datetime.now(timezone.utc)]
+        else:
+            entry[0] += 1
+            entry[1] = datetime.now(timezone.utc)
+        # If there are too many tags waiting, save them now
+        # (unless they are being saved or the storage is not available, in which case the periodic flush saves them)
+        if len(self.uses) >= self.max_uses and (self.flushing is None or self.flushing.done()) and \
+                (self.bot.breaker is None or self.bot.breaker.closed):
+            self.flushing = self.bot.loop.create_task(self.try_flush_uses())
+
+    def cog_handoff(self):
+        """
+        Gives the cached tags, indexes and uses that have not been saved to the cog that replaces this one.
+        """
+        state = {"cache": self.cache, "indexes": self.indexes, "texts": self.texts, "uses": self.uses}
+        # The uses now belong to the new cog, so they are not saved twice
+        self.uses = {}
+        return state
+
+    def cog_restore(self, state: dict):
+        """
+        Takes the cached tags, indexes and uses of the cog that this one replaces.
+        """
+        # Keep the limits of the current configuration
+        for name in ("cache", "indexes", "texts"):
+            cache = state[name]
+            new = getattr(self, name)
+            cache.max_items, cache.ttl, cache.max_memory = new.max_items, new.ttl, new.max_memory
+            setattr(self, name, cache)
+        # And add the uses that were not saved
+        self.merge_uses(state["uses"])
+
+    def merge_uses(self, uses: dict):
+        """
+        Adds uses that have not been saved to the ones waiting for the next flush.
+        """
+        for key, (count, last) in uses.items():
+            entry = self.uses.setdefault(key, [0, last])
+            entry[0] += count
+            entry[1] = max(entry[1], last)
+
+    async def cog_invalidate(self):
+        """
+        Removes the cached tags and indexes after the tags were changed outside of the cog.
+        """
+        self.cache.clear()
+        self.indexes.clear()
+        self.texts.clear()
+
+    async def flush_uses(self):
+        """
+        Saves the uses of the tags on the storage with a single bulk write.
+        """
+        # If there is nothing to save, return
+        if not self.uses:
+            return
+        # Take the uses that are waiting, so new uses are added to a new buffer
+        uses, self.uses = self.uses, {}
+        # And save them, keeping them for the next flush if the write fails for any reason
+        try:
+            await self.storage.add_uses(uses)
+        except Exception:
+            self.merge_uses(uses)
+            raise
+
+    async def try_flush_uses(self):
+        """
+        Saves the uses of the tags, logging the errors instead of raising them (for the flushes on the background).
+        """
+        # The flush can be started by a command, but is not part of it, so it does not wait for the scheduler
+        CURRENT_GUILD.set(None)
+        try:
+            await self.flush_uses()
+        except DatabaseUnavailable:
+            LOGGER.warning("The storage is not available, the uses of %s tags will be saved later", len(self.uses))
+        except Exception:
+            LOGGER.exception("Unable to save the uses of the tags")
+
+    async def flush_loop(self):
+        """
+        Saves the uses of the tags periodically.
+        """
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.try_flush_uses()
+
+    async def get_index(self, guild_id: int):
+        """
+        Gets the index of tag names for a guild, building it if is not available.
+        """
+        # If the index is available, return it
+        index = self.indexes.get(guild_id)
+        if index is not None:
+            return index
+
+        # If the index is not being built, start building it
+        if guild_id not in self.building:
+            self.building[guild_id] = self.bot.loop.create_task(self.build_index(guild_id))
+        # And wait until it has been built
+        try:
+            return await asyncio.shield(self.building[guild_id])
+        finally:
+            self.building.pop(guild_id, None)
+
+    async def build_index(self, guild_id: int):
+        """
+        Creates the index of tag names for a guild from the database.
+        """
+        names = []
+        # Request the names in large pages until we get all of them
+        while True:
+            page = await self.storage.names(guild_id, names[-1] if names else None, 1000)
+            names.extend(page)
+            if len(page) < 1000:
+                break
+        # Then, create the index and save it
+        index = NameIndex(names)
+        self.indexes.put(guild_id, index)
+        # And return it
+        return index
+
+    def update_index(self, guild_id: int, added: str = None, removed: str = None):
+        """
+        Adds or removes a name from the index of a guild, if the index has been built.
+        """
+        # Try to get the index
+        index = self.indexes.get(guild_id)
+        # If there is no index, there is nothing to update
+        if index is None:
+            return
+        # Otherwise, add or remove the name
+        if added is not None:
+            index.add(added)
+        if removed is not None:
+            index.remove(removed)
+
+    async def get_text_index(self, guild_id: int):
+        """
+        Gets the text index of the tags of a guild, building it if is not available.
+        """
+        # If the index is available, return it
+        index = self.texts.get(guild_id)
+        if index is not None:
+            return index
+
+        # Otherwise, build it (once) and wait until is ready
+        if guild_id not in self.building_texts:
+            self.building_texts[guild_id] = self.bot.loop.create_task(self.build_text_index(guild_id))
+        try:
+            return await asyncio.shield(self.building_texts[guild_id])
+        finally:
+            self.building_texts.pop(guild_id, None)
+
+    async def build_text_index(self, guild_id: int):
+        """
+        Creates the text index of the tags of a guild from the database.
+        """
+        index = TextIndex()
+        # Add the tags as they are received, letting the other tasks run between the batches
+        async for item in self.storage.stream(guild_id, 1000):
+            index.add(item["name"], item["content"])
+            if not len(index) % 1000:
+                await asyncio.sleep(0)
+        # And save the index
+        self.texts.put(guild_id, index)
+        return index
+
+    def update_text_index(self, guild_id: int, name: str, content: str = None):
+        """
+        Adds, replaces or removes (when there is no content) a tag on the text index of a guild, if is built.
+        """
+        index = self.texts.get(guild_id)
+        if index is None:
+            return
+        if content is None:
+            index.remove(name)
+        else:
+            index.add(name, content)
+
+    async def get_tag(self, guild_id: int, name: str):
+        """
+        Gets a tag from the cache or the database.
+        """
+        # Try to get the tag from the cache
+        item = self.cache.get((guild_id, name))
+        # If the tag is known to not exist, return nothing
+        if item is MISSING:
+            return None
+        # If we got the tag, return it
+        if item is not None:
+            return item
+
+        # Otherwise, request it from the database
+        item = await self.storage.get(guild_id, name)
+        # And save it on the cache, or mark it as missing
+        if item:
+            self.cache.put((guild_id, name), item)
+        else:
+            self.cache.put_missing((guild_id, name))
+        return item
+
+    def update_cache(self, guild_id: int, name: str, item: dict):
+        """
+        Replaces the cached version of a tag after it has been modified.
+        """
+        # If there is a new version of the tag, save it
+        if item:
+            self.cache.put((guild_id, name), item)
+        # Otherwise, mark it as missing
+        else:
+            self.cache.put_missing((guild_id, name))
+
+    async def check_template(self, ctx: commands.Context, text: str):
+        """
+        Checks if the text of a tag is a valid template, telling the user the problem if is not.
+        """
+        try:
+            validate(text)
+            return True
+        except TemplateError as e:
+            await ctx.send(f"The text of the tag is not valid: {e.args[0]}")
+            return False
 
     @commands.group(aliases=["tags", "snippet"], invoke_without_command=True)
     @commands.guild_only()
@@ -26,21 +302,35 @@ class Tags(commands.Cog):
 
         A tag is just a snippet of plain text.
         """
-        # Get the collection of tags for this guild
-        collection = self.bot.db[f"tag_{ctx.guild.id}"]
         # Try to get an item with the specified name
-        item = await collection.find_one({"_id": name})
+        item = await self.get_tag(ctx.guild.id, name)
 
         # If there is a tag
         if item:
+            # Count the use of the tag
+            self.add_use(ctx.guild.id, name)
             # Select the correct user to mention
             mention = to or ctx.author
+            # Render the content, mentioning the user first if the tag does not do it
+            template = compile_template(item["content"])
+            content = render_for(template, mention, ctx.channel)
+            if "user" not in template.variables:
+                content = mention.mention + "\n" + content
             # And send it
-            await ctx.send(mention.mention + "\n" + item["content"])
+            await ctx.send(content)
         # Otherwise
         else:
-            # Tell the user that the tag does not exists
-            await ctx.send(f"The tag `{name}` does not exists!")
+            # Look for tags with a similar name (unless the names can't be read from the storage)
+            try:
+                index = await self.get_index(ctx.guild.id)
+                suggestions = index.suggest(name, self.bot.config.get("tag_suggestions", 3))
+            except DatabaseUnavailable:
+                suggestions = []
+            # And tell the user that the tag does not exists
+            message = f"The tag `{name}` does not exists!"
+            if suggestions:
+                message += " Did you mean " + ", ".join(f"`{x}`" for x in suggestions) + "?"
+            await ctx.send(message)
 
     @tag.command(aliases=["make", "add"])
     @commands.guild_only()
@@ -49,21 +339,21 @@ class Tags(commands.Cog):
         """
         Creates a tag with the specified name and contents.
         """
-        # Get the collection of tags for this guild
-        collection = self.bot.db[f"tag_{ctx.guild.id}"]
-
-        # Try to get an item with the specified name
-        item = await collection.find_one({"_id": name})
-        # If something was found, notify about it and return
-        if item:
+        # Make sure that the variables and conditions of the contents are valid
+        if not await self.check_template(ctx, contents):
+            return
+        # Create the item
+        item = {"guild_id": ctx.guild.id, "name": name, "content": contents, "author": ctx.author.id,
+                "discriminator": f"{ctx.author.name}#{ctx.author.discriminator}",
+                "created": datetime.now(timezone.utc), "edited": None, "usage": None}
+        # Try to save it, and if there is already a tag with that name, notify about it and return
+        if not await self.storage.create(item):
             await ctx.send("There is already a tag with that name!")
             return
-
-        # Otherwise, add the item into the collection
-        await collection.insert_one({"_id": name, "content": contents, "author": ctx.author.id,
-                                     "discriminator": f"{ctx.author.name}#{ctx.author.discriminator}",
-                                     "created": datetime.now(timezone.utc), "edited": None,
-                                     "usage": None})
+        # And replace the negative entry on the cache (if any)
+        self.cache.put((ctx.guild.id, name), item)
+        self.update_index(ctx.guild.id, added=name)
+        self.update_text_index(ctx.guild.id, name, contents)
         # And notify about it
         await ctx.send(f"The tag `{name}` was created!")
 
@@ -74,12 +364,14 @@ class Tags(commands.Cog):
         """
         Deletes the specified tag.
         """
-        # Get the collection of tags for this guild
-        collection = self.bot.db[f"tag_{ctx.guild.id}"]
-        # And try to delete a single item with that name
-        count = await collection.delete_one({"_id": name})
+        # Try to delete the tag
+        deleted = await self.storage.delete(ctx.guild.id, name)
+        # And mark it as missing on the cache
+        self.cache.put_missing((ctx.guild.id, name))
+        self.update_index(ctx.guild.id, removed=name)
+        self.update_text_index(ctx.guild.id, name)
         # If we removed something, notify it
-        if count:
+        if deleted:
             await ctx.send(f"The tag `{name}` was deleted!")
         # Otherwise, say that no tags were found
         else:
@@ -92,14 +384,17 @@ class Tags(commands.Cog):
         """
         Replaces the text of the specified tag.
         """
-        # Get the collection of tags for this guild
-        collection = self.bot.db[f"tag_{ctx.guild.id}"]
+        # Make sure that the variables and conditions of the contents are valid
+        if not await self.check_template(ctx, contents):
+            return
         # Try to update the tag
-        result = await collection.find_one_and_update({"_id": name},
-                                                      {"$set": {"content": contents,
-                                                                "edited": datetime.now(timezone.utc)}})
+        result = await self.storage.update(ctx.guild.id, name, {"content": contents,
+                                                                "edited": datetime.now(timezone.utc)})
+        # Update the cache with the new version of the tag
+        self.update_cache(ctx.guild.id, name, result)
         # And tell the user if we managed to update it
         if result:
+            self.update_text_index(ctx.guild.id, name, result["content"])
             await ctx.send(f"The text of the tag `{name}` was changed!")
         else:
             await ctx.send(f"There are no tags with a name of `{name}`")
@@ -113,15 +408,14 @@ class Tags(commands.Cog):
 
         You can remove the text by specifying "remove".
         """
-        # Get the collection of tags for this guild
-        collection = self.bot.db[f"tag_{ctx.guild.id}"]
-        # And select the correct usage
+        # Select the correct usage
         usage = None if text.lower() == "remove" else text
 
         # Try to update the tag
-        result = await collection.find_one_and_update({"_id": name},
-                                                      {"$set": {"usage": usage,
-                                                                "edited": datetime.now(timezone.utc)}})
+        result = await self.storage.update(ctx.guild.id, name, {"usage": usage,
+                                                                "edited": datetime.now(timezone.utc)})
+        # Update the cache with the new version of the tag
+        self.update_cache(ctx.guild.id, name, result)
         # And tell the user if we managed to update it
         if result:
             await ctx.send(f"The usage of the tag `{name}` was changed!")
@@ -134,18 +428,74 @@ class Tags(commands.Cog):
         """
         Lists all of the tags on this guild.
         """
-        # Get the collection of tags for this guild
-        collection = self.bot.db[f"tag_{ctx.guild.id}"]
-
-        # If there are no items, say so and return
-        if not await collection.count_documents({}):
+        # Create a paginator that requests the names of the tags as they are shown
+        paginator = KeysetPaginator(ctx, lambda after, limit: self.storage.names(ctx.guild.id, after, limit),
+                                    f"Tags on {ctx.guild.name}", self.bot.config.get("tag_page_size", 50))
+        # If there are no items, say so
+        if not await paginator.start():
             await ctx.send("This guild doesn't have any tags.")
+
+    @tag.command(aliases=["top"])
+    @commands.guild_only()
+    async def stats(self, ctx: commands.Context, count: int = 10):
+        """
+        Shows the most used tags on this guild.
+        """
+        # Request the most used tags
+        count = max(min(count, 25), 1)
+        items = await self.storage.most_used(ctx.guild.id, count)
+        # If no tags have been used, say so and return
+        if not items:
+            await ctx.send("No tags have been used on this guild.")
+            return
+
+        # Otherwise, create an embed with the tags
+        embed = discord.Embed()
+        embed.title = f"Most used tags on {ctx.guild.name}"
+        embed.description = "\n".join("**{0}**: {1} uses{2}".format(
+            item["name"], item["uses"],
+            ", last on " + item["last_used"].strftime("%B %d, %Y %H:%M UTC") if item.get("last_used", None) else "")
+            for item in items)
+        # And send it
+        await ctx.send(embed=embed)
+
+    @tag.command(aliases=["complete"])
+    @commands.guild_only()
+    async def find(self, ctx: commands.Context, prefix: str):
+        """
+        Lists the tags that start with the specified text.
+        """
+        # Get the names that start with the text
+        index = await self.get_index(ctx.guild.id)
+        names = index.complete(prefix)
+        # If there are no names, say so and return
+        if not names:
+            await ctx.send(f"There are no tags starting with `{prefix}`.")
+            return
+        # Otherwise, send them
+        await ctx.send(", ".join(f"`{x}`" for x in names))
+
+    @tag.command(aliases=["lookup"])
+    @commands.guild_only()
+    async def search(self, ctx: commands.Context, *, text: str):
+        """
+        Lists the tags that contain the specified words on their name or text, the most relevant first.
+        """
+        limit = self.bot.config.get("tag_search_results", 10)
+        # Let the storage search the tags if it can, otherwise use the index on memory
+        names = await self.storage.search(ctx.guild.id, text, limit)
+        if names is None:
+            index = await self.get_text_index(ctx.guild.id)
+            names = index.search(text, limit)
+        # If there are no tags, say so and return
+        if not names:
+            await ctx.send("There are no tags with those words.")
             return
 
-        # Create an embed and set the values
+        # Otherwise, create an embed with the tags
         embed = discord.Embed()
-        embed.title = f"Tags on {ctx.guild.name}"
-        embed.description = ", ".join([tag["_id"] async for tag in collection.find({})])
+        embed.title = f'Tags matching "{text[:200]}"'
+        embed.description = "\n".join(f"{number}. `{name}`" for number, name in enumerate(names, 1))
         # And send it
         await ctx.send(embed=embed)
 
@@ -155,20 +505,18 @@ class Tags(commands.Cog):
         """
         Shows the information of a Tag.
         """
-        # Get the collection of tags for this guild
-        collection = self.bot.db[f"tag_{ctx.guild.id}"]
-
         # Try to get the tag with the specified name
-        item = await collection.find_one({"_id": name})
+        item = await self.get_tag(ctx.guild.id, name)
         # If there is no tag, say so and return
         if not item:
             await ctx.send("There is no tag with that name!")
             return
 
-        # Try to get the current user
-        member = ctx.guild.get_member(item["author"])
+        # Try to get the current user, requesting it if is not cached
+        member = await self.bot.member_lookup.get(ctx.guild, item["author"])
         # Format the parameters
-        creation = item["created"].strftime("%B %d, %Y %H:%M:%S UTC")
+        created = item.get("created", None)
+        creation = created.strftime("%B %d, %Y %H:%M:%S UTC") if created else "an unknown date"
         author = member.mention if member else item["discriminator"]
         edited = item["edited"].strftime("%B %d, %Y %H:%M:%S UTC") if item["edited"] else None
         usage = item.get("usage", None) or "No usage specified"
@@ -176,10 +524,85 @@ class Tags(commands.Cog):
         # Otherwise, create an embed
         embed = discord.Embed()
         # Add the information
-        embed.title = 'About the tag "{0}"'.format(item["_id"])
+        embed.title = 'About the tag "{0}"'.format(item["name"])
         embed.description = item["content"] + "\n\n"
         embed.description += f"Usage: {usage}\n"
         embed.description += f"Created by {author} on **{creation}**"
         embed.description += f"\nEdited on **{edited}**" if edited else ""
         # And send it
         await ctx.send(embed=embed)
+
+    @tag.command(name="cache")
+    @commands.is_owner()
+    async def cache_stats(self, ctx: commands.Context):
+        """
+        Shows the statistics of the tag cache.
+        """
+        # Get the counters of the cache
+        stats = self.cache.stats()
+        # Calculate the ratio of hits
+        requests = stats["hits"] + stats["misses"]
+        ratio = stats["hits"] / requests * 100 if requests else 0
+
+        # Create an embed with the information
+        embed = discord.Embed()
+        embed.title = "Tag Cache"
+        embed.description = f"{stats['items']} items using ~{stats['memory'] // 1024} KiB\n"
+        embed.description += f"{stats['hits']} hits, {stats['misses']} misses ({ratio:.1f}% hit ratio)\n"
+        embed.description += f"{stats['evictions']} evictions"
+        # And send it
+        await ctx.send(embed=embed)
+
+    @tag.command()
+    @commands.is_owner()
+    async def migrate(self, ctx: commands.Context, drop: bool = False):
+        """
+        Copies the tags from the old per guild collections into the tags collection.
+
+        The migration can be resumed if is interrupted. Set drop to true to remove the old collections afterwards.
+        """
+        # Get the tool for migrating the tags
+        migration = getattr(self.storage, "migration", None)
+        # If there is none, the tags are not stored on MongoDB, so say so and return
+        if not migration:
+            await ctx.send("The migration is only available for MongoDB.")
+            return
+
+        # Get the guilds that still have a legacy collection
+        guilds = await migration.legacy_guilds()
+        # If there are none, say so and return
+        if not guilds:
+            await ctx.send("There are no tags left to migrate.")
+            return
+
+        # Notify that we are starting
+        await ctx.send(f"Migrating the tags of {len(guilds)} guilds...")
+        start = time.perf_counter()
+        copied = 0
+
+        # Migrate the guilds one by one, so the bot can keep serving the rest
+        for guild_id in guilds:
+            copied += await migration.migrate_guild(guild_id)
+            self.storage.migrated.add(guild_id)
+
+        # Measure the lookup times and storage before removing anything
+        legacy_time, current_time = await migration.lookup_latency(guilds)
+        legacy, current = await migration.storage_stats(guilds)
+
+        # If the user wants to drop the legacy collections, do it
+        if drop:
+            for guild_id in guilds:
+                await migration.drop_legacy(guild_id)
+
+        # Create an embed with the results
+        embed = discord.Embed()
+        embed.title = "Tag Migration"
+        embed.description = f"Copied {copied} tags from {len(guilds)} guilds in {time.perf_counter() - start:.2f}s\n"
+        if legacy_time is not None:
+            embed.description += f"Lookup: {legacy_time:.2f}ms before, {current_time:.2f}ms after\n"
+        embed.description += "Before: {collections} collections, {indexes} indexes, {storage} bytes of data, " \
+                             "{index_size} bytes of indexes\n".format(**legacy)
+        embed.description += "After: {collections} collections, {indexes} indexes, {storage} bytes of data, " \
+                             "{index_size} bytes of indexes".format(**current)
+        # And send it
+        await ctx.send(embed=embed)
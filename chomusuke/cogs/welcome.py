@@ -1,24 +1,178 @@
 import logging
+from collections import namedtuple
 
 import discord
 from discord.ext import commands
 
-from chomusuke.exceptions import DatabaseRequired
+from chomusuke.coalescer import Coalescer
+from chomusuke.exceptions import DatabaseRequired, DatabaseUnavailable, TemplateError
+from chomusuke.templates import compile_template, validate
 
 LOGGER = logging.getLogger("chomusuke")
+# The maximum length of a Discord message
+MESSAGE_LIMIT = 2000
+
+
+class WelcomeSettings(namedtuple("WelcomeSettings", ["enabled", "message", "channel"])):
+    """
+    The welcome message settings of a single guild.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_document(cls, document: dict):
+        """
+        Creates the settings from a document of the welcome collection.
+        """
+        return cls(document.get("enabled", False), document.get("msg", None), document.get("channel", 0))
 
 
 class Welcome(commands.Cog):
     """
     Shows a custom join message for new users.
     """
+    # The commands of this cog use the storage, so their storage operations wait for the scheduler of the bot
+    uses_storage = True
+
     def __init__(self, bot):
-        # If there is no database saved
-        if not bot.db:
+        # If there is no storage available
+        if not bot.storage:
             # Raise an exception
             raise DatabaseRequired("The Welcome Messages need a database")
-        # And save the bot
+        # And save the bot and the storage of the settings
         self.bot = bot
+        self.storage = bot.storage.welcome
+        # The settings of the guilds, or None if the guild has nothing configured
+        self.settings = {}
+        # If the settings of all of the guilds have been loaded
+        self.loaded = False
+        # If the joins happening at the same time should be grouped on a single message, create the coalescer
+        window = bot.config.get("welcome_window", 0)
+        if window:
+            self.coalescer = Coalescer(bot.loop, self.send_batch, window, bot.config.get("welcome_max_delay", 5),
+                                       bot.config.get("welcome_batch", 25))
+        else:
+            self.coalescer = None
+
+    def cog_unload(self):
+        """
+        Sends the welcome messages that are waiting before the cog is removed.
+        """
+        if self.coalescer:
+            self.bot.loop.create_task(self.coalescer.flush_all())
+
+    async def cog_flush(self):
+        """
+        Sends the welcome messages that are waiting before the bot is closed.
+        """
+        if self.coalescer:
+            await self.coalescer.flush_all()
+
+    def cog_handoff(self):
+        """
+        Gives the cached settings to the cog that replaces this one.
+        """
+        return {"settings": self.settings, "loaded": self.loaded}
+
+    def cog_restore(self, state: dict):
+        """
+        Takes the cached settings of the cog that this one replaces.
+        """
+        self.settings = state["settings"]
+        self.loaded = state["loaded"]
+
+    async def cog_invalidate(self):
+        """
+        Loads the settings again after they were changed outside of the cog.
+        """
+        self.settings = {}
+        self.loaded = False
+        await self.on_ready()
+
+    async def send_batch(self, key, members):
+        """
+        Sends a single welcome message for multiple members.
+        """
+        # Get the channel and message of the batch
+        channel, message = key
+        template = compile_template(message)
+        # Split the mentions of the members in as few messages as possible
+        mentions = []
+        for member in members:
+            # If adding the mention would go over the Discord limit, send the current mentions
+            if mentions and len(self.render(template, mentions + [member.mention], channel)) > MESSAGE_LIMIT:
+                await self.bot.outbound.announce(channel, self.render(template, mentions, channel))
+                mentions = []
+            # Then, add the mention
+            mentions.append(member.mention)
+        # And send the remaining mentions
+        if mentions:
+            await self.bot.outbound.announce(channel, self.render(template, mentions, channel))
+        LOGGER.info("Welcome message sent to %s members on channel %s", len(members), channel.id,
+                    extra={"key": ("welcome batch", channel.id)})
+
+    @staticmethod
+    def render(template, mentions, channel):
+        """
+        Renders a welcome message for the mentions of some members.
+        """
+        user = " ".join(mentions)
+        text = template.render(user, channel.guild.name, channel.guild.member_count, channel.mention)
+        # If the message does not mention the members, add the mentions before the text
+        return text if "user" in template.variables else f"{user} {text}"
+
+    async def get_settings(self, guild_id: int):
+        """
+        Gets the welcome settings of a guild.
+        """
+        # If the settings are cached, return them
+        if guild_id in self.settings:
+            return self.settings[guild_id]
+        # If all of the settings have been loaded, the guild has nothing configured
+        if self.loaded:
+            return None
+
+        # Otherwise, request them from the database
+        document = await self.storage.get(guild_id)
+        settings = WelcomeSettings.from_document(document) if document else None
+        # Save them
+        self.settings[guild_id] = settings
+        # And return them
+        return settings
+
+    async def update_settings(self, guild_id: int, values: dict):
+        """
+        Saves some welcome settings on the database and the cache.
+        """
+        # Save the values on the storage
+        document = await self.storage.update(guild_id, values)
+        # And update the cached settings
+        self.settings[guild_id] = WelcomeSettings.from_document(document)
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        """
+        Loads the welcome settings of all of the guilds.
+        """
+        # If the settings were already loaded, return
+        if self.loaded:
+            return
+
+        # Otherwise, request every document in a single query (the guilds are loaded one by one if this fails)
+        try:
+            documents = await self.storage.all()
+        except DatabaseUnavailable:
+            LOGGER.warning("The storage is not available, the welcome settings will be loaded when needed")
+            return
+        settings = {}
+        for document in documents:
+            settings[document["_id"]] = WelcomeSettings.from_document(document)
+        # Keep the settings that were saved while we were loading, since they are newer
+        settings.update(self.settings)
+        self.settings = settings
+        # And mark every other guild as not configured
+        self.loaded = True
+        LOGGER.info("Loaded the welcome settings of %s guilds", len(settings))
 
     @commands.group(invoke_without_command=True)
     @commands.guild_only()
@@ -28,7 +182,7 @@ class Welcome(commands.Cog):
         Group of commands for modifying the custom welcome messages.
         """
         # Try to get the settings for the current guild and channel
-        settings = await self.bot.db["welcome"].find_one({"_id": ctx.guild.id}) or {}
+        settings = await self.storage.get(ctx.guild.id) or {}
         channel = self.bot.get_channel(settings.get("channel", 0))
         # Create the message with the correct contents
         message = "Welcome messages are " + ("enabled" if settings.get("enabled", False) else "disabled") + "\n"
@@ -46,9 +200,7 @@ class Welcome(commands.Cog):
         Enables or Disables the custom welcome messages.
         """
         # Save the activation of the welcome messages
-        await self.bot.db["welcome"].find_one_and_update({"_id": ctx.guild.id},
-                                                         {"$set": {"enabled": enabled}},
-                                                         upsert=True)
+        await self.update_settings(ctx.guild.id, {"enabled": enabled})
         # And notify about it
         await ctx.send("The welcome messages have been " + ("enabled" if enabled else "disabled"))
 
@@ -58,11 +210,18 @@ class Welcome(commands.Cog):
     async def message(self, ctx: commands.Context, *, message: str):
         """
         Sets the welcome message for this server.
+
+        The message can use {user}, {guild}, {member_count} and {channel}, and conditions like
+        {if member_count >= 100}...{else}...{end}.
         """
+        # Make sure that the variables and conditions of the message are valid
+        try:
+            validate(message)
+        except TemplateError as e:
+            await ctx.send(f"The welcome message is not valid: {e.args[0]}")
+            return
         # Save the welcome message
-        await self.bot.db["welcome"].find_one_and_update({"_id": ctx.guild.id},
-                                                         {"$set": {"msg": message}},
-                                                         upsert=True)
+        await self.update_settings(ctx.guild.id, {"msg": message})
         # And notify about it
         await ctx.send(f"The welcome message was set to:\n```\n{message}\n```")
 
@@ -80,9 +239,7 @@ class Welcome(commands.Cog):
             return
 
         # Save the ID of the Channel
-        await self.bot.db["welcome"].find_one_and_update({"_id": ctx.guild.id},
-                                                         {"$set": {"channel": channel.id}},
-                                                         upsert=True)
+        await self.update_settings(ctx.guild.id, {"channel": channel.id})
         # And notify about it
         await ctx.send(f"The channel for welcome messages was set to {channel.mention}")
 
@@ -93,24 +250,28 @@ class Welcome(commands.Cog):
         :param member: The member that just joined.
         """
         # Get the settings for the current guild
-        settings = await self.bot.db["welcome"].find_one({"_id": member.guild.id})
+        try:
+            settings = await self.get_settings(member.guild.id)
+        except DatabaseUnavailable:
+            LOGGER.warning("Unable to welcome a member of %s, the storage is not available", member.guild.id)
+            return
 
         # If there are no settings, return
         if not settings:
             return
 
         # If the settings are disabled, return
-        if not settings.get("enabled", False):
+        if not settings.enabled:
             return
 
         # Try to get the message
-        message = settings.get("msg", None)
+        message = settings.message
         # If there is no message, return
         if not message:
             return
 
         # Try to get the the channel to use
-        channel_id = settings.get("channel", 0)
+        channel_id = settings.channel
         # If there is no channel, return
         if not channel_id:
             return
@@ -127,7 +288,16 @@ class Welcome(commands.Cog):
             LOGGER.error("The Channel %s is not part of the Guild %s!", channel_id, member.guild.id)
             return
 
-        # If we got here, send a message to the channel
-        await channel.send(f"{member.mention} {message}")
+        # If the joins are being grouped, add the member to the batch of the channel and return
+        if self.coalescer:
+            self.coalescer.add((channel, message), member)
+            return
+
+        # Otherwise, queue a message for the channel
+        text = self.render(compile_template(message), [member.mention], channel)
+        if not await self.bot.outbound.announce(channel, text):
+            LOGGER.warning("Welcome message for %s on guild %s was dropped", member.id, member.guild.id,
+                           extra={"key": ("welcome dropped", member.guild.id)})
+            return
         # And log about it
-        LOGGER.info("Welcome message sent to %s on channel %s for guild %s", member.id, channel_id, member.guild.id)
+        LOGGER.debug("Welcome message sent to %s on channel %s for guild %s", member.id, channel_id, member.guild.id)
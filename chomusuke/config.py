@@ -0,0 +1,76 @@
+import json
+import logging
+import os
+
+LOGGER = logging.getLogger("chomusuke")
+
+
+def parse_timeouts(text: str):
+    """
+    Parses the time limits of some operations or phases, like "get=2,add_uses=30".
+    """
+    output = {}
+    for item in text.split(","):
+        if item.strip():
+            name, seconds = item.split("=")
+            output[name.strip()] = float(seconds)
+    return output
+
+
+def config_from_env():
+    """
+    Generates a dict with configuration values from the environment variables.
+    """
+    # Notify the user
+    LOGGER.info("Using environment variables for the configuration")
+    # Create a dictionary with the info that we need
+    output = {
+        "token": os.environ["DISCORD_TOKEN"],
+        "prefix": os.environ.get("DISCORD_PREFIX", "!"),
+        "cogs": os.environ.get("DISCORD_COGS", "").split(","),
+        "database": os.environ.get("MONGODB_URL", ""),
+        "storage": os.environ.get("STORAGE", ""),
+        "database_timeout": float(os.environ.get("DATABASE_TIMEOUT", 10)),
+        "storage_timeout": float(os.environ.get("STORAGE_TIMEOUT", 5)),
+        "storage_timeouts": parse_timeouts(os.environ.get("STORAGE_TIMEOUTS", "")),
+        "breaker_threshold": int(os.environ.get("BREAKER_THRESHOLD", 5)),
+        "breaker_reset": float(os.environ.get("BREAKER_RESET", 30)),
+        "sqlite": os.environ.get("SQLITE_PATH", "chomusuke.db"),
+        "global_concurrency": int(os.environ.get("GLOBAL_CONCURRENCY", 50)),
+        "guild_concurrency": int(os.environ.get("GUILD_CONCURRENCY", 4)),
+        "command_queue": int(os.environ.get("COMMAND_QUEUE", 100)),
+        "command_queue_timeout": float(os.environ.get("COMMAND_QUEUE_TIMEOUT", 10)),
+        "outbound_deadline": float(os.environ.get("OUTBOUND_DEADLINE", 60)),
+        "outbound_drain": float(os.environ.get("OUTBOUND_DRAIN", 5)),
+        "metrics_port": int(os.environ.get("METRICS_PORT", 0)),
+        "metrics_host": os.environ.get("METRICS_HOST", "127.0.0.1"),
+        "tag_cache_size": int(os.environ.get("TAG_CACHE_SIZE", 1024)),
+        "tag_cache_ttl": int(os.environ.get("TAG_CACHE_TTL", 300)),
+        "tag_cache_memory": int(os.environ.get("TAG_CACHE_MEMORY", 0)),
+        "welcome_window": float(os.environ.get("WELCOME_WINDOW", 0)),
+        "welcome_max_delay": float(os.environ.get("WELCOME_MAX_DELAY", 5)),
+        "welcome_batch": int(os.environ.get("WELCOME_BATCH", 25)),
+        "member_cache": os.environ.get("MEMBER_CACHE", "full"),
+        "member_chunking": os.environ.get("MEMBER_CHUNKING", "startup"),
+        "shard_count": int(os.environ.get("SHARD_COUNT", 0)),
+        "identify_concurrency": int(os.environ.get("IDENTIFY_CONCURRENCY", 1)),
+        "restart_backoff": float(os.environ.get("RESTART_BACKOFF", 5)),
+        "restart_max_backoff": float(os.environ.get("RESTART_MAX_BACKOFF", 300)),
+        "shutdown_deadlines": parse_timeouts(os.environ.get("SHUTDOWN_DEADLINES", ""))
+    }
+    # And return it
+    return output
+
+
+def config_from_json(file):
+    """
+    Generates a dict with configuration values from a JSON file.
+    """
+    # Notify the user about the loading
+    LOGGER.info("Loading configuration from %s", file)
+    # Open the file for reading
+    with open(file, encoding="utf-8") as opened:
+        # Get the contents as JSON
+        output = json.load(opened)
+    # If everything succeeds, return the output
+    return output
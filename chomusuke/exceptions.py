@@ -14,3 +14,21 @@ class DatabaseRequired(FeatureRequired):
     """
     Exception raised when a Cog requires a MongoDB instance but is not available or is disabled.
     """
+
+
+class DatabaseUnavailable(ChomusukeException):
+    """
+    Exception raised when the storage of the bot can't be reached.
+    """
+
+
+class Overloaded(ChomusukeException):
+    """
+    Exception raised when a command can't run because there are too many commands running or waiting.
+    """
+
+
+class TemplateError(ChomusukeException):
+    """
+    Exception raised when the text of a template is not valid.
+    """
@@ -0,0 +1,73 @@
+import argparse
+import subprocess
+import sys
+
+# The modules that should only be imported when a cog or feature that needs them is used
+DEFERRED = ("git", "motor", "pymongo", "aiosqlite", "aiohttp.web", "chomusuke.cogs")
+
+
+def measure(module: str):
+    """
+    Imports a module on a new interpreter and gets the time taken by every module as (name, self, cumulative).
+    """
+    # Run the import with the import times enabled (they are written to STDERR)
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if process.returncode:
+        raise RuntimeError(f"Unable to import {module}:\n{process.stderr}")
+
+    # Parse the lines like "import time:       157 |     290374 |     discord.ext"
+    modules = []
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        modules.append((name.strip(), int(own), int(cumulative)))
+    return modules
+
+
+def parse_args():
+    """
+    Parses the command line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Checks the time taken to import the core of the bot")
+    parser.add_argument("--module", default="chomusuke.bot", help="the module to import")
+    parser.add_argument("--budget", type=float, default=1500, help="the maximum milliseconds for the import")
+    parser.add_argument("--top", type=int, default=10, help="the number of slowest modules to show")
+    return parser.parse_args()
+
+
+def main():
+    """
+    Measures the import time of the bot and exits with an error if is over the budget.
+    """
+    args = parse_args()
+    # -X importtime is only available on Python 3.7 and newer
+    if sys.version_info < (3, 7):
+        print("The import times can't be measured on Python versions older than 3.7")
+        return
+
+    modules = measure(args.module)
+    # The total time is the time spent on every module
+    total = sum(own for _, own, _ in modules) / 1000
+    print(f"Importing {args.module} took {total:.1f}ms ({len(modules)} modules, budget of {args.budget:.0f}ms)")
+    # Show the modules that took the most time by themselves
+    for name, own, cumulative in sorted(modules, key=lambda x: x[1], reverse=True)[:args.top]:
+        print(f"  {own / 1000:8.1f}ms {cumulative / 1000:8.1f}ms  {name}")
+
+    # Check the modules that should not be imported
+    failed = False
+    for name in sorted(name for name, _, _ in modules):
+        if any(name == deferred or name.startswith(deferred + ".") for deferred in DEFERRED):
+            print(f"{name} should only be imported when is used")
+            failed = True
+    # And check the budget
+    if total > args.budget:
+        print(f"The import time is over the budget by {total - args.budget:.1f}ms")
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
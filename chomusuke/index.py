@@ -0,0 +1,224 @@
+import bisect
+import heapq
+import math
+import re
+from collections import Counter
+
+# The pattern of the words used by the text search, without the underscores
+WORD = re.compile(r"[^\W_]+")
+# The number of times that a word on the name of a tag counts, compared to one on the content
+NAME_WEIGHT = 3
+# The parameters of the BM25 ranking, for the saturation of repeated words and the normalization of the length
+K1 = 1.2
+B = 0.75
+# How many times the tags of a word must outnumber the tags already found to only rank those
+COMMON = 8
+
+
+def trigrams(text: str):
+    """
+    Gets the set of trigrams of a text, padded so short texts also have some.
+    """
+    # Pad the text, so the start and end of the words are also compared
+    padded = f"  {text.lower()} "
+    # And return every combination of three characters
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def words(text: str):
+    """
+    Splits a text into lowercase words for the text search.
+    """
+    return WORD.findall(text.lower())
+
+
+class NameIndex:
+    """
+    In-memory index of the names of the tags of a single guild.
+
+    The names are kept sorted for prefix completion and split into trigrams for finding similar names.
+    """
+    def __init__(self, names=()):
+        """
+        Initializes a new Name Index.
+        :param names: The names to add to the index.
+        """
+        # The sorted list of (lowercase name, name) for prefix searches
+        self._sorted = []
+        # The trigrams of every name and the names that contain a trigram
+        self._trigrams = {}
+        self._postings = {}
+        # Add the initial names, sorting them only once
+        for name in names:
+            self._add_trigrams(name)
+        self._sorted = sorted((name.lower(), name) for name in self._trigrams)
+
+    def __len__(self):
+        return len(self._trigrams)
+
+    def __contains__(self, name):
+        return name in self._trigrams
+
+    def add(self, name: str):
+        """
+        Adds a name to the index.
+        """
+        # If the name is already present, return
+        if name in self._trigrams:
+            return
+        # Otherwise, add it on the sorted list and the trigrams
+        bisect.insort(self._sorted, (name.lower(), name))
+        self._add_trigrams(name)
+
+    def remove(self, name: str):
+        """
+        Removes a name from the index.
+        """
+        # If the name is not present, return
+        if name not in self._trigrams:
+            return
+        # Remove it from the sorted list
+        position = bisect.bisect_left(self._sorted, (name.lower(), name))
+        del self._sorted[position]
+        # And from the trigrams
+        for trigram in self._trigrams.pop(name):
+            names = self._postings[trigram]
+            names.discard(name)
+            if not names:
+                del self._postings[trigram]
+
+    def complete(self, prefix: str, limit: int = 25):
+        """
+        Gets the names that start with the specified text, ignoring the case.
+        """
+        # Find where the names with the prefix start
+        prefix = prefix.lower()
+        position = bisect.bisect_left(self._sorted, (prefix,))
+        output = []
+        # And add names until the prefix no longer matches
+        for lowered, name in self._sorted[position:position + limit]:
+            if not lowered.startswith(prefix):
+                break
+            output.append(name)
+        return output
+
+    def suggest(self, text: str, limit: int = 3, threshold: float = 0.3):
+        """
+        Gets the names that are the most similar to the specified text.
+        """
+        # Get the trigrams of the text
+        query = trigrams(text)
+        # Count the trigrams shared with every name
+        shared = Counter()
+        for trigram in query:
+            shared.update(self._postings.get(trigram, ()))
+
+        # Calculate the similarity of the names (Dice coefficient) and ignore the ones that are too different
+        scores = []
+        for name, count in shared.items():
+            score = 2 * count / (len(query) + len(self._trigrams[name]))
+            if score >= threshold:
+                scores.append((-score, name))
+        # And return the most similar ones
+        scores.sort()
+        return [name for _, name in scores[:limit]]
+
+    def _add_trigrams(self, name: str):
+        """
+        Adds the trigrams of a name to the index.
+        """
+        grams = trigrams(name)
+        self._trigrams[name] = grams
+        for trigram in grams:
+            self._postings.setdefault(trigram, set()).add(name)
+
+
+class TextIndex:
+    """
+    In-memory inverted index of the names and contents of the tags of a single guild.
+
+    Every word points to the tags where it appears, so a search only looks at the tags that contain the words.
+    """
+    def __init__(self, tags=()):
+        """
+        Initializes a new Text Index.
+        :param tags: The (name, content) of the tags to add to the index.
+        """
+        # The words of every tag as name -> word -> weighted count, and the length of them
+        self._words = {}
+        self._lengths = {}
+        self._total = 0
+        # The tags that contain a word as word -> name -> weighted count
+        self._postings = {}
+        for name, content in tags:
+            self.add(name, content)
+
+    def __len__(self):
+        return len(self._words)
+
+    def __contains__(self, name):
+        return name in self._words
+
+    def add(self, name: str, content: str):
+        """
+        Adds a tag to the index, replacing the previous version of it.
+        """
+        # Remove the old version, if any
+        self.remove(name)
+        # Count the words of the name and the content, giving more weight to the name
+        counts = Counter()
+        for word in words(name):
+            counts[word] += NAME_WEIGHT
+        counts.update(words(content))
+        # And save them
+        self._words[name] = counts
+        length = sum(counts.values())
+        self._lengths[name] = length
+        self._total += length
+        for word, count in counts.items():
+            self._postings.setdefault(word, {})[name] = count
+
+    def remove(self, name: str):
+        """
+        Removes a tag from the index.
+        """
+        # If the tag is not present, return
+        counts = self._words.pop(name, None)
+        if counts is None:
+            return
+        # Otherwise, remove it from the words that it contains
+        self._total -= self._lengths.pop(name)
+        for word in counts:
+            names = self._postings[word]
+            del names[name]
+            if not names:
+                del self._postings[word]
+
+    def search(self, text: str, limit: int = 10):
+        """
+        Gets the names of the tags that contain any of the words of a text, the most relevant first.
+        """
+        # If no tag has words, there is nothing to find
+        if not self._total:
+            return []
+        # Rank the tags with BM25, so rare words and short tags count more than common words and long tags
+        count = len(self._words)
+        base = K1 * (1 - B)
+        scale = K1 * B * count / self._total
+        lengths = self._lengths
+        scores = {}
+        # Start with the rarest words, which find the most relevant tags
+        postings = sorted((self._postings[word] for word in set(words(text)) if word in self._postings), key=len)
+        for names in postings:
+            weight = math.log(1 + (count - len(names) + 0.5) / (len(names) + 0.5)) * (K1 + 1)
+            # If the word is much more common than the tags found, only use it to rank those tags
+            if scores and len(names) > COMMON * len(scores):
+                for name, score in scores.items():
+                    frequency = names.get(name, 0)
+                    if frequency:
+                        scores[name] = score + weight * frequency / (frequency + base + scale * lengths[name])
+                continue
+            for name, frequency in names.items():
+                scores[name] = scores.get(name, 0) + weight * frequency / (frequency + base + scale * lengths[name])
+        # And return the best ones, using the name when the score is the same
+        return [name for name, _ in heapq.nsmallest(limit, scores.items(), key=lambda x: (-x[1], x[0]))]
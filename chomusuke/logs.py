@@ -0,0 +1,99 @@
+import copy
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler
+
+
+class LogQueueHandler(QueueHandler):
+    """
+    Puts the log records on a queue, so they are formatted and written by a listener on another thread.
+    """
+    def prepare(self, record):
+        # The queue is on the same process, so only the arguments are merged now (in case they change later)
+        # and the rest of the formatting (including the exceptions) is left to the thread of the listener
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Drops the repeated log records of the same key, like the same missing channel of a guild.
+
+    The key is the key value of the extra arguments, or the message and arguments when there is none.
+    """
+    def __init__(self, limit: int = 10, interval: float = 60, max_keys: int = 10000):
+        """
+        Initializes a new Rate Limit Filter.
+        :param limit: The records of a key that are logged on every interval, or zero for no limit.
+        :param interval: The seconds of the intervals.
+        :param max_keys: The maximum number of keys remembered.
+        """
+        super().__init__()
+        self.limit = limit
+        self.interval = interval
+        self.max_keys = max_keys
+        # The interval of every key as key -> [start, records, dropped records]
+        self.windows = OrderedDict()
+        # The records can come from the executors, so the keys are only used by a thread at a time
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if not self.limit:
+            return True
+        key = getattr(record, "key", None) or (record.msg, record.args)
+        now = time.monotonic()
+        with self.lock:
+            # Get the interval of the key, logging the record if the key can't be used (like with dicts as arguments)
+            try:
+                window = self.windows.get(key, None)
+            except TypeError:
+                return True
+
+            # If this is a new interval, start it and say how many records were dropped during the last one
+            if window is None or now - window[0] >= self.interval:
+                if window and window[2] and isinstance(record.msg, str):
+                    record.msg += f" ({window[2]} similar messages were not logged)"
+                self.windows[key] = [now, 1, 0]
+                self.windows.move_to_end(key)
+                while len(self.windows) > self.max_keys:
+                    self.windows.popitem(last=False)
+                return True
+
+            # Otherwise, log the record only if the key is under the limit
+            window[1] += 1
+            if window[1] <= self.limit:
+                return True
+            window[2] += 1
+            return False
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formats the log records as a line of JSON, for log collectors.
+    """
+    def __init__(self, worker: int = None):
+        """
+        Initializes a new JSON Formatter.
+        :param worker: The number of the worker of the cluster that is logging, if any.
+        """
+        super().__init__()
+        self.worker = worker
+
+    def format(self, record):
+        output = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "file": record.filename,
+            "message": record.getMessage()
+        }
+        if self.worker is not None:
+            output["worker"] = self.worker
+        if record.exc_info:
+            output["exception"] = self.formatException(record.exc_info)
+        return json.dumps(output, ensure_ascii=False, default=str)
@@ -0,0 +1,111 @@
+import itertools
+import logging
+import sys
+
+import discord
+
+from .cache import LRUCache, MISSING, estimate_size
+
+LOGGER = logging.getLogger("chomusuke")
+# The attributes of the members and users that point to objects shared with the rest of the cache
+SHARED = {"guild", "_state", "_user"}
+
+
+def member_options(policy: str = "full", chunking: str = "startup"):
+    """
+    Gets the arguments of the bot for a member cache policy.
+    :param policy: none (no members), active (only the members seen by the bot) or full (every member).
+    :param chunking: startup (request the members before ready) or background (request them after ready).
+    """
+    # No members or user updates at all, only the authors of the messages
+    if policy == "none":
+        return {"guild_subscriptions": False, "fetch_offline_members": False}
+    # The members that are online or send something, without requesting the offline ones
+    if policy == "active":
+        return {"guild_subscriptions": True, "fetch_offline_members": False}
+    # Every member, requested by discord.py during the startup or by the bot later
+    if policy == "full":
+        if chunking not in ("startup", "background"):
+            raise ValueError(f"Unknown member chunking strategy: {chunking}")
+        return {"guild_subscriptions": True, "fetch_offline_members": chunking == "startup"}
+    raise ValueError(f"Unknown member cache policy: {policy}")
+
+
+def estimate_object(value):
+    """
+    Calculates the approximate size in bytes of an object with slots, without the objects shared with others.
+    """
+    size = sys.getsizeof(value)
+    for cls in type(value).__mro__:
+        for slot in getattr(cls, "__slots__", ()):
+            if slot not in SHARED:
+                size += estimate_size(getattr(value, slot, None))
+    return size
+
+
+def average_size(objects, sample: int = 1000):
+    """
+    Calculates the average size of some objects, using only the first ones.
+    """
+    sizes = [estimate_object(value) for value in itertools.islice(objects, sample)]
+    return sum(sizes) / len(sizes) if sizes else 0
+
+
+def cache_memory(bot, sample: int = 1000):
+    """
+    Calculates the approximate memory used by the members of every guild and the users.
+
+    Returns the bytes used by the users and a list of (guild, members, bytes) sorted by size.
+    """
+    # Calculate the average size of the members and users with a sample
+    members = itertools.chain.from_iterable(guild._members.values() for guild in bot.guilds)
+    member_size = average_size(members, sample)
+    user_size = average_size(bot._connection._users.values(), sample)
+    # And use it for the guilds and users
+    guilds = [(guild, len(guild._members), int(len(guild._members) * member_size + sys.getsizeof(guild._members)))
+              for guild in bot.guilds]
+    guilds.sort(key=lambda x: x[2], reverse=True)
+    return int(len(bot._connection._users) * user_size), guilds
+
+
+class MemberLookup:
+    """
+    Gets members from the cache of discord.py, requesting the ones that are not cached to Discord.
+    """
+    def __init__(self, max_items: int = 1024, ttl: float = 300):
+        """
+        Initializes a new Member Lookup.
+        :param max_items: The maximum number of members requested to Discord that are kept.
+        :param ttl: The time in seconds before a member requested to Discord expires.
+        """
+        self.cache = LRUCache(max_items, ttl)
+
+    async def get(self, guild: discord.Guild, user_id: int):
+        """
+        Gets a member of a guild, or None if the user is not part of it.
+        """
+        # If the member is on the cache of discord.py, return it
+        member = guild.get_member(user_id)
+        if member:
+            return member
+        # If the member was already requested, return it
+        key = (guild.id, user_id)
+        member = self.cache.get(key)
+        if member is MISSING:
+            return None
+        if member is not None:
+            return member
+
+        # Otherwise, request it
+        try:
+            member = await guild.fetch_member(user_id)
+        except discord.NotFound:
+            self.cache.put_missing(key)
+            return None
+        except discord.HTTPException:
+            LOGGER.exception("Unable to fetch the member %s of the guild %s", user_id, guild.id)
+            return None
+        # Save it
+        self.cache.put(key, member)
+        # And return it
+        return member
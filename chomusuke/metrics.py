@@ -0,0 +1,240 @@
+import asyncio
+import bisect
+import logging
+import time
+
+LOGGER = logging.getLogger("chomusuke")
+# The default buckets of the histograms, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def format_labels(names, values, extra: str = ""):
+    """
+    Formats the labels of a sample on the Prometheus text format.
+    """
+    # Escape the values and join them with the names
+    labels = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    # Add the extra label (if any)
+    if extra:
+        labels.append(extra)
+    # And return them, if there are any
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def escape(value):
+    """
+    Escapes the value of a label.
+    """
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    """
+    A value that only goes up, like the number of errors, optionally calculated when the metrics are requested.
+    """
+    type = "counter"
+
+    def __init__(self, name: str, description: str, labels=(), callback=None):
+        """
+        Initializes a new Counter.
+        :param callback: The function that returns the values as a dict of labels -> value.
+        """
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.values = {}
+        self.callback = callback
+
+    def inc(self, *labels, amount: float = 1):
+        """
+        Increases the value for the specified labels.
+        """
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        """
+        Gets the lines with the values of the counter.
+        """
+        # If there is a callback, update the values with it
+        if self.callback:
+            self.values = self.callback()
+        # And return the lines
+        for labels, value in self.values.items():
+            yield f"{self.name}{format_labels(self.labels, labels)} {value}"
+
+
+class Gauge(Counter):
+    """
+    A value that can go up and down, optionally calculated when the metrics are requested.
+    """
+    type = "gauge"
+
+    def set(self, *labels, value: float):
+        """
+        Sets the value for the specified labels.
+        """
+        self.values[labels] = value
+
+
+class Histogram:
+    """
+    Counts the number of values that fall inside of specific ranges, like the latency of the commands.
+    """
+    type = "histogram"
+
+    def __init__(self, name: str, description: str, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # The values for every set of labels as [count per bucket, sum, count]
+        self.values = {}
+
+    def observe(self, *labels, value: float):
+        """
+        Adds a value for the specified labels.
+        """
+        # Get the values of the labels, or create them
+        values = self.values.get(labels, None)
+        if values is None:
+            values = self.values[labels] = [[0] * (len(self.buckets) + 1), 0, 0]
+        # Add the value on the first bucket where it fits
+        values[0][bisect.bisect_left(self.buckets, value)] += 1
+        values[1] += value
+        values[2] += 1
+
+    def samples(self):
+        """
+        Gets the lines with the buckets, sum and count of the histogram.
+        """
+        for labels, (buckets, total, count) in self.values.items():
+            # The buckets are cumulative, so add the previous ones
+            cumulative = 0
+            for bound, value in zip(self.buckets + ("+Inf",), buckets):
+                cumulative += value
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{format_labels(self.labels, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{format_labels(self.labels, labels)} {total}"
+            yield f"{self.name}_count{format_labels(self.labels, labels)} {count}"
+
+
+class Registry:
+    """
+    Collection of metrics that can be exported on the Prometheus text format.
+    """
+    def __init__(self):
+        self.metrics = {}
+
+    def add(self, metric):
+        """
+        Adds a metric to the registry, or returns the existing one with the same name.
+        """
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, description: str, labels=(), callback=None):
+        """
+        Creates a new counter or returns the existing one with the same name.
+        """
+        return self.add(Counter(name, description, labels, callback))
+
+    def gauge(self, name: str, description: str, labels=(), callback=None):
+        """
+        Creates a new gauge or returns the existing one with the same name.
+        """
+        return self.add(Gauge(name, description, labels, callback))
+
+    def histogram(self, name: str, description: str, labels=(), buckets=BUCKETS):
+        """
+        Creates a new histogram or returns the existing one with the same name.
+        """
+        return self.add(Histogram(name, description, labels, buckets))
+
+    def render(self):
+        """
+        Gets all of the metrics on the Prometheus text format.
+        """
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+class InstrumentedStorage:
+    """
+    Measures the time and errors of the coroutines of a storage, like the ones of bot.storage.tags.
+    """
+    def __init__(self, target, collection: str, latency: Histogram, errors: Counter):
+        """
+        Initializes a new Instrumented Storage.
+        :param target: The storage to measure.
+        :param collection: The name of the type of data stored, used as a label.
+        :param latency: The histogram for the time taken by the operations.
+        :param errors: The counter of the operations that failed.
+        """
+        self._target = target
+        self._collection = collection
+        self._latency = latency
+        self._errors = errors
+
+    def __getattr__(self, name):
+        # Get the attribute from the storage
+        value = getattr(self._target, name)
+        # If is not a coroutine, return it as is
+        if not asyncio.iscoroutinefunction(value):
+            return value
+
+        async def measure(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await value(*args, **kwargs)
+            except Exception as e:
+                self._errors.inc(self._collection, name, type(e).__name__)
+                raise
+            finally:
+                self._latency.observe(self._collection, name, value=time.perf_counter() - start)
+
+        # Save the wrapper, so is not created again
+        self.__dict__[name] = measure
+        return measure
+
+
+class MetricsServer:
+    """
+    Local HTTP server that exports the metrics for Prometheus.
+    """
+    def __init__(self, registry: Registry, host: str = "127.0.0.1", port: int = 9100):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.runner = None
+
+    async def handle(self, request):
+        """
+        Returns the metrics on the Prometheus text format.
+        """
+        from aiohttp import web
+        return web.Response(text=self.registry.render(), content_type="text/plain", charset="utf-8")
+
+    async def start(self):
+        """
+        Starts listening for requests.
+        """
+        # Import aiohttp only when the server is used
+        from aiohttp import web
+        # Create the app with a single route
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle)
+        # And start the server
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        LOGGER.info("Serving the metrics on http://%s:%s/metrics", self.host, self.port)
+
+    async def stop(self):
+        """
+        Stops the server.
+        """
+        if self.runner:
+            await self.runner.cleanup()
@@ -0,0 +1,224 @@
+import asyncio
+import heapq
+import itertools
+import logging
+
+from discord.ext import commands
+
+LOGGER = logging.getLogger("chomusuke")
+# The maximum length of a Discord message
+MESSAGE_LIMIT = 2000
+# The priorities of the messages, where the lowest number is sent first
+REPLY = 0
+ANNOUNCEMENT = 1
+PRIORITIES = {REPLY: "reply", ANNOUNCEMENT: "announcement"}
+
+
+class _Message:
+    """
+    A message waiting to be sent to a channel.
+    """
+    __slots__ = ("priority", "number", "content", "kwargs", "merge", "queued", "deadline", "future")
+
+    def __init__(self, priority: int, number: int, content, kwargs: dict, merge: bool, queued: float,
+                 deadline: float, future):
+        self.priority = priority
+        self.number = number
+        self.content = content
+        self.kwargs = kwargs
+        self.merge = merge
+        self.queued = queued
+        self.deadline = deadline
+        self.future = future
+
+    def __lt__(self, other):
+        # Sort by priority, and then in the order that the messages were added
+        return (self.priority, self.number) < (other.priority, other.number)
+
+
+class OutboundDispatcher:
+    """
+    Sends the messages of the bot through a queue per channel.
+
+    Every channel sends a single message at a time (so the rate limits of discord.py are respected), picking the
+    command replies before the announcements. Queued announcements are merged into a single message when possible, and
+    the ones that waited for too long are dropped.
+    """
+    def __init__(self, loop, registry, deadline: float = 60):
+        """
+        Initializes a new Outbound Dispatcher.
+        :param loop: The event loop used for the tasks that send the messages.
+        :param registry: The registry where the metrics of the queues are saved.
+        :param deadline: The maximum seconds that an announcement can wait before being dropped.
+        """
+        self.loop = loop
+        self.deadline = deadline
+        # The messages waiting as channel ID -> heap of messages, and the tasks sending them
+        self.queues = {}
+        self.workers = {}
+        # The number used to keep the order of the messages with the same priority
+        self.counter = itertools.count()
+        # And the metrics of the queues
+        registry.gauge("chomusuke_outbound_queued", "Messages waiting to be sent", ["priority"], self.queued)
+        self.sent = registry.counter("chomusuke_outbound_sent_total", "Messages sent", ["priority"])
+        self.merged = registry.counter("chomusuke_outbound_merged_total", "Messages merged into another one",
+                                       ["priority"])
+        self.dropped = registry.counter("chomusuke_outbound_dropped_total", "Messages dropped for waiting too long",
+                                        ["priority"])
+        self.wait = registry.histogram("chomusuke_outbound_wait_seconds", "Time waited by the messages before sending",
+                                       ["priority"])
+
+    def queued(self):
+        """
+        Gets the number of messages waiting for every priority.
+        """
+        counts = {(name,): 0 for name in PRIORITIES.values()}
+        for queue in self.queues.values():
+            for message in queue:
+                counts[(PRIORITIES[message.priority],)] += 1
+        return counts
+
+    async def send(self, channel, content=None, *, priority: int = REPLY, merge: bool = False,
+                   deadline: float = None, **kwargs):
+        """
+        Sends a message to a channel, waiting on the queue of the channel if other messages are being sent.
+
+        Returns the message sent, or None if the message was dropped.
+        :param channel: The channel (or any other Messageable) where the message should be sent.
+        :param content: The text of the message.
+        :param priority: The priority of the message.
+        :param merge: If the text can be merged with other messages of the same priority.
+        :param deadline: The maximum seconds that the message can wait, or None to wait forever.
+        :param kwargs: The other arguments of the send method of the channel.
+        """
+        # If nothing is being sent to the channel, send the message right away
+        if channel.id not in self.workers:
+            return await self.send_now(channel, content, priority, kwargs)
+
+        now = self.loop.time()
+        future = self.loop.create_future()
+        # Only plain text can be merged
+        merge = merge and not kwargs and content is not None
+        message = _Message(priority, next(self.counter), content, kwargs, merge, now,
+                           now + deadline if deadline is not None else None, future)
+        # Otherwise, add the message to the queue of the channel
+        heapq.heappush(self.queues.setdefault(channel.id, []), message)
+        # And wait until is sent
+        return await future
+
+    async def send_now(self, channel, content, priority: int, kwargs: dict):
+        """
+        Sends a message to a channel that has nothing on the queue.
+        """
+        # Mark the channel as busy, so the other messages wait on the queue
+        self.workers[channel.id] = None
+        try:
+            sent = await channel.send(content, **kwargs)
+        finally:
+            # Once is sent, start sending the messages that were queued in the meantime (if any)
+            del self.workers[channel.id]
+            if channel.id in self.queues:
+                self.workers[channel.id] = self.loop.create_task(self.work(channel))
+        # And save the metrics
+        name = PRIORITIES[priority]
+        self.sent.inc(name)
+        self.wait.observe(name, value=0)
+        return sent
+
+    async def announce(self, channel, content: str):
+        """
+        Sends a background message to a channel, like a welcome message.
+        """
+        return await self.send(channel, content, priority=ANNOUNCEMENT, merge=True, deadline=self.deadline)
+
+    def expired(self, message: _Message, now: float):
+        """
+        Checks if a message waited for too long, dropping it if that is the case.
+        """
+        if message.deadline is None or now <= message.deadline:
+            return False
+        self.dropped.inc(PRIORITIES[message.priority])
+        if not message.future.done():
+            message.future.set_result(None)
+        return True
+
+    async def work(self, channel):
+        """
+        Sends the messages of a channel until there are no more in the queue.
+        """
+        queue = self.queues[channel.id]
+        try:
+            while queue:
+                # Take the next message, skipping the ones that nobody is waiting for or waited for too long
+                message = heapq.heappop(queue)
+                now = self.loop.time()
+                if message.future.done() or self.expired(message, now):
+                    continue
+
+                # If the text can be merged, add the next messages while they fit
+                group = [message]
+                content = message.content
+                while message.merge and queue and queue[0].merge and queue[0].priority == message.priority:
+                    # If the next message waited for too long, drop it
+                    if queue[0].future.done() or self.expired(queue[0], now):
+                        heapq.heappop(queue)
+                        continue
+                    # If it does not fit, stop
+                    if len(content) + len(queue[0].content) + 1 > MESSAGE_LIMIT:
+                        break
+                    other = heapq.heappop(queue)
+                    content += "\n" + other.content
+                    group.append(other)
+
+                # Then, send the message
+                try:
+                    sent = await channel.send(content, **message.kwargs)
+                except Exception as e:
+                    for item in group:
+                        if not item.future.done():
+                            item.future.set_exception(e)
+                    continue
+
+                # And return it to everybody waiting
+                name = PRIORITIES[message.priority]
+                self.sent.inc(name)
+                self.merged.inc(name, amount=len(group) - 1)
+                now = self.loop.time()
+                for item in group:
+                    self.wait.observe(name, value=now - item.queued)
+                    if not item.future.done():
+                        item.future.set_result(sent)
+        finally:
+            # Once there is nothing else to send, remove the task
+            del self.workers[channel.id]
+            if not queue:
+                del self.queues[channel.id]
+
+    async def drain(self, timeout: float = 5):
+        """
+        Waits for the messages to be sent, and cancels the ones that are still waiting after the timeout.
+        """
+        # Wait for the tasks to finish
+        tasks = [task for task in self.workers.values() if task]
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+        # Cancel the ones that are still running
+        for task in tasks:
+            task.cancel()
+        # And the messages that were not sent
+        count = 0
+        for queue in self.queues.values():
+            for message in queue:
+                message.future.cancel()
+            count += len(queue)
+        self.queues.clear()
+        if count:
+            LOGGER.warning("%s messages were not sent before closing", count)
+
+
+class OutboundContext(commands.Context):
+    """
+    Context of a command that sends the replies through the outbound dispatcher of the bot.
+    """
+    async def send(self, content=None, **kwargs):
+        return await self.bot.outbound.send(self.channel, content, **kwargs)
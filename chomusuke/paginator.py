@@ -0,0 +1,129 @@
+import asyncio
+
+import discord
+from discord.ext import commands
+
+# The reactions used to navigate between the pages
+PREVIOUS = "\N{BLACK LEFT-POINTING TRIANGLE}"
+NEXT = "\N{BLACK RIGHT-POINTING TRIANGLE}"
+# The maximum length of the description of an embed
+DESCRIPTION_LIMIT = 2048
+
+
+class KeysetPaginator:
+    """
+    Shows a list of items one page at a time, with reactions for moving between the pages.
+
+    Pages are requested when they are shown by calling fetch(after, limit), where after is the last item of the
+    previous page (or None for the first page), so the database can continue from an index instead of skipping items.
+    """
+    def __init__(self, ctx: commands.Context, fetch, title: str, per_page: int = 50, timeout: float = 60):
+        """
+        Initializes a new Keyset Paginator.
+        :param ctx: The context of the command that requested the list.
+        :param fetch: The coroutine function that returns the items after a specific one.
+        :param title: The title of the embed.
+        :param per_page: The number of items shown on every page.
+        :param timeout: The seconds to wait for a reaction before stopping.
+        """
+        self.ctx = ctx
+        self.fetch = fetch
+        self.title = title
+        self.per_page = per_page
+        self.timeout = timeout
+        # The item before the start of every page that we have seen, the first page starts from nothing
+        self.starts = [None]
+        # The current page and the items on it
+        self.page = 0
+        self.items = []
+        self.more = False
+
+    async def load(self, page: int):
+        """
+        Requests the items of a specific page.
+        """
+        # Request one extra item, so we know if there is a next page
+        items = await self.fetch(self.starts[page], self.per_page + 1)
+        # Save the items and the page
+        self.page = page
+        self.more = len(items) > self.per_page
+        self.items = items[:self.per_page]
+        # If there is a next page and we don't know where it starts, save it
+        if self.more and len(self.starts) == page + 1:
+            self.starts.append(self.items[-1])
+
+    def render(self):
+        """
+        Creates the embed for the current page.
+        """
+        # Join the items and make sure that they fit on the embed
+        description = ", ".join(self.items)
+        if len(description) > DESCRIPTION_LIMIT:
+            description = description[:DESCRIPTION_LIMIT - 3] + "..."
+
+        # Create the embed with the items
+        embed = discord.Embed()
+        embed.title = self.title
+        embed.description = description
+        embed.set_footer(text=f"Page {self.page + 1}" + ("" if self.more else " (last)"))
+        # And return it
+        return embed
+
+    async def start(self):
+        """
+        Shows the first page and starts listening for reactions.
+
+        Returns False if there are no items to show.
+        """
+        # Load the first page
+        await self.load(0)
+        # If there are no items, return
+        if not self.items:
+            return False
+
+        # Send the first page
+        message = await self.ctx.send(embed=self.render())
+        # If there is a single page, there is no need to navigate
+        if not self.more:
+            return True
+
+        # Add the reactions for navigating
+        await message.add_reaction(PREVIOUS)
+        await message.add_reaction(NEXT)
+
+        def check(reaction, user):
+            return reaction.message.id == message.id and user == self.ctx.author and \
+                str(reaction.emoji) in (PREVIOUS, NEXT)
+
+        while True:
+            # Wait for the author to react
+            try:
+                reaction, user = await self.ctx.bot.wait_for("reaction_add", check=check, timeout=self.timeout)
+            # If nothing happened, stop listening
+            except asyncio.TimeoutError:
+                break
+
+            # Try to remove the reaction of the user, so it can be used again
+            try:
+                await message.remove_reaction(reaction.emoji, user)
+            except discord.Forbidden:
+                pass
+
+            # Select the page to show
+            if str(reaction.emoji) == NEXT and self.more:
+                page = self.page + 1
+            elif str(reaction.emoji) == PREVIOUS and self.page > 0:
+                page = self.page - 1
+            else:
+                continue
+
+            # And show it
+            await self.load(page)
+            await message.edit(embed=self.render())
+
+        # Once we are done, try to remove the reactions
+        try:
+            await message.clear_reactions()
+        except discord.Forbidden:
+            pass
+        return True
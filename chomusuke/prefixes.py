@@ -0,0 +1,99 @@
+from collections import Counter
+
+# The maximum length of the prefix of a guild
+MAX_LENGTH = 10
+
+
+def validate_prefix(prefix: str):
+    """
+    Checks that a prefix can be used, raising a ValueError if it can't.
+    """
+    if not prefix:
+        raise ValueError("The prefix can't be empty")
+    if len(prefix) > MAX_LENGTH:
+        raise ValueError(f"The prefix can't be longer than {MAX_LENGTH} characters")
+    if any(character.isspace() for character in prefix):
+        raise ValueError("The prefix can't have spaces")
+
+
+class PrefixResolver:
+    """
+    Gets the command prefix of the guilds from memory, used as the command_prefix of the bot.
+
+    The first characters of every prefix are kept, so most messages that are not commands are rejected by checking a
+    single character.
+    """
+    def __init__(self, default: str):
+        """
+        Initializes a new Prefix Resolver.
+        :param default: The prefix used on the guilds without a custom prefix and on private messages.
+        """
+        self.default = default
+        # The custom prefixes as guild_id -> prefix
+        self.prefixes = {}
+        # The number of prefixes (including the default one) that start with every character
+        self._counts = Counter(default[:1])
+        self._first = frozenset(self._counts)
+
+    def __len__(self):
+        return len(self.prefixes)
+
+    def __call__(self, bot, message):
+        guild = message.guild
+        return self.prefixes.get(guild.id, self.default) if guild else self.default
+
+    def load(self, prefixes: dict):
+        """
+        Replaces the custom prefixes of every guild, as guild_id -> prefix.
+        """
+        self.prefixes = dict(prefixes)
+        self._counts = Counter(prefix[:1] for prefix in self.prefixes.values())
+        self._counts[self.default[:1]] += 1
+        self._first = frozenset(self._counts)
+
+    def set(self, guild_id: int, prefix: str = None):
+        """
+        Changes the prefix of a guild, or uses the default one if is None.
+        """
+        old = self.prefixes.pop(guild_id, None)
+        if old is not None:
+            self._discard(old)
+        if prefix is not None:
+            self.prefixes[guild_id] = prefix
+            self._counts[prefix[:1]] += 1
+        self._first = frozenset(self._counts)
+
+    def set_default(self, prefix: str):
+        """
+        Changes the prefix used on the guilds without a custom prefix.
+        """
+        self._discard(self.default)
+        self.default = prefix
+        self._counts[prefix[:1]] += 1
+        self._first = frozenset(self._counts)
+
+    def get(self, guild_id: int = None):
+        """
+        Gets the prefix of a guild, or the default one if the guild does not have one.
+        """
+        return self.prefixes.get(guild_id, self.default)
+
+    def matches(self, message):
+        """
+        Checks if a message starts with the prefix of their guild, and could be a command.
+        """
+        content = message.content
+        # Most messages don't start with the first character of any prefix, so reject them right away
+        if not content or content[0] not in self._first:
+            return False
+        guild = message.guild
+        return content.startswith(self.prefixes.get(guild.id, self.default) if guild else self.default)
+
+    def _discard(self, prefix: str):
+        """
+        Removes a prefix from the counts of the first characters.
+        """
+        key = prefix[:1]
+        self._counts[key] -= 1
+        if self._counts[key] <= 0:
+            del self._counts[key]
@@ -0,0 +1,189 @@
+import asyncio
+import contextvars
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from .exceptions import Overloaded
+
+# The guild of the command running on the current task, so the storage operations of the command wait for a slot
+CURRENT_GUILD = contextvars.ContextVar("current_guild", default=None)
+
+
+class FairScheduler:
+    """
+    Limits the commands running at the same time, globally and per guild.
+
+    When there are no free slots, the commands wait on a bounded queue and the guilds take turns when a slot is freed,
+    so a single guild can't use all of the slots while the others wait.
+    """
+    def __init__(self, global_limit: int = 50, guild_limit: int = 4, queue_limit: int = 100,
+                 timeout: float = 10):
+        """
+        Initializes a new Fair Scheduler.
+        :param global_limit: The maximum number of commands running at the same time.
+        :param guild_limit: The maximum number of commands running at the same time on a single guild.
+        :param queue_limit: The maximum number of commands waiting for a slot.
+        :param timeout: The maximum seconds that a command can wait for a slot.
+        """
+        self.global_limit = global_limit
+        self.guild_limit = guild_limit
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        # The number of commands running, in total and per guild
+        self.running = 0
+        self.guild_running = {}
+        # The commands waiting for a slot as guild -> queue of futures, and the order of the guilds
+        self.queues = {}
+        self.turns = deque()
+        self.waiting = 0
+        # The commands refused because the bot was busy
+        self.rejected = 0
+
+    def _can_run(self, guild_id: int):
+        """
+        Checks if a command from the guild can run right now.
+        """
+        return self.running < self.global_limit and self.guild_running.get(guild_id, 0) < self.guild_limit
+
+    def _start(self, guild_id: int):
+        """
+        Marks a command of the guild as running.
+        """
+        self.running += 1
+        self.guild_running[guild_id] = self.guild_running.get(guild_id, 0) + 1
+
+    async def acquire(self, guild_id: int):
+        """
+        Waits until a command from the guild can run.
+
+        Returns the seconds spent waiting, or raises Overloaded if the queue is full or the wait is too long.
+        """
+        # If there is a free slot and nobody from the guild is waiting, start right away
+        if self._can_run(guild_id) and guild_id not in self.queues:
+            self._start(guild_id)
+            return 0
+        # If there are too many commands waiting, refuse this one
+        if self.waiting >= self.queue_limit:
+            self.rejected += 1
+            raise Overloaded("There are too many commands waiting")
+
+        # Otherwise, add the command to the queue of the guild
+        future = asyncio.get_event_loop().create_future()
+        if guild_id not in self.queues:
+            self.queues[guild_id] = deque()
+            self.turns.append(guild_id)
+        self.queues[guild_id].append(future)
+        self.waiting += 1
+        start = time.perf_counter()
+
+        # And wait until it can run
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            # If the slot was given at the same time, keep it unless the command was cancelled
+            if future.done():
+                if isinstance(e, asyncio.CancelledError):
+                    self.release(guild_id)
+                    raise
+            # Otherwise, remove the command from the queue
+            else:
+                self._forget(guild_id, future)
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                self.rejected += 1
+                raise Overloaded("The command waited for too long")
+        return time.perf_counter() - start
+
+    def _forget(self, guild_id: int, future):
+        """
+        Removes a command that is no longer waiting from the queue.
+        """
+        future.cancel()
+        queue = self.queues[guild_id]
+        queue.remove(future)
+        self.waiting -= 1
+        # If there are no more commands from the guild, remove it from the line
+        if not queue:
+            del self.queues[guild_id]
+            self.turns.remove(guild_id)
+
+    def release(self, guild_id: int):
+        """
+        Marks a command of the guild as finished and lets the waiting commands run.
+        """
+        # Free the slot
+        self.running -= 1
+        self.guild_running[guild_id] -= 1
+        if not self.guild_running[guild_id]:
+            del self.guild_running[guild_id]
+
+        # Go over the guilds once, taking turns, while there are free slots
+        for _ in range(len(self.turns)):
+            if self.running >= self.global_limit:
+                break
+            # Take the next guild in line
+            guild = self.turns.popleft()
+            queue = self.queues[guild]
+            # If the guild has a free slot, start the first command
+            if self.guild_running.get(guild, 0) < self.guild_limit:
+                self.waiting -= 1
+                self._start(guild)
+                queue.popleft().set_result(None)
+            # If the guild still has commands waiting, put it at the end of the line
+            if queue:
+                self.turns.append(guild)
+            else:
+                del self.queues[guild]
+
+    @asynccontextmanager
+    async def slot(self, guild_id: int):
+        """
+        Runs the code inside of the with block once a command from the guild can run, giving the seconds waited.
+        """
+        waited = await self.acquire(guild_id)
+        try:
+            yield waited
+        finally:
+            self.release(guild_id)
+
+
+class ScheduledStorage:
+    """
+    Runs the coroutines of a storage, like the ones of bot.storage.tags, on a slot of a Fair Scheduler when they are
+    used by a command of a guild.
+
+    Only the storage operations hold the slots, so the commands waiting for something else (like the reactions of a
+    paginator) don't stop the commands of the other users.
+    """
+    def __init__(self, target, scheduler: FairScheduler, wait):
+        """
+        Initializes a new Scheduled Storage.
+        :param target: The storage to limit.
+        :param scheduler: The scheduler that gives the slots.
+        :param wait: The histogram for the time waited by the operations.
+        """
+        self._target = target
+        self._scheduler = scheduler
+        self._wait = wait
+
+    def __getattr__(self, name):
+        # Get the attribute from the storage
+        value = getattr(self._target, name)
+        # If is not a coroutine, return it as is
+        if not asyncio.iscoroutinefunction(value):
+            return value
+
+        async def scheduled(*args, **kwargs):
+            # If this is not used by a command of a guild (like the events and the background tasks), run it right away
+            guild_id = CURRENT_GUILD.get()
+            if guild_id is None:
+                return await value(*args, **kwargs)
+            # Otherwise, wait for a slot of the guild
+            async with self._scheduler.slot(guild_id) as waited:
+                self._wait.observe(value=waited)
+                return await value(*args, **kwargs)
+
+        # Save the wrapper, so is not created again
+        self.__dict__[name] = scheduled
+        return scheduled
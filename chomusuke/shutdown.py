@@ -0,0 +1,107 @@
+import asyncio
+import functools
+import logging
+import time
+
+LOGGER = logging.getLogger("chomusuke")
+# The seconds that every phase of the shutdown can take, in the order that they run
+DEADLINES = {"commands": 10, "cogs": 10, "outbound": 5, "gateway": 5, "storage": 5, "tasks": 5}
+# The extra seconds given to the phases that stop by themselves at the deadline, so they can clean up
+GRACE = 1
+
+
+async def run_phase(name: str, function, deadline: float):
+    """
+    Runs a phase of the shutdown with a time limit, logging the time taken.
+
+    Returns True if the phase finished in time.
+    :param name: The name of the phase.
+    :param function: The coroutine function of the phase, called with the deadline.
+    :param deadline: The seconds that the phase can take.
+    """
+    start = time.perf_counter()
+    try:
+        await asyncio.wait_for(function(deadline), deadline + GRACE)
+    except asyncio.TimeoutError:
+        LOGGER.warning("The shutdown phase %s did not finish in %ss", name, deadline)
+        return False
+    except Exception:
+        LOGGER.exception("The shutdown phase %s failed", name)
+        return False
+    LOGGER.info("The shutdown phase %s finished in %.3fs", name, time.perf_counter() - start)
+    return True
+
+
+async def cancel_tasks(tasks, deadline: float):
+    """
+    Cancels some tasks and waits for them to stop.
+    """
+    if not tasks:
+        return
+    for task in tasks:
+        task.cancel()
+    done, pending = await asyncio.wait(tasks, timeout=deadline)
+    # Retrieve the results, so the errors of the tasks are not reported when they are deleted
+    for task in done:
+        if not task.cancelled():
+            task.exception()
+    LOGGER.info("Cancelled %s tasks", len(tasks))
+    if pending:
+        LOGGER.warning("%s tasks did not stop after being cancelled", len(pending))
+
+
+class ShutdownCoordinator:
+    """
+    Closes the bot in phases that run one after the other, each one with a time limit.
+    """
+    def __init__(self, loop, deadlines: dict = None):
+        """
+        Initializes a new Shutdown Coordinator.
+        :param loop: The event loop of the bot.
+        :param deadlines: The seconds of specific phases, as name -> seconds.
+        """
+        self.loop = loop
+        self.deadlines = dict(DEADLINES, **(deadlines or {}))
+        # The phases as (name, coroutine function)
+        self.phases = []
+        # The task running the phases, once the shutdown has started
+        self.task = None
+
+    @property
+    def started(self):
+        """
+        If the bot is shutting down.
+        """
+        return self.task is not None
+
+    def add(self, name: str, function):
+        """
+        Adds a phase that runs after the ones already added.
+        :param name: The name of the phase, used for the deadline and the logs.
+        :param function: The coroutine function of the phase, called with the deadline.
+        """
+        self.phases.append((name, function))
+
+    async def run(self):
+        """
+        Runs the phases, or waits for them if the shutdown already started.
+        """
+        if self.task is None:
+            self.task = self.loop.create_task(self._run())
+        # If the caller is cancelled, the shutdown continues
+        await asyncio.shield(self.task)
+
+    async def _run(self):
+        LOGGER.info("Shutting down")
+        start = time.perf_counter()
+        for name, function in self.phases:
+            await run_phase(name, function, self.deadlines.get(name, 5))
+        LOGGER.info("Shutdown finished in %.3fs", time.perf_counter() - start)
+
+    async def finish(self):
+        """
+        Cancels the tasks that are still running after the shutdown, as the last phase.
+        """
+        # The phase runs on another task, so the task calling this one is excluded here
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        await run_phase("tasks", functools.partial(cancel_tasks, tasks), self.deadlines["tasks"])
@@ -0,0 +1,41 @@
+import logging
+import time
+from contextlib import contextmanager
+
+LOGGER = logging.getLogger("chomusuke")
+
+
+class StartupTimer:
+    """
+    Measures the time taken by every phase of the startup of the bot.
+    """
+    def __init__(self):
+        # The moment when the startup began
+        self.start = time.perf_counter()
+        # The phases that have finished as (name, seconds after the start, duration)
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Measures the time of the code inside of the with block.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start)
+
+    def add(self, name: str, start: float):
+        """
+        Saves a phase that began at the specified time and just finished.
+        """
+        self.phases.append((name, start - self.start, time.perf_counter() - start))
+
+    def report(self):
+        """
+        Logs the time taken by every phase.
+        """
+        LOGGER.info("Startup finished in %.3fs", time.perf_counter() - self.start)
+        for name, offset, duration in sorted(self.phases, key=lambda x: x[1]):
+            LOGGER.info("  %s: %.3fs (started at %.3fs)", name, duration, offset)
@@ -0,0 +1,24 @@
+from .base import PrefixStorage, Storage, TagStorage, WelcomeStorage
+
+
+def create_storage(backend: str, config: dict):
+    """
+    Creates the storage with the specified backend.
+    :param backend: The name of the backend: mongo, sqlite or memory.
+    :param config: The configuration of the bot.
+    """
+    # The backends are imported when selected, so their dependencies are only required when used
+    if backend == "mongo":
+        from .mongo import MongoStorage
+        return MongoStorage(config["database"], config)
+    elif backend == "sqlite":
+        from .sqlite import SQLiteStorage
+        return SQLiteStorage(config.get("sqlite", "chomusuke.db"))
+    elif backend == "memory":
+        from .memory import MemoryStorage
+        return MemoryStorage()
+    # If the backend is not known, raise an exception
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+__all__ = ["PrefixStorage", "Storage", "TagStorage", "WelcomeStorage", "create_storage"]
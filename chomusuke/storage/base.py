@@ -0,0 +1,160 @@
+import abc
+
+
+class TagStorage(abc.ABC):
+    """
+    Base class for the storage of the tags.
+
+    Tags are dicts with the keys guild_id, name, content, author, discriminator, created, edited, usage, uses and
+    last_used.
+    """
+    @abc.abstractmethod
+    async def get(self, guild_id: int, name: str):
+        """
+        Gets a single tag, or None if is not present.
+        """
+
+    @abc.abstractmethod
+    async def create(self, item: dict):
+        """
+        Saves a new tag.
+
+        Returns False if there is already a tag with the same name on the guild.
+        """
+
+    @abc.abstractmethod
+    async def delete(self, guild_id: int, name: str):
+        """
+        Deletes a tag.
+
+        Returns True if the tag was deleted.
+        """
+
+    @abc.abstractmethod
+    async def update(self, guild_id: int, name: str, values: dict):
+        """
+        Updates some values of a tag.
+
+        Returns the new version of the tag, or None if is not present.
+        """
+
+    @abc.abstractmethod
+    async def names(self, guild_id: int, after: str = None, limit: int = 50):
+        """
+        Gets the sorted names of the tags of a guild that come after a specific name.
+        """
+
+    @abc.abstractmethod
+    async def add_uses(self, uses: dict):
+        """
+        Adds the uses of multiple tags, as (guild_id, name) -> (count, last use).
+        """
+
+    @abc.abstractmethod
+    async def most_used(self, guild_id: int, limit: int = 10):
+        """
+        Gets the name, uses and last use of the most used tags of a guild.
+        """
+
+    async def search(self, guild_id: int, text: str, limit: int = 10):
+        """
+        Gets the names of the tags of a guild that contain the words of a text, the most relevant first.
+
+        Returns None if the storage can't search the tags of the guild, so the bot uses an index in memory instead.
+        """
+        return None
+
+    @abc.abstractmethod
+    def stream(self, guild_id: int = None, batch: int = 500):
+        """
+        Iterates asynchronously over the tags of a guild (or every guild), reading a batch at a time.
+        """
+
+    @abc.abstractmethod
+    async def insert_many(self, items: list, replace: bool = False):
+        """
+        Saves multiple tags at once, skipping (or replacing) the ones that already exist.
+
+        Returns the number of tags saved.
+        """
+
+
+class WelcomeStorage(abc.ABC):
+    """
+    Base class for the storage of the welcome message settings.
+
+    Settings are dicts with the keys _id (the ID of the guild), enabled, msg and channel.
+    """
+    @abc.abstractmethod
+    async def get(self, guild_id: int):
+        """
+        Gets the settings of a guild, or None if the guild has nothing configured.
+        """
+
+    @abc.abstractmethod
+    async def update(self, guild_id: int, values: dict):
+        """
+        Updates some settings of a guild and returns the new version of them.
+        """
+
+    @abc.abstractmethod
+    async def all(self):
+        """
+        Gets the settings of all of the guilds.
+        """
+
+    @abc.abstractmethod
+    def stream(self, batch: int = 500):
+        """
+        Iterates asynchronously over the settings of all of the guilds, reading a batch at a time.
+        """
+
+    @abc.abstractmethod
+    async def insert_many(self, items: list, replace: bool = False):
+        """
+        Saves the settings of multiple guilds at once, skipping (or replacing) the guilds that already have settings.
+
+        Returns the number of guilds saved.
+        """
+
+
+class PrefixStorage(abc.ABC):
+    """
+    Base class for the storage of the command prefixes of the guilds.
+    """
+    @abc.abstractmethod
+    async def all(self):
+        """
+        Gets the prefixes of all of the guilds that changed it, as guild_id -> prefix.
+        """
+
+    @abc.abstractmethod
+    async def set(self, guild_id: int, prefix: str = None):
+        """
+        Saves the prefix of a guild, or removes it if is None.
+        """
+
+
+class Storage:
+    """
+    Base class for the places where the data of the bot is stored.
+    """
+    # The name of the storage, used on the logs
+    name = "unknown"
+    # The exceptions raised when the storage can't be reached, which open the circuit breaker of the bot
+    unavailable_errors = ()
+
+    # The storage of every type of data, created by the subclasses
+    tags: TagStorage
+    welcome: WelcomeStorage
+    prefixes: PrefixStorage
+
+    async def connect(self):
+        """
+        Prepares the storage for being used.
+        """
+
+    async def close(self):
+        """
+        Closes the connections used by the storage.
+        """
@@ -0,0 +1,139 @@
+import heapq
+
+from .base import PrefixStorage, Storage, TagStorage, WelcomeStorage
+
+
+class MemoryTagStorage(TagStorage):
+    """
+    Stores the tags on a dict, only while the bot is running.
+    """
+    def __init__(self):
+        # The tags of every guild as guild_id -> name -> tag
+        self.guilds = {}
+
+    async def get(self, guild_id: int, name: str):
+        item = self.guilds.get(guild_id, {}).get(name, None)
+        return dict(item) if item else None
+
+    async def create(self, item: dict):
+        # Get the tags of the guild
+        tags = self.guilds.setdefault(item["guild_id"], {})
+        # If there is already a tag with the same name, return
+        if item["name"] in tags:
+            return False
+        # Otherwise, save a copy of it
+        tags[item["name"]] = dict(item)
+        return True
+
+    async def delete(self, guild_id: int, name: str):
+        return self.guilds.get(guild_id, {}).pop(name, None) is not None
+
+    async def update(self, guild_id: int, name: str, values: dict):
+        # Try to get the tag
+        item = self.guilds.get(guild_id, {}).get(name, None)
+        # If there is no tag, return
+        if not item:
+            return None
+        # Otherwise, update it and return a copy
+        item.update(values)
+        return dict(item)
+
+    async def names(self, guild_id: int, after: str = None, limit: int = 50):
+        names = self.guilds.get(guild_id, {}).keys()
+        return heapq.nsmallest(limit, (name for name in names if after is None or name > after))
+
+    async def add_uses(self, uses: dict):
+        for (guild_id, name), (count, last) in uses.items():
+            # Try to get the tag
+            item = self.guilds.get(guild_id, {}).get(name, None)
+            # If the tag was deleted, skip it
+            if not item:
+                continue
+            # Otherwise, add the uses
+            item["uses"] = item.get("uses", 0) + count
+            item["last_used"] = max(item.get("last_used", None) or last, last)
+
+    async def most_used(self, guild_id: int, limit: int = 10):
+        items = (item for item in self.guilds.get(guild_id, {}).values() if item.get("uses", 0))
+        return [{"name": item["name"], "uses": item["uses"], "last_used": item["last_used"]}
+                for item in heapq.nlargest(limit, items, key=lambda x: x["uses"])]
+
+    async def stream(self, guild_id: int = None, batch: int = 500):
+        guilds = [guild_id] if guild_id is not None else list(self.guilds)
+        for guild in guilds:
+            for item in list(self.guilds.get(guild, {}).values()):
+                yield dict(item)
+
+    async def insert_many(self, items: list, replace: bool = False):
+        count = 0
+        for item in items:
+            tags = self.guilds.setdefault(item["guild_id"], {})
+            if replace or item["name"] not in tags:
+                tags[item["name"]] = dict(item)
+                count += 1
+        return count
+
+
+class MemoryWelcomeStorage(WelcomeStorage):
+    """
+    Stores the welcome settings on a dict, only while the bot is running.
+    """
+    def __init__(self):
+        # The settings as guild_id -> settings
+        self.settings = {}
+
+    async def get(self, guild_id: int):
+        settings = self.settings.get(guild_id, None)
+        return dict(settings) if settings else None
+
+    async def update(self, guild_id: int, values: dict):
+        settings = self.settings.setdefault(guild_id, {"_id": guild_id})
+        settings.update(values)
+        return dict(settings)
+
+    async def all(self):
+        return [dict(settings) for settings in self.settings.values()]
+
+    async def stream(self, batch: int = 500):
+        for settings in list(self.settings.values()):
+            yield dict(settings)
+
+    async def insert_many(self, items: list, replace: bool = False):
+        count = 0
+        for item in items:
+            if replace or item["_id"] not in self.settings:
+                self.settings[item["_id"]] = dict(item)
+                count += 1
+        return count
+
+
+class MemoryPrefixStorage(PrefixStorage):
+    """
+    Stores the prefixes on a dict, only while the bot is running.
+    """
+    def __init__(self):
+        # The prefixes as guild_id -> prefix
+        self.prefixes = {}
+
+    async def all(self):
+        return dict(self.prefixes)
+
+    async def set(self, guild_id: int, prefix: str = None):
+        if prefix is None:
+            self.prefixes.pop(guild_id, None)
+        else:
+            self.prefixes[guild_id] = prefix
+
+
+class MemoryStorage(Storage):
+    """
+    Stores the data of the bot in memory, for testing and benchmarks.
+
+    Everything is lost when the bot is closed.
+    """
+    name = "Memory"
+
+    def __init__(self):
+        self.tags = MemoryTagStorage()
+        self.welcome = MemoryWelcomeStorage()
+        self.prefixes = MemoryPrefixStorage()
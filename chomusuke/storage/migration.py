@@ -0,0 +1,170 @@
+import logging
+import re
+import time
+
+from pymongo.errors import BulkWriteError
+
+LOGGER = logging.getLogger("chomusuke")
+# The pattern of the legacy collections that contain the tags of a single guild
+LEGACY_TAGS = re.compile(r"^tag_(\d+)$")
+# The Mongo error code for duplicated keys
+DUPLICATE_KEY = 11000
+
+
+def from_legacy(guild_id: int, item: dict):
+    """
+    Converts a tag stored on a legacy tag_{guild_id} collection to the format of the tags collection.
+    """
+    # Make a copy of the item without the ID
+    output = {key: value for key, value in item.items() if key != "_id"}
+    # And add the guild and name of the tag
+    output["guild_id"] = guild_id
+    output["name"] = item["_id"]
+    return output
+
+
+class TagMigration:
+    """
+    Copies the tags from the legacy per guild collections into the single tags collection.
+
+    The progress is saved after every batch on the tag_migration collection, so the migration can be resumed.
+    """
+    def __init__(self, db, batch_size: int = 500):
+        """
+        Initializes a new Tag Migration.
+        :param db: The Motor database that contains the collections.
+        :param batch_size: The number of tags copied on every batch.
+        """
+        self.db = db
+        self.batch_size = batch_size
+
+    async def legacy_guilds(self):
+        """
+        Gets the IDs of the guilds that still have a legacy collection.
+        """
+        # Get the names of all of the collections
+        names = await self.db.list_collection_names()
+        # And return the ID of the ones that match the legacy format
+        return [int(match.group(1)) for match in map(LEGACY_TAGS.match, names) if match]
+
+    async def migrated_guilds(self):
+        """
+        Gets the IDs of the guilds that have been fully migrated.
+        """
+        return {item["_id"] async for item in self.db["tag_migration"].find({"done": True}, {"_id": 1})}
+
+    async def migrate_guild(self, guild_id: int):
+        """
+        Copies and verifies the tags of a single guild.
+
+        Returns the number of tags copied.
+        """
+        # Get the legacy collection, the new one and the progress of the migration
+        legacy = self.db[f"tag_{guild_id}"]
+        tags = self.db["tags"]
+        progress = await self.db["tag_migration"].find_one({"_id": guild_id}) or {}
+
+        # If the guild was already migrated, return
+        if progress.get("done", False):
+            return 0
+
+        # Get the last tag copied, so we can resume from it
+        last = progress.get("last", None)
+        copied = 0
+
+        while True:
+            # Request the next batch of legacy tags ordered by name
+            query = {"_id": {"$gt": last}} if last is not None else {}
+            batch = await legacy.find(query).sort("_id", 1).limit(self.batch_size).to_list(None)
+            # If there are no more tags, stop the loop
+            if not batch:
+                break
+
+            # Try to insert the tags on the new collection
+            try:
+                await tags.insert_many([from_legacy(guild_id, item) for item in batch], ordered=False)
+            # Tags that are already present have been written while the bot was running, so they are newer
+            except BulkWriteError as e:
+                if any(error["code"] != DUPLICATE_KEY for error in e.details["writeErrors"]):
+                    raise
+
+            # Verify that every tag of the batch is present on the new collection
+            names = [item["_id"] for item in batch]
+            count = await tags.count_documents({"guild_id": guild_id, "name": {"$in": names}})
+            if count != len(names):
+                raise RuntimeError(f"Only {count} of {len(names)} tags of {guild_id} were found after copying them")
+
+            # Save the progress of the migration
+            last = names[-1]
+            copied += len(batch)
+            await self.db["tag_migration"].update_one({"_id": guild_id}, {"$set": {"last": last, "done": False}},
+                                                      upsert=True)
+
+        # Finally, mark the guild as migrated
+        await self.db["tag_migration"].update_one({"_id": guild_id}, {"$set": {"done": True}}, upsert=True)
+        LOGGER.info("Migrated %s tags of guild %s", copied, guild_id)
+        return copied
+
+    async def drop_legacy(self, guild_id: int):
+        """
+        Drops the legacy collection of a guild that has been fully migrated.
+        """
+        # If the guild has not been migrated, refuse to drop the collection
+        progress = await self.db["tag_migration"].find_one({"_id": guild_id}) or {}
+        if not progress.get("done", False):
+            raise RuntimeError(f"The tags of {guild_id} have not been migrated")
+        # Otherwise, drop it
+        await self.db.drop_collection(f"tag_{guild_id}")
+
+    async def storage_stats(self, guilds):
+        """
+        Gets the storage used by the legacy collections of the guilds and the tags collection.
+        """
+        # Start with empty stats
+        legacy = {"collections": 0, "indexes": 0, "size": 0, "storage": 0, "index_size": 0}
+        # For every legacy collection, add the stats
+        for guild_id in guilds:
+            stats = await self.db.command("collStats", f"tag_{guild_id}")
+            legacy["collections"] += 1
+            legacy["indexes"] += stats.get("nindexes", 0)
+            legacy["size"] += stats.get("size", 0)
+            legacy["storage"] += stats.get("storageSize", 0)
+            legacy["index_size"] += stats.get("totalIndexSize", 0)
+
+        # Then, get the stats of the tags collection
+        stats = await self.db.command("collStats", "tags")
+        current = {"collections": 1, "indexes": stats.get("nindexes", 0), "size": stats.get("size", 0),
+                   "storage": stats.get("storageSize", 0), "index_size": stats.get("totalIndexSize", 0)}
+        # And return both of them
+        return legacy, current
+
+    async def lookup_latency(self, guilds, samples: int = 100):
+        """
+        Measures the average time in milliseconds to find a single tag on the legacy and new collections.
+        """
+        legacy_time = 0
+        current_time = 0
+        count = 0
+
+        # Iterate over the guilds with legacy collections
+        for guild_id in guilds:
+            # Get some of the names of the tags
+            names = [item["_id"] async for item in self.db[f"tag_{guild_id}"].find({}, {"_id": 1}).limit(samples)]
+            # And measure the time required to find each one of them on both collections
+            for name in names:
+                start = time.perf_counter()
+                await self.db[f"tag_{guild_id}"].find_one({"_id": name})
+                legacy_time += time.perf_counter() - start
+                start = time.perf_counter()
+                await self.db["tags"].find_one({"guild_id": guild_id, "name": name})
+                current_time += time.perf_counter() - start
+                count += 1
+            # If we got enough samples, stop
+            if count >= samples:
+                break
+
+        # If there are no tags, return nothing
+        if not count:
+            return None, None
+        # Otherwise, return the averages in milliseconds
+        return legacy_time / count * 1000, current_time / count * 1000
@@ -0,0 +1,277 @@
+import logging
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, ReplaceOne, ReturnDocument, TEXT, UpdateOne
+from pymongo.errors import BulkWriteError, ConnectionFailure, DuplicateKeyError
+
+from .base import PrefixStorage, Storage, TagStorage, WelcomeStorage
+from .migration import DUPLICATE_KEY, TagMigration, from_legacy
+
+LOGGER = logging.getLogger("chomusuke")
+
+
+class MongoTagStorage(TagStorage):
+    """
+    Stores the tags on the tags collection of a MongoDB database.
+
+    Guilds that have not been migrated also read and write on their legacy tag_{guild_id} collection.
+    """
+    def __init__(self, db, migration_batch: int = 500):
+        self.db = db
+        # Save the tool for migrating the legacy tag_{guild_id} collections
+        self.migration = TagMigration(db, migration_batch)
+        # The guilds that no longer need to read from the legacy collections
+        self.migrated = set()
+
+    async def prepare(self):
+        """
+        Creates the indexes of the tags collection and loads the guilds that have been migrated.
+        """
+        # Make sure that the names of the tags are unique per guild
+        await self.db["tags"].create_index([("guild_id", ASCENDING), ("name", ASCENDING)], unique=True)
+        # Allow the most used tags to be sorted without scanning the guild
+        await self.db["tags"].create_index([("guild_id", ASCENDING), ("uses", DESCENDING)])
+        # Search the names and contents of the tags of a guild, without stemming because the tags use any language
+        await self.db["tags"].create_index([("guild_id", ASCENDING), ("name", TEXT), ("content", TEXT)],
+                                           weights={"name": 3, "content": 1}, default_language="none")
+        # And get the guilds that have been migrated
+        self.migrated = await self.migration.migrated_guilds()
+
+    async def get(self, guild_id: int, name: str):
+        # Try to get the tag from the tags collection
+        item = await self.db["tags"].find_one({"guild_id": guild_id, "name": name})
+        # If there was nothing and the guild has not been migrated, try the legacy collection
+        if not item and guild_id not in self.migrated:
+            item = await self.db[f"tag_{guild_id}"].find_one({"_id": name})
+            item = from_legacy(guild_id, item) if item else None
+        # And return whatever we got
+        return item
+
+    async def create(self, item: dict):
+        # If the tag exists on the legacy collection, return
+        if item["guild_id"] not in self.migrated and \
+                await self.db[f"tag_{item['guild_id']}"].count_documents({"_id": item["name"]}, limit=1):
+            return False
+        # Otherwise, try to add it into the collection
+        try:
+            await self.db["tags"].insert_one(dict(item))
+            return True
+        # If there is already a tag with the same name, return
+        except DuplicateKeyError:
+            return False
+
+    async def delete(self, guild_id: int, name: str):
+        # Try to delete the tag from the tags collection
+        result = await self.db["tags"].delete_one({"guild_id": guild_id, "name": name})
+        count = result.deleted_count
+        # If the guild has not been migrated, also delete it from the legacy collection
+        if guild_id not in self.migrated:
+            result = await self.db[f"tag_{guild_id}"].delete_one({"_id": name})
+            count += result.deleted_count
+        # And return if something was deleted
+        return bool(count)
+
+    async def update(self, guild_id: int, name: str, values: dict):
+        # Try to update the tag on the tags collection
+        query = {"guild_id": guild_id, "name": name}
+        result = await self.db["tags"].find_one_and_update(query, {"$set": values},
+                                                           return_document=ReturnDocument.AFTER)
+        # If the tag was updated or the guild has been migrated, return the result
+        if result or guild_id in self.migrated:
+            return result
+
+        # Otherwise, try to find the tag on the legacy collection
+        item = await self.db[f"tag_{guild_id}"].find_one({"_id": name})
+        # If there is no tag, return
+        if not item:
+            return None
+        # Otherwise, copy it into the tags collection (if the migration did not copied it already)
+        try:
+            await self.db["tags"].insert_one(from_legacy(guild_id, item))
+        except DuplicateKeyError:
+            pass
+        # And update it
+        return await self.db["tags"].find_one_and_update(query, {"$set": values},
+                                                         return_document=ReturnDocument.AFTER)
+
+    async def names(self, guild_id: int, after: str = None, limit: int = 50):
+        # Request only the names of the tags after the last one, using the index to sort and continue
+        query = {"guild_id": guild_id}
+        if after is not None:
+            query["name"] = {"$gt": after}
+        cursor = self.db["tags"].find(query, {"name": 1, "_id": 0}).sort("name", ASCENDING).limit(limit)
+        names = [tag["name"] async for tag in cursor]
+
+        # If the guild has not been migrated, merge the ones on the legacy collection
+        if guild_id not in self.migrated:
+            query = {"_id": {"$gt": after}} if after is not None else {}
+            cursor = self.db[f"tag_{guild_id}"].find(query, {"_id": 1}).sort("_id", ASCENDING).limit(limit)
+            names = sorted(set(names).union([tag["_id"] async for tag in cursor]))[:limit]
+
+        # And return the names
+        return names
+
+    async def add_uses(self, uses: dict):
+        # Create the operations for the tags collection and the legacy collections
+        operations = []
+        legacy = {}
+        for (guild_id, name), (count, last) in uses.items():
+            update = {"$inc": {"uses": count}, "$max": {"last_used": last}}
+            operations.append(UpdateOne({"guild_id": guild_id, "name": name}, update))
+            if guild_id not in self.migrated:
+                legacy.setdefault(guild_id, []).append(UpdateOne({"_id": name}, update))
+
+        # And execute them
+        await self.db["tags"].bulk_write(operations, ordered=False)
+        for guild_id, guild_operations in legacy.items():
+            await self.db[f"tag_{guild_id}"].bulk_write(guild_operations, ordered=False)
+
+    async def most_used(self, guild_id: int, limit: int = 10):
+        cursor = self.db["tags"].find({"guild_id": guild_id, "uses": {"$gt": 0}},
+                                      {"name": 1, "uses": 1, "last_used": 1, "_id": 0})
+        return await cursor.sort("uses", DESCENDING).limit(limit).to_list(None)
+
+    async def search(self, guild_id: int, text: str, limit: int = 10):
+        # The legacy collections don't have a text index, so use the index in memory for those guilds
+        if guild_id not in self.migrated:
+            return None
+        # Otherwise, let the text index find and rank the tags
+        cursor = self.db["tags"].find({"guild_id": guild_id, "$text": {"$search": text}},
+                                      {"name": 1, "_id": 0, "score": {"$meta": "textScore"}})
+        cursor = cursor.sort([("score", {"$meta": "textScore"}), ("name", ASCENDING)]).limit(limit)
+        return [tag["name"] async for tag in cursor]
+
+    async def stream(self, guild_id: int = None, batch: int = 500):
+        # Return the tags on the tags collection, fetching a batch at a time
+        query = {"guild_id": guild_id} if guild_id is not None else {}
+        async for item in self.db["tags"].find(query, {"_id": 0}).batch_size(batch):
+            yield item
+
+        # Then, the ones on the legacy collections of the guilds that have not been migrated
+        guilds = [guild_id] if guild_id is not None else await self.migration.legacy_guilds()
+        for guild in guilds:
+            if guild in self.migrated:
+                continue
+            cursor = self.db[f"tag_{guild}"].find({}).batch_size(batch)
+            while True:
+                items = await cursor.to_list(batch)
+                if not items:
+                    break
+                # Skip the tags that were already copied into the tags collection
+                query = {"guild_id": guild, "name": {"$in": [item["_id"] for item in items]}}
+                copied = {item["name"] async for item in self.db["tags"].find(query, {"name": 1})}
+                for item in items:
+                    if item["_id"] not in copied:
+                        yield from_legacy(guild, item)
+
+    async def insert_many(self, items: list, replace: bool = False):
+        if not items:
+            return 0
+        # If the tags should be replaced, do it (or insert them) with a single bulk write
+        if replace:
+            operations = [ReplaceOne({"guild_id": item["guild_id"], "name": item["name"]}, item, upsert=True)
+                          for item in items]
+            result = await self.db["tags"].bulk_write(operations, ordered=False)
+            return result.matched_count + result.upserted_count
+        # Otherwise, insert them and let the unique index skip the ones that already exist
+        try:
+            result = await self.db["tags"].insert_many([dict(item) for item in items], ordered=False)
+            return len(result.inserted_ids)
+        except BulkWriteError as e:
+            # If something other than a duplicated key failed, let it go
+            if any(error["code"] != DUPLICATE_KEY for error in e.details["writeErrors"]):
+                raise
+            return e.details["nInserted"]
+
+
+class MongoWelcomeStorage(WelcomeStorage):
+    """
+    Stores the welcome settings on the welcome collection of a MongoDB database.
+    """
+    def __init__(self, db):
+        self.db = db
+
+    async def get(self, guild_id: int):
+        return await self.db["welcome"].find_one({"_id": guild_id})
+
+    async def update(self, guild_id: int, values: dict):
+        return await self.db["welcome"].find_one_and_update({"_id": guild_id}, {"$set": values}, upsert=True,
+                                                            return_document=ReturnDocument.AFTER)
+
+    async def all(self):
+        return await self.db["welcome"].find({}).to_list(None)
+
+    async def stream(self, batch: int = 500):
+        async for item in self.db["welcome"].find({}).batch_size(batch):
+            yield item
+
+    async def insert_many(self, items: list, replace: bool = False):
+        if not items:
+            return 0
+        # If the settings should be replaced, do it with a single bulk write
+        if replace:
+            operations = [ReplaceOne({"_id": item["_id"]}, item, upsert=True) for item in items]
+            result = await self.db["welcome"].bulk_write(operations, ordered=False)
+            return result.matched_count + result.upserted_count
+        # Otherwise, insert them and skip the guilds that already have settings
+        try:
+            result = await self.db["welcome"].insert_many([dict(item) for item in items], ordered=False)
+            return len(result.inserted_ids)
+        except BulkWriteError as e:
+            # If something other than a duplicated key failed, let it go
+            if any(error["code"] != DUPLICATE_KEY for error in e.details["writeErrors"]):
+                raise
+            return e.details["nInserted"]
+
+
+class MongoPrefixStorage(PrefixStorage):
+    """
+    Stores the prefixes on the prefixes collection of a MongoDB database.
+    """
+    def __init__(self, db):
+        self.db = db
+
+    async def all(self):
+        return {item["_id"]: item["prefix"] async for item in self.db["prefixes"].find({})}
+
+    async def set(self, guild_id: int, prefix: str = None):
+        if prefix is None:
+            await self.db["prefixes"].delete_one({"_id": guild_id})
+        else:
+            await self.db["prefixes"].replace_one({"_id": guild_id}, {"_id": guild_id, "prefix": prefix}, upsert=True)
+
+
+class MongoStorage(Storage):
+    """
+    Stores the data of the bot on a MongoDB database.
+    """
+    name = "MongoDB"
+    # Raised when the server can't be selected or the connection is lost
+    unavailable_errors = (ConnectionFailure,)
+
+    def __init__(self, url: str, config: dict):
+        """
+        Initializes a new MongoDB Storage.
+        :param url: The URL of the MongoDB server.
+        :param config: The configuration of the bot.
+        """
+        # Create the Motor/MongoDB instance, waiting for a server only as long as we wait during the startup
+        timeout = int(config.get("database_timeout", 10) * 1000)
+        self.client = AsyncIOMotorClient(url, serverSelectionTimeoutMS=timeout)
+        # Save the bot database
+        self.db = self.client.chomusuke
+        # And create the storage of every type of data
+        # (the bot wraps them with time limits before connecting, so the storage of the tags is also kept as is for
+        # the index builds, which can take a long time and are not a sign of the server being down)
+        self._tags = self.tags = MongoTagStorage(self.db, config.get("tag_migration_batch", 500))
+        self.welcome = MongoWelcomeStorage(self.db)
+        self.prefixes = MongoPrefixStorage(self.db)
+
+    async def connect(self):
+        # Make sure that the the database is valid by calling a simple command
+        await self.client.admin.command("ismaster")
+        # And prepare the collections, without the wrappers of the bot
+        await self._tags.prepare()
+
+    async def close(self):
+        self.client.close()
@@ -0,0 +1,248 @@
+import sqlite3
+from datetime import datetime
+
+import aiosqlite
+
+from .base import PrefixStorage, Storage, TagStorage, WelcomeStorage
+
+# The columns of the tables, used to make sure that only known values are updated
+TAG_COLUMNS = ("guild_id", "name", "content", "author", "discriminator", "created", "edited", "usage", "uses",
+               "last_used")
+DATE_COLUMNS = ("created", "edited", "last_used")
+WELCOME_COLUMNS = ("enabled", "msg", "channel")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tags (
+    guild_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    content TEXT NOT NULL,
+    author INTEGER,
+    discriminator TEXT,
+    created TEXT,
+    edited TEXT,
+    usage TEXT,
+    uses INTEGER NOT NULL DEFAULT 0,
+    last_used TEXT,
+    PRIMARY KEY (guild_id, name)
+);
+CREATE INDEX IF NOT EXISTS tags_uses ON tags (guild_id, uses DESC);
+CREATE TABLE IF NOT EXISTS welcome (
+    guild_id INTEGER PRIMARY KEY,
+    enabled INTEGER NOT NULL DEFAULT 0,
+    msg TEXT,
+    channel INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS prefixes (
+    guild_id INTEGER PRIMARY KEY,
+    prefix TEXT NOT NULL
+);
+"""
+
+
+def to_row(values: dict, columns):
+    """
+    Converts a dict into the values of the columns that are present, with the dates as ISO 8601 text.
+    """
+    output = {}
+    for key, value in values.items():
+        # If the column is not known, refuse to continue
+        if key not in columns:
+            raise KeyError(f"Unknown column: {key}")
+        # Otherwise, save the value
+        output[key] = value.isoformat() if key in DATE_COLUMNS and value else value
+    return output
+
+
+def to_tag(row):
+    """
+    Converts a row of the tags table to a dict.
+    """
+    output = dict(zip(TAG_COLUMNS, row))
+    for key in DATE_COLUMNS:
+        output[key] = datetime.fromisoformat(output[key]) if output[key] else None
+    return output
+
+
+class SQLiteTagStorage(TagStorage):
+    """
+    Stores the tags on the tags table of a SQLite database.
+    """
+    def __init__(self, storage):
+        self.storage = storage
+
+    async def get(self, guild_id: int, name: str):
+        query = f"SELECT {', '.join(TAG_COLUMNS)} FROM tags WHERE guild_id = ? AND name = ?"
+        async with self.storage.connection.execute(query, (guild_id, name)) as cursor:
+            row = await cursor.fetchone()
+        return to_tag(row) if row else None
+
+    async def create(self, item: dict):
+        row = to_row(item, TAG_COLUMNS)
+        query = f"INSERT OR IGNORE INTO tags ({', '.join(row)}) VALUES ({', '.join('?' * len(row))})"
+        cursor = await self.storage.connection.execute(query, tuple(row.values()))
+        await self.storage.connection.commit()
+        return cursor.rowcount > 0
+
+    async def delete(self, guild_id: int, name: str):
+        cursor = await self.storage.connection.execute("DELETE FROM tags WHERE guild_id = ? AND name = ?",
+                                                       (guild_id, name))
+        await self.storage.connection.commit()
+        return cursor.rowcount > 0
+
+    async def update(self, guild_id: int, name: str, values: dict):
+        row = to_row(values, TAG_COLUMNS)
+        query = f"UPDATE tags SET {', '.join(f'{x} = ?' for x in row)} WHERE guild_id = ? AND name = ?"
+        cursor = await self.storage.connection.execute(query, (*row.values(), guild_id, name))
+        await self.storage.connection.commit()
+        return await self.get(guild_id, name) if cursor.rowcount else None
+
+    async def names(self, guild_id: int, after: str = None, limit: int = 50):
+        # If there is no name to continue from, start from the first one
+        if after is None:
+            query = "SELECT name FROM tags WHERE guild_id = ? ORDER BY name LIMIT ?"
+            parameters = (guild_id, limit)
+        else:
+            query = "SELECT name FROM tags WHERE guild_id = ? AND name > ? ORDER BY name LIMIT ?"
+            parameters = (guild_id, after, limit)
+        # And return the names
+        async with self.storage.connection.execute(query, parameters) as cursor:
+            return [row[0] for row in await cursor.fetchall()]
+
+    async def add_uses(self, uses: dict):
+        query = "UPDATE tags SET uses = uses + ?, last_used = MAX(COALESCE(last_used, ''), ?) " \
+                "WHERE guild_id = ? AND name = ?"
+        await self.storage.connection.executemany(query, [(count, last.isoformat(), guild_id, name)
+                                                          for (guild_id, name), (count, last) in uses.items()])
+        await self.storage.connection.commit()
+
+    async def most_used(self, guild_id: int, limit: int = 10):
+        query = "SELECT name, uses, last_used FROM tags WHERE guild_id = ? AND uses > 0 ORDER BY uses DESC LIMIT ?"
+        async with self.storage.connection.execute(query, (guild_id, limit)) as cursor:
+            return [{"name": name, "uses": uses, "last_used": datetime.fromisoformat(last) if last else None}
+                    for name, uses, last in await cursor.fetchall()]
+
+    async def stream(self, guild_id: int = None, batch: int = 500):
+        # Select the tags of the guild, or every tag
+        query = f"SELECT {', '.join(TAG_COLUMNS)} FROM tags"
+        parameters = ()
+        if guild_id is not None:
+            query += " WHERE guild_id = ?"
+            parameters = (guild_id,)
+        # And return them, fetching a batch of rows at a time
+        async with self.storage.connection.execute(query, parameters) as cursor:
+            while True:
+                rows = await cursor.fetchmany(batch)
+                if not rows:
+                    break
+                for row in rows:
+                    yield to_tag(row)
+
+    async def insert_many(self, items: list, replace: bool = False):
+        # Convert the tags to rows with every column, since all of them are inserted with the same query
+        rows = []
+        for item in items:
+            row = to_row(item, TAG_COLUMNS)
+            row["uses"] = row.get("uses", None) or 0
+            rows.append(tuple(row.get(column, None) for column in TAG_COLUMNS))
+        # And insert them on a single transaction
+        query = f"INSERT OR {'REPLACE' if replace else 'IGNORE'} INTO tags ({', '.join(TAG_COLUMNS)}) " \
+                f"VALUES ({', '.join('?' * len(TAG_COLUMNS))})"
+        cursor = await self.storage.connection.executemany(query, rows)
+        await self.storage.connection.commit()
+        return cursor.rowcount
+
+
+class SQLiteWelcomeStorage(WelcomeStorage):
+    """
+    Stores the welcome settings on the welcome table of a SQLite database.
+    """
+    def __init__(self, storage):
+        self.storage = storage
+
+    async def get(self, guild_id: int):
+        query = "SELECT guild_id, enabled, msg, channel FROM welcome WHERE guild_id = ?"
+        async with self.storage.connection.execute(query, (guild_id,)) as cursor:
+            row = await cursor.fetchone()
+        return {"_id": row[0], "enabled": bool(row[1]), "msg": row[2], "channel": row[3]} if row else None
+
+    async def update(self, guild_id: int, values: dict):
+        row = to_row(values, WELCOME_COLUMNS)
+        await self.storage.connection.execute("INSERT OR IGNORE INTO welcome (guild_id) VALUES (?)", (guild_id,))
+        await self.storage.connection.execute(f"UPDATE welcome SET {', '.join(f'{x} = ?' for x in row)} "
+                                              f"WHERE guild_id = ?", (*row.values(), guild_id))
+        await self.storage.connection.commit()
+        return await self.get(guild_id)
+
+    async def all(self):
+        async with self.storage.connection.execute("SELECT guild_id, enabled, msg, channel FROM welcome") as cursor:
+            return [{"_id": row[0], "enabled": bool(row[1]), "msg": row[2], "channel": row[3]}
+                    for row in await cursor.fetchall()]
+
+    async def stream(self, batch: int = 500):
+        async with self.storage.connection.execute("SELECT guild_id, enabled, msg, channel FROM welcome") as cursor:
+            while True:
+                rows = await cursor.fetchmany(batch)
+                if not rows:
+                    break
+                for row in rows:
+                    yield {"_id": row[0], "enabled": bool(row[1]), "msg": row[2], "channel": row[3]}
+
+    async def insert_many(self, items: list, replace: bool = False):
+        rows = [(item["_id"], bool(item.get("enabled", False)), item.get("msg", None), item.get("channel", 0) or 0)
+                for item in items]
+        query = f"INSERT OR {'REPLACE' if replace else 'IGNORE'} INTO welcome (guild_id, enabled, msg, channel) " \
+                f"VALUES (?, ?, ?, ?)"
+        cursor = await self.storage.connection.executemany(query, rows)
+        await self.storage.connection.commit()
+        return cursor.rowcount
+
+
+class SQLitePrefixStorage(PrefixStorage):
+    """
+    Stores the prefixes on the prefixes table of a SQLite database.
+    """
+    def __init__(self, storage):
+        self.storage = storage
+
+    async def all(self):
+        async with self.storage.connection.execute("SELECT guild_id, prefix FROM prefixes") as cursor:
+            return {row[0]: row[1] for row in await cursor.fetchall()}
+
+    async def set(self, guild_id: int, prefix: str = None):
+        if prefix is None:
+            await self.storage.connection.execute("DELETE FROM prefixes WHERE guild_id = ?", (guild_id,))
+        else:
+            await self.storage.connection.execute("INSERT OR REPLACE INTO prefixes (guild_id, prefix) VALUES (?, ?)",
+                                                  (guild_id, prefix))
+        await self.storage.connection.commit()
+
+
+class SQLiteStorage(Storage):
+    """
+    Stores the data of the bot on a local SQLite database.
+    """
+    name = "SQLite"
+    # Raised when the database is locked or the file can't be read
+    unavailable_errors = (sqlite3.OperationalError,)
+
+    def __init__(self, path: str):
+        """
+        Initializes a new SQLite Storage.
+        :param path: The path of the database file.
+        """
+        self.path = path
+        self.connection = None
+        self.tags = SQLiteTagStorage(self)
+        self.welcome = SQLiteWelcomeStorage(self)
+        self.prefixes = SQLitePrefixStorage(self)
+
+    async def connect(self):
+        # Open the database file
+        self.connection = await aiosqlite.connect(self.path)
+        # And make sure that the tables exist
+        await self.connection.executescript(SCHEMA)
+        await self.connection.commit()
+
+    async def close(self):
+        if self.connection:
+            await self.connection.close()
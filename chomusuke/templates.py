@@ -0,0 +1,219 @@
+import functools
+import operator
+import re
+
+from .exceptions import TemplateError
+
+# The variables that can be used on the templates
+VARIABLES = ("user", "guild", "member_count", "channel")
+# The variables that can be compared with numbers
+NUMBERS = ("member_count",)
+# The pattern used to find the blocks between braces
+BLOCK = re.compile(r"\{([^{}\n]*)\}")
+# The pattern of the conditions, like "if member_count >= 100" or "if not channel"
+CONDITION = re.compile(r"^if\s+(not\s+)?(\w+)(?:\s*(==|!=|<=|>=|<|>)\s*(-?\d+))?$")
+# The operators that can be used on the conditions
+OPERATORS = {"==": operator.eq, "!=": operator.ne, "<=": operator.le, ">=": operator.ge, "<": operator.lt,
+             ">": operator.gt}
+
+
+class _Variable:
+    """
+    A variable replaced with their value when the template is rendered.
+    """
+    __slots__ = ("name",)
+
+    def __init__(self, name: str):
+        self.name = name
+
+
+class _Condition:
+    """
+    A block of the template that is only rendered if a condition is met.
+    """
+    __slots__ = ("name", "negate", "op", "number", "then", "otherwise")
+
+    def __init__(self, name: str, negate: bool, op: str, number: int):
+        self.name = name
+        self.negate = negate
+        self.op = op
+        self.number = number
+        self.then = []
+        self.otherwise = []
+
+
+def parse(text: str):
+    """
+    Parses the text of a template into a list of strings, variables and conditions.
+
+    The blocks between braces that are not variables or conditions are left as they are, so code snippets can be used.
+    """
+    # The nodes of the template, and the conditions that have not been closed as [condition, parent nodes, on else]
+    nodes = []
+    stack = []
+    current = nodes
+    position = 0
+
+    for match in BLOCK.finditer(text):
+        block = match.group(1).strip()
+        # Add the text before the block
+        if match.start() > position:
+            current.append(text[position:match.start()])
+        position = match.end()
+
+        # If this is a variable, add it
+        if block in VARIABLES:
+            current.append(_Variable(block))
+        # If this is a condition, open a new branch
+        elif block.startswith("if ") or block == "if":
+            condition = CONDITION.match(block)
+            if not condition:
+                raise TemplateError(f"The condition `{{{block}}}` is not valid")
+            negate, name, op, number = condition.groups()
+            if name not in VARIABLES:
+                raise TemplateError(f"The variable `{name}` does not exists")
+            if op and name not in NUMBERS:
+                raise TemplateError(f"The variable `{name}` is not a number")
+            node = _Condition(name, bool(negate), op, int(number) if number else None)
+            current.append(node)
+            stack.append([node, current, False])
+            current = node.then
+        # If this is the else of a condition, continue on the other branch
+        elif block == "else":
+            if not stack or stack[-1][2]:
+                raise TemplateError("There is an `{else}` without an `{if}`")
+            stack[-1][2] = True
+            current = stack[-1][0].otherwise
+        # If this is the end of a condition, go back to the branch where the condition is
+        elif block == "end":
+            if not stack:
+                raise TemplateError("There is an `{end}` without an `{if}`")
+            current = stack.pop()[1]
+        # Otherwise, this is just text
+        else:
+            current.append(match.group(0))
+
+    # Add the text after the last block
+    if position < len(text):
+        current.append(text[position:])
+    # And make sure that every condition was closed
+    if stack:
+        raise TemplateError("There is an `{if}` without an `{end}`")
+    return nodes
+
+
+def _compile_nodes(nodes):
+    """
+    Converts a list of nodes into a function that renders them with a dict of values.
+    """
+    # If there are no conditions, use a format string
+    if not any(isinstance(node, _Condition) for node in nodes):
+        parts = []
+        for node in nodes:
+            if isinstance(node, _Variable):
+                parts.append("{" + node.name + "}")
+            else:
+                parts.append(node.replace("{", "{{").replace("}", "}}"))
+        return "".join(parts).format_map
+
+    # Otherwise, split the nodes on the conditions and join the results when rendering
+    renderers = []
+    plain = []
+    for node in nodes:
+        if isinstance(node, _Condition):
+            if plain:
+                renderers.append(_compile_nodes(plain))
+                plain = []
+            renderers.append(_compile_condition(node))
+        else:
+            plain.append(node)
+    if plain:
+        renderers.append(_compile_nodes(plain))
+    return lambda values: "".join([render(values) for render in renderers])
+
+
+def _compile_condition(node: _Condition):
+    """
+    Converts a condition into a function that renders the correct branch.
+    """
+    then = _compile_nodes(node.then)
+    otherwise = _compile_nodes(node.otherwise)
+    name = node.name
+    negate = node.negate
+    number = node.number
+    test = OPERATORS[node.op] if node.op else None
+
+    def render(values):
+        value = values[name]
+        result = test(value or 0, number) if test else bool(value)
+        return then(values) if result != negate else otherwise(values)
+
+    return render
+
+
+class Template:
+    """
+    A text with variables and conditions that has been parsed and compiled.
+    """
+    __slots__ = ("source", "variables", "_render")
+
+    def __init__(self, source: str, nodes=None):
+        """
+        Initializes a new Template.
+        :param source: The text of the template.
+        :param nodes: The parsed nodes, or None to use the text as is.
+        """
+        self.source = source
+        # Save the variables used, so the callers can know if the user is already mentioned
+        self.variables = set(_find_variables(nodes or []))
+        self._render = _compile_nodes(nodes) if nodes is not None else None
+
+    def render(self, user=None, guild=None, member_count=None, channel=None):
+        """
+        Renders the template with the specified values.
+        """
+        if self._render is None:
+            return self.source
+        return self._render({"user": user, "guild": guild, "member_count": member_count, "channel": channel})
+
+
+def _find_variables(nodes):
+    """
+    Gets the names of the variables used by some nodes.
+    """
+    for node in nodes:
+        if isinstance(node, _Variable):
+            yield node.name
+        elif isinstance(node, _Condition):
+            yield node.name
+            yield from _find_variables(node.then)
+            yield from _find_variables(node.otherwise)
+
+
+def validate(text: str):
+    """
+    Checks that a template is valid, raising a TemplateError if is not.
+    """
+    parse(text)
+
+
+@functools.lru_cache(maxsize=4096)
+def compile_template(text: str):
+    """
+    Compiles the text of a template, using it as is if is not valid.
+
+    The templates are cached by their text, so a template is only parsed once until is edited.
+    """
+    try:
+        return Template(text, parse(text))
+    except TemplateError:
+        return Template(text)
+
+
+def render_for(template: Template, member, channel):
+    """
+    Renders a template for a member (or user) of a guild channel.
+    """
+    guild = getattr(channel, "guild", None)
+    return template.render(member.mention, guild.name if guild else None, guild.member_count if guild else None,
+                           getattr(channel, "mention", None))
@@ -0,0 +1,200 @@
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+from datetime import datetime, timezone
+
+from .storage import create_storage
+
+LOGGER = logging.getLogger("chomusuke")
+# The fields of the tags and welcome settings that are exported, and the ones that are dates
+TAG_FIELDS = ("guild_id", "name", "content", "author", "discriminator", "created", "edited", "usage", "uses",
+              "last_used")
+WELCOME_FIELDS = ("_id", "enabled", "msg", "channel")
+DATE_FIELDS = ("created", "edited", "last_used")
+
+
+def encode(kind: str, document: dict):
+    """
+    Converts a tag or welcome settings into a line of NDJSON, like {"type": "tag", "guild_id": 1, ...}.
+    """
+    fields = TAG_FIELDS if kind == "tag" else WELCOME_FIELDS
+    output = {"type": kind}
+    for key in fields:
+        value = document.get(key, None)
+        output[key] = value.isoformat() if key in DATE_FIELDS and value else value
+    return json.dumps(output, ensure_ascii=False) + "\n"
+
+
+def decode(line: str):
+    """
+    Converts a line of NDJSON into the type of document and the document itself.
+    """
+    data = json.loads(line)
+    kind = data.pop("type", None)
+    if kind not in ("tag", "welcome"):
+        raise ValueError(f"Unknown type of document: {kind}")
+    fields = TAG_FIELDS if kind == "tag" else WELCOME_FIELDS
+    document = {key: data.get(key, None) for key in fields}
+    for key in DATE_FIELDS:
+        if document.get(key, None):
+            document[key] = datetime.fromisoformat(document[key])
+    # Make sure that the required values are present
+    if kind == "tag" and (document["guild_id"] is None or not document["name"] or document["content"] is None):
+        raise ValueError("The tag needs a guild_id, name and content")
+    if kind == "welcome" and document["_id"] is None:
+        raise ValueError("The welcome settings need an _id")
+    # And fill the dates that the bot expects on every tag, using the time of the import when they are missing
+    if kind == "tag":
+        document["created"] = document["created"] or datetime.now(timezone.utc)
+        document["uses"] = document["uses"] or 0
+        if document["uses"] and not document["last_used"]:
+            document["last_used"] = document["created"]
+    return kind, document
+
+
+async def export_data(storage, file, guild_id: int = None, batch: int = 500, progress=None):
+    """
+    Writes the tags and welcome settings of a guild (or every guild) into a file as NDJSON.
+
+    Returns the number of tags and welcome settings written.
+    :param storage: The storage where the data is read from.
+    :param file: The text file where the lines are written.
+    :param guild_id: The guild to export, or None for every guild.
+    :param batch: The number of documents requested at the same time.
+    :param progress: The function called with the type and number of documents after every batch.
+    """
+    counts = {"tag": 0, "welcome": 0}
+    # Write the tags as they are received
+    async for item in storage.tags.stream(guild_id, batch):
+        file.write(encode("tag", item))
+        counts["tag"] += 1
+        if progress and not counts["tag"] % batch:
+            progress("tag", counts["tag"])
+    # And do the same with the welcome settings
+    async for item in storage.welcome.stream(batch):
+        if guild_id is not None and item["_id"] != guild_id:
+            continue
+        file.write(encode("welcome", item))
+        counts["welcome"] += 1
+        if progress and not counts["welcome"] % batch:
+            progress("welcome", counts["welcome"])
+    return counts
+
+
+async def import_data(storage, lines, guild_id: int = None, batch: int = 500, replace: bool = False,
+                      progress=None):
+    """
+    Saves the tags and welcome settings from some lines of NDJSON, in batches.
+
+    Returns the number of documents read and saved, and the number of invalid lines.
+    :param storage: The storage where the data is saved.
+    :param lines: The lines to read, like a text file.
+    :param guild_id: The guild where the data is saved instead of the original one, or None to keep them.
+    :param batch: The number of documents saved at the same time.
+    :param replace: If the documents that already exist should be replaced.
+    :param progress: The function called with the type and number of documents after every batch.
+    """
+    counts = {"read": 0, "saved": 0, "invalid": 0}
+    pending = {"tag": [], "welcome": []}
+    targets = {"tag": storage.tags, "welcome": storage.welcome}
+
+    async def flush(kind):
+        counts["saved"] += await targets[kind].insert_many(pending[kind], replace)
+        pending[kind] = []
+        if progress:
+            progress(kind, counts["read"])
+
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        # Parse the line, skipping the ones that are not valid
+        try:
+            kind, document = decode(line)
+        except ValueError as e:
+            LOGGER.warning("Skipping line %s: %s", number, e.args[0])
+            counts["invalid"] += 1
+            continue
+        # Move the document to another guild, if requested
+        if guild_id is not None:
+            document["guild_id" if kind == "tag" else "_id"] = guild_id
+        # And add it to the batch, saving it once is full
+        counts["read"] += 1
+        pending[kind].append(document)
+        if len(pending[kind]) >= batch:
+            await flush(kind)
+
+    # Save the remaining documents
+    for kind, documents in pending.items():
+        if documents:
+            await flush(kind)
+    return counts
+
+
+def parse_args():
+    """
+    Parses the command line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Exports and imports the tags and welcome settings as NDJSON.")
+    parser.add_argument("action", choices=("export", "import"), help="what to do with the data")
+    parser.add_argument("file", help="the NDJSON file to write or read, or - for STDOUT/STDIN")
+    parser.add_argument("--storage", choices=("mongo", "sqlite", "memory"), default="mongo",
+                        help="the storage where the data is saved")
+    parser.add_argument("--database", default="", help="the URL of the MongoDB server")
+    parser.add_argument("--sqlite", default="chomusuke.db", help="the SQLite database file")
+    parser.add_argument("--guild", type=int, default=None,
+                        help="the guild to export, or the guild where the data is imported")
+    parser.add_argument("--batch", type=int, default=500, help="the number of documents read or saved at once")
+    parser.add_argument("--replace", action="store_true", help="if the existing documents should be replaced")
+    return parser.parse_args()
+
+
+async def run(args):
+    """
+    Exports or imports the data with the command line arguments.
+    """
+    start = time.perf_counter()
+
+    def progress(kind, count):
+        elapsed = time.perf_counter() - start
+        print(f"{count} documents ({kind}) in {elapsed:.1f}s ({count / elapsed:.0f}/s)", file=sys.stderr)
+
+    # Connect to the storage
+    storage = create_storage(args.storage, {"database": args.database, "sqlite": args.sqlite})
+    await storage.connect()
+    try:
+        # Export or import the data
+        if args.action == "export":
+            file = sys.stdout if args.file == "-" else open(args.file, "w", encoding="utf-8")
+            try:
+                counts = await export_data(storage, file, args.guild, args.batch, progress)
+            finally:
+                if file is not sys.stdout:
+                    file.close()
+        else:
+            file = sys.stdin if args.file == "-" else open(args.file, encoding="utf-8")
+            try:
+                counts = await import_data(storage, file, args.guild, args.batch, args.replace, progress)
+            finally:
+                if file is not sys.stdin:
+                    file.close()
+    finally:
+        await storage.close()
+    # And show the results
+    elapsed = time.perf_counter() - start
+    print(f"Finished in {elapsed:.2f}s: " + ", ".join(f"{value} {key}" for key, value in counts.items()),
+          file=sys.stderr)
+
+
+def main():
+    """
+    Exports or imports the data from the command line.
+    """
+    logging.basicConfig(level=logging.INFO, format="[%(asctime)s] [%(levelname)s] %(message)s")
+    asyncio.get_event_loop().run_until_complete(run(parse_args()))
+
+
+if __name__ == "__main__":
+    main()